@@ -0,0 +1,148 @@
+"""
+Admission control for inference-bound endpoints.
+
+At most ADMISSION_MAX_CONCURRENT requests run inference at once; up to
+ADMISSION_MAX_QUEUE more wait in line per lane. A request that cannot start within
+ADMISSION_QUEUE_TIMEOUT_MS (or finds the queue full) fails fast with 503 and
+a Retry-After header instead of piling onto an overloaded worker, so admitted
+requests keep predictable latency.
+
+Two lanes share the slots: "interactive" (chatbot queries) and "bulk"
+(uploads). Each lane has its own queue, waiting interactive requests are
+always admitted first, and ADMISSION_RESERVED_INTERACTIVE slots can only be
+used by them, so a burst of uploads cannot starve chat.
+"""
+import functools
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from flask import jsonify, request
+
+import metrics
+
+ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "4"))
+MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT_MS = int(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS", "10000"))
+RESERVED_INTERACTIVE = int(os.environ.get("ADMISSION_RESERVED_INTERACTIVE", "1"))
+
+LANES = ("interactive", "bulk")
+
+metrics.describe("admission_rejected_total", "Requests turned away by admission control")
+metrics.describe("admission_wait_seconds", "Time requests spent queued for admission")
+
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted; retry_after is in seconds"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency plus a bounded, deadline-limited, two-lane wait queue"""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE,
+                 queue_timeout_ms=QUEUE_TIMEOUT_MS, reserved_interactive=RESERVED_INTERACTIVE):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        # Never reserve every slot, bulk work must still be able to run
+        self.reserved_interactive = min(max(0, reserved_interactive), self.max_concurrent - 1)
+        self.running = 0
+        self.queues = {lane: deque() for lane in LANES}
+        self.service_seconds = 1.0    # moving average of time spent holding a slot
+        self._cond = threading.Condition()
+
+    def _limit(self, lane):
+        if lane == "bulk":
+            return self.max_concurrent - self.reserved_interactive
+        return self.max_concurrent
+
+    def _can_start(self, lane, ticket=None):
+        """Whether ticket (or, without one, a new arrival) may take a slot now"""
+        if self.running >= self._limit(lane):
+            return False
+        if lane == "bulk" and self.queues["interactive"]:
+            return False
+        queue = self.queues[lane]
+        return not queue if ticket is None else queue[0] is ticket
+
+    def _retry_after(self):
+        """Rough seconds until a slot frees up for a new arrival"""
+        queued = sum(len(q) for q in self.queues.values())
+        return max(1, math.ceil(self.service_seconds * (queued + 1) / self.max_concurrent))
+
+    def acquire(self, lane="bulk"):
+        """Block until admitted; returns seconds spent queued or raises Overloaded"""
+        start = time.perf_counter()
+        deadline = start + self.queue_timeout
+        ticket = object()
+        with self._cond:
+            # A free slot admits right away, however full the other lane's queue is
+            if self._can_start(lane):
+                self.running += 1
+                return time.perf_counter() - start
+            queue = self.queues[lane]
+            if len(queue) >= self.max_queue:
+                raise Overloaded(self._retry_after(), "queue full")
+            queue.append(ticket)
+            try:
+                while not self._can_start(lane, ticket):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise Overloaded(self._retry_after(), "queue timeout")
+                    self._cond.wait(remaining)
+            finally:
+                queue.remove(ticket)
+                # Whoever is next may now be at the head of a lane
+                self._cond.notify_all()
+            self.running += 1
+        return time.perf_counter() - start
+
+    def release(self, held_seconds):
+        with self._cond:
+            self.running -= 1
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * held_seconds
+            self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            return {
+                "running": self.running,
+                "max_concurrent": self.max_concurrent,
+                "queued": {lane: len(q) for lane, q in self.queues.items()},
+                "max_queue": self.max_queue,
+            }
+
+
+controller = AdmissionController()
+
+
+def admission_controlled(lane="bulk"):
+    """Decorator for Flask views that run inference; returns 503 + Retry-After when overloaded"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return view(*args, **kwargs)
+            endpoint = request.url_rule.rule if request.url_rule else view.__name__
+            try:
+                waited = controller.acquire(lane)
+            except Overloaded as e:
+                metrics.inc("admission_rejected_total", endpoint=endpoint, lane=lane, reason=str(e))
+                response = jsonify({'error': 'Server busy, please retry shortly', 'retry_after': e.retry_after})
+                return response, 503, {'Retry-After': str(e.retry_after)}
+
+            metrics.observe("admission_wait_seconds", waited, endpoint=endpoint, lane=lane)
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                controller.release(time.perf_counter() - start)
+        return wrapper
+    return decorator
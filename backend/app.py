@@ -1,15 +1,29 @@
 import os
+import io
 import datetime
 import hashlib
-from flask import Flask, request, jsonify, send_from_directory
+import time
+from flask import Flask, request, jsonify, send_from_directory, g, Response, abort
 from flask_cors import CORS
 import psycopg2
+from psycopg2.extras import execute_values
 from PIL import Image
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-from transformers import pipeline
+import admission
+import blob_store
+import duplicate_cleanup
+import memory_accounting
+import metrics
+import model_registry
+import near_duplicates
+from admission import admission_controlled
+from classification import (
+    classify_all_attributes_efficient, classify_all_attributes_batch, classify_with_confidence_boost
+)
 from chatbot_routes import chatbot_bp
-from per_user_index import add_image_for_user
+from per_user_index import add_image_for_user, add_images_for_user, remove_path, set_item_attributes
+from outfits import recommend_outfits
 from flask import send_from_directory
 
 UPLOAD_FOLDER = 'uploaded_images'
@@ -18,12 +32,58 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # Initialize Flask App
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024  # 8MB upload limit
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024  # 8MB upload limit
+MAX_BATCH_IMAGES = 50
+MAX_BATCH_UPLOAD_BYTES = 64 * 1024 * 1024  # whole /classify-batch request
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 CORS(app)
 
 # Register chatbot blueprint
 app.register_blueprint(chatbot_bp)
 
+
+# Only /classify-batch may exceed the single-upload limit. Werkzeug enforces
+# the limit while reading the body, so chunked requests are covered too.
+@app.before_request
+def _allow_large_batches():
+    if request.endpoint == 'classify_batch':
+        request.max_content_length = MAX_BATCH_UPLOAD_BYTES
+
+
+@app.errorhandler(413)
+def _upload_too_large(e):
+    return jsonify({'error': 'Upload too large'}), 413
+
+
+# Per-endpoint request timing (no-op unless METRICS_ENABLED=1)
+@app.before_request
+def _start_request_timer():
+    if metrics.ENABLED:
+        g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    if metrics.ENABLED and 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('request_duration_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+        metrics.inc('requests_total', endpoint=endpoint, status=response.status_code)
+    return response
+
+
+# Per-endpoint memory accounting (no-op unless MEMORY_PROFILING=1)
+@app.before_request
+def _start_memory_accounting():
+    if memory_accounting.ENABLED:
+        g.memory_start = memory_accounting.request_started()
+
+
+@app.teardown_request
+def _record_memory_accounting(exc):
+    if memory_accounting.ENABLED and 'memory_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        memory_accounting.request_finished(endpoint, g.memory_start)
+
 # PostgreSQL connection
 conn = psycopg2.connect(
     dbname=os.environ.get("DB_NAME", "loga"),
@@ -42,36 +102,30 @@ except Exception as e:
     print(f"Error adding favorite column: {e}")
     conn.rollback()
 
-# Load zero-shot classification pipeline
-classifier = pipeline("zero-shot-image-classification", model="openai/clip-vit-base-patch32")
-
-
-# Improved prompt-engineered categories for better CLIP performance
-POSITION_CATEGORIES = [
-    "upper body clothing, shirt, blouse, top",
-    "lower body clothing, pants, skirt, trousers",
-    "full body clothing, dress, gown, jumpsuit"
-]
-
-STYLE_CATEGORIES = [
-    "formal business attire, professional clothing, office wear",
-    "traditional ethnic clothing, cultural dress, heritage wear",
-    "casual everyday clothing, relaxed wear, comfortable outfit"
-]
-
-COLOR_CATEGORIES = [
-    "red clothing, red dress, red shirt",
-    "blue clothing, blue dress, blue shirt", 
-    "green clothing, green dress, green shirt",
-    "black clothing, black dress, black shirt",
-    "white clothing, white dress, white shirt",
-    "yellow clothing, yellow dress, yellow shirt",
-    "orange clothing, orange dress, orange shirt",
-    "purple clothing, purple dress, purple shirt",
-    "brown clothing, brown dress, brown shirt",
-    "pink clothing, pink dress, pink shirt",
-    "gray clothing, gray dress, gray shirt"
-]
+# Perceptual hash for near-duplicate detection
+try:
+    cur.execute("ALTER TABLE uploads ADD COLUMN IF NOT EXISTS phash BIGINT")
+    conn.commit()
+except Exception as e:
+    print(f"Error adding phash column: {e}")
+    conn.rollback()
+
+# Lets per-user duplicate checks and cleanup read only that user's rows
+try:
+    cur.execute("CREATE INDEX IF NOT EXISTS uploads_user_path_id ON uploads (username, image_path, id)")
+    conn.commit()
+except Exception as e:
+    print(f"Error creating uploads index: {e}")
+    conn.rollback()
+
+if memory_accounting.ENABLED:
+    memory_accounting.start()
+
+# Optionally load all models in the background right after startup
+WARM_UP_MODELS = os.environ.get("WARM_UP_MODELS", "0") == "1"
+if WARM_UP_MODELS:
+    model_registry.warm_up_in_background()
+
 
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
 
@@ -80,338 +134,41 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-# Enhanced classification function with better prompt handling
-def classify_attribute(image, categories, clean=False):
-    """Classify attribute using CLIP with improved prompt engineering."""
-    try:
-        results = classifier(images=image, candidate_labels=categories)
-        if results and len(results) > 0:
-            # Sort by confidence score
-            sorted_results = sorted(results, key=lambda x: x['score'], reverse=True)
-            top_result = sorted_results[0]
-            
-            # Very low threshold to ensure we get results
-            if top_result['score'] > 0.05:  # Much lower threshold
-                label = top_result['label']
-                
-                if clean:  # Map back to simple labels for JSON response
-                    if "color" in label:
-                        # Extract color from prompt with more flexible matching
-                        color_map = {
-                            "red": "red", "blue": "blue", "green": "green", 
-                            "black": "black", "white": "white", "yellow": "yellow",
-                            "orange": "orange", "purple": "purple", "brown": "brown",
-                            "pink": "pink", "gray": "gray"
-                        }
-                        for color, clean_color in color_map.items():
-                            if color in label.lower():
-                                return clean_color
-                        # If no color found, return most common
-                        return "black"
-                    elif "clothing" in label or "garment" in label:
-                        if any(word in label.lower() for word in ["upper", "shirt", "blouse", "top", "t-shirt"]):
-                            return "upper"
-                        elif any(word in label.lower() for word in ["lower", "pants", "skirt", "trousers", "jeans"]):
-                            return "lower"
-                        elif any(word in label.lower() for word in ["full", "dress", "gown", "jumpsuit", "onesie"]):
-                            return "full"
-                        # Default to upper body if unclear
-                        return "upper"
-                    elif any(word in label.lower() for word in ["formal", "business", "professional", "office", "corporate", "attire"]):
-                        return "formal"
-                    elif any(word in label.lower() for word in ["traditional", "ethnic", "cultural", "heritage", "ceremonial"]):
-                        return "traditional"
-                    elif any(word in label.lower() for word in ["casual", "everyday", "relaxed", "comfortable", "street", "outfit"]):
-                        return "casual"
-                    # Default to casual if unclear
-                    return "casual"
-                
-                return label
-            else:
-                # Return sensible defaults instead of unknown
-                if "color" in categories[0]:
-                    return "black"
-                elif "clothing" in categories[0]:
-                    return "upper"
-                else:
-                    return "casual"
-        # Return sensible defaults instead of unknown
-        if "color" in categories[0]:
-            return "black"
-        elif "clothing" in categories[0]:
-            return "upper"
-        else:
-            return "casual"
-    except Exception as e:
-        print(f"Classification error: {e}")
-        # Return sensible defaults instead of unknown
-        if "color" in categories[0]:
-            return "black"
-        elif "clothing" in categories[0]:
-            return "upper"
-        else:
-            return "casual"
-
+def _load_user_phashes(username):
+    cur.execute("SELECT id, phash FROM uploads WHERE username = %s AND phash IS NOT NULL", (username,))
+    return [(row[0], near_duplicates.from_signed(row[1])) for row in cur.fetchall()]
 
-def classify_all_attributes_efficient(image):
-    """Efficiently classify all attributes in a single CLIP call for better performance."""
-    try:
-        # Combine all categories into one comprehensive classification
-        all_categories = []
-        
-        # Position categories
-        all_categories.extend([
-            "upper body shirt blouse top",
-            "lower body pants skirt trousers", 
-            "full body dress gown jumpsuit"
-        ])
-        
-        # Style categories
-        all_categories.extend([
-            "formal business professional office",
-            "traditional ethnic cultural heritage",
-            "casual everyday relaxed comfortable"
-        ])
-        
-        # Color categories
-        all_categories.extend([
-            "red clothing", "blue clothing", "green clothing",
-            "black clothing", "white clothing", "yellow clothing",
-            "orange clothing", "purple clothing", "brown clothing",
-            "pink clothing", "gray clothing"
-        ])
-        
-        # Single CLIP call for all categories
-        results = classifier(images=image, candidate_labels=all_categories)
-        
-        if not results or len(results) == 0:
-            # Return sensible defaults instead of unknown
-            return {"position": "upper", "style": "casual", "color": "black"}
-        
-        # Sort by confidence score
-        sorted_results = sorted(results, key=lambda x: x['score'], reverse=True)
-        
-        # Initialize results with defaults instead of unknown
-        classification = {"position": "upper", "style": "casual", "color": "black"}
-        
-        # Process results with very low threshold for better coverage
-        for result in sorted_results:
-            if result['score'] < 0.05:  # Very low threshold
-                continue
-                
-            label = result['label'].lower()
-            
-            # Determine position with more flexible matching
-            if any(word in label for word in ["upper", "shirt", "blouse", "top", "t-shirt", "garment"]):
-                classification["position"] = "upper"
-            elif any(word in label for word in ["lower", "pants", "skirt", "trousers", "jeans", "garment"]):
-                classification["position"] = "lower"
-            elif any(word in label for word in ["full", "dress", "gown", "jumpsuit", "onesie", "garment"]):
-                classification["position"] = "full"
-            
-            # Determine style with more flexible matching
-            if any(word in label for word in ["formal", "business", "professional", "office", "corporate", "attire"]):
-                classification["style"] = "formal"
-            elif any(word in label for word in ["traditional", "ethnic", "cultural", "heritage", "ceremonial"]):
-                classification["style"] = "traditional"
-            elif any(word in label for word in ["casual", "everyday", "relaxed", "comfortable", "street", "outfit"]):
-                classification["style"] = "casual"
-            
-            # Determine color with more flexible matching
-            color_map = {
-                "red": "red", "blue": "blue", "green": "green",
-                "black": "black", "white": "white", "yellow": "yellow",
-                "orange": "orange", "purple": "purple", "brown": "brown",
-                "pink": "pink", "gray": "gray"
-            }
-            for color, clean_color in color_map.items():
-                if color in label:
-                    classification["color"] = clean_color
-                    break
-        
-        return classification
-        
-    except Exception as e:
-        print(f"Multi-attribute classification error: {e}")
-        # Return sensible defaults instead of unknown
-        return {"position": "upper", "style": "casual", "color": "black"}
-
-
-def generate_enhanced_prompts():
-    """Generate enhanced prompts with better CLIP performance."""
-    return {
-        "position": [
-            "upper body garment, shirt, blouse, top, t-shirt",
-            "lower body garment, pants, skirt, trousers, jeans",
-            "full body garment, dress, gown, jumpsuit, onesie"
-        ],
-        "style": [
-            "formal professional business attire, office wear, corporate clothing",
-            "traditional cultural ethnic clothing, heritage dress, ceremonial wear",
-            "casual relaxed everyday clothing, street wear, comfortable outfit"
-        ],
-        "color": [
-            "bright red clothing", "deep blue clothing", "forest green clothing",
-            "jet black clothing", "pure white clothing", "sunny yellow clothing",
-            "vibrant orange clothing", "royal purple clothing", "warm brown clothing",
-            "soft pink clothing", "cool gray clothing"
-        ]
-    }
 
+# Per-user BK-trees of perceptual hashes, built lazily from the uploads table
+near_dup_index = near_duplicates.NearDuplicateIndex(_load_user_phashes)
 
-def classify_with_confidence_boost(image, attribute_type="all"):
-    """Classify with confidence boosting using multiple prompt variations."""
-    try:
-        enhanced_prompts = generate_enhanced_prompts()
-        
-        if attribute_type == "all":
-            # Combine all enhanced prompts for single classification
-            all_prompts = []
-            for category_prompts in enhanced_prompts.values():
-                all_prompts.extend(category_prompts)
-            
-            results = classifier(images=image, candidate_labels=all_prompts)
-            
-            if not results:
-                # Return sensible defaults instead of unknown
-                return {"position": "upper", "style": "casual", "color": "black"}
-            
-            # Process with confidence boosting
-            return process_confidence_boosted_results(results, enhanced_prompts)
-        
-        else:
-            # Single attribute classification with enhanced prompts
-            prompts = enhanced_prompts.get(attribute_type, [])
-            if not prompts:
-                # Return sensible defaults instead of unknown
-                if attribute_type == "position":
-                    return "upper"
-                elif attribute_type == "style":
-                    return "casual"
-                elif attribute_type == "color":
-                    return "black"
-                return "casual"
-            
-            results = classifier(images=image, candidate_labels=prompts)
-            if not results:
-                # Return sensible defaults instead of unknown
-                if attribute_type == "position":
-                    return "upper"
-                elif attribute_type == "style":
-                    return "casual"
-                elif attribute_type == "color":
-                    return "black"
-                return "casual"
-            
-            # Return top result if confidence is high enough
-            top_result = max(results, key=lambda x: x['score'])
-            if top_result['score'] > 0.1:  # Lower threshold
-                result = map_enhanced_prompt_to_clean(top_result['label'], attribute_type)
-                if result != "unknown":
-                    return result
-            
-            # Return sensible defaults instead of unknown
-            if attribute_type == "position":
-                return "upper"
-            elif attribute_type == "style":
-                return "casual"
-            elif attribute_type == "color":
-                return "black"
-            return "casual"
-            
-    except Exception as e:
-        print(f"Enhanced classification error: {e}")
-        return {"position": "unknown", "style": "unknown", "color": "unknown"}
 
+def perceptual_hash(img):
+    """pHash of a decoded upload, or None when near-duplicate detection is off."""
+    if not near_duplicates.ENABLED:
+        return None
+    with metrics.stage("phash"):
+        return near_duplicates.phash(img)
 
-def process_confidence_boosted_results(results, enhanced_prompts):
-    """Process results with confidence boosting for better accuracy."""
-    # Initialize with sensible defaults instead of unknown
-    classification = {"position": "upper", "style": "casual", "color": "black"}
-    
-    # Sort by confidence score
-    sorted_results = sorted(results, key=lambda x: x['score'], reverse=True)
-    
-    # Process each result with very low threshold for better coverage
-    for result in sorted_results:
-        if result['score'] < 0.05:  # Very low threshold
-            continue
-            
-        label = result['label'].lower()
-        
-        # Determine position with more flexible matching
-        if any(word in label for word in ["upper", "shirt", "blouse", "top", "t-shirt", "garment"]):
-            classification["position"] = "upper"
-        elif any(word in label for word in ["lower", "pants", "skirt", "trousers", "jeans", "garment"]):
-            classification["position"] = "lower"
-        elif any(word in label for word in ["full", "dress", "gown", "jumpsuit", "onesie", "garment"]):
-            classification["position"] = "full"
-        
-        # Determine style with more flexible matching
-        if any(word in label for word in ["formal", "professional", "business", "office", "corporate", "attire"]):
-            classification["style"] = "formal"
-        elif any(word in label for word in ["traditional", "cultural", "ethnic", "heritage", "ceremonial"]):
-            classification["style"] = "traditional"
-        elif any(word in label for word in ["casual", "relaxed", "everyday", "street", "comfortable", "outfit"]):
-            classification["style"] = "casual"
-        
-        # Determine color with more flexible matching
-        color_map = {
-            "red": "red", "blue": "blue", "green": "green",
-            "black": "black", "white": "white", "yellow": "yellow",
-            "orange": "orange", "purple": "purple", "brown": "brown",
-            "pink": "pink", "gray": "gray"
-        }
-        for color, clean_color in color_map.items():
-            if color in label:
-                classification["color"] = clean_color
-                break
-    
-    return classification
 
+def find_near_duplicate(username, phash, img):
+    """(image_path, position, style, color) of a visually identical earlier upload, or None.
 
-def map_enhanced_prompt_to_clean(label, attribute_type):
-    """Map enhanced prompt results to clean labels."""
-    label_lower = label.lower()
-    
-    if attribute_type == "position":
-        if any(word in label_lower for word in ["upper", "shirt", "blouse", "top"]):
-            return "upper"
-        elif any(word in label_lower for word in ["lower", "pants", "skirt", "trousers"]):
-            return "lower"
-        elif any(word in label_lower for word in ["full", "dress", "gown", "jumpsuit"]):
-            return "full"
-    
-    elif attribute_type == "style":
-        if any(word in label_lower for word in ["formal", "professional", "business", "office"]):
-            return "formal"
-        elif any(word in label_lower for word in ["traditional", "cultural", "ethnic", "heritage"]):
-            return "traditional"
-        elif any(word in label_lower for word in ["casual", "relaxed", "everyday", "street"]):
-            return "casual"
-    
-    elif attribute_type == "color":
-        color_map = {
-            "red": "red", "blue": "blue", "green": "green",
-            "black": "black", "white": "white", "yellow": "yellow",
-            "orange": "orange", "purple": "purple", "brown": "brown",
-            "pink": "pink", "gray": "gray"
-        }
-        for color, clean_color in color_map.items():
-            if color in label_lower:
-                return clean_color
-    
-        # Default to black if unclear
-        return "black"
-    
-    # Return sensible defaults instead of unknown
-    if attribute_type == "position":
-        return "upper"
-    elif attribute_type == "style":
-        return "casual"
-    elif attribute_type == "color":
-        return "black"
-    return "casual"
+    Hash matches are confirmed by colour, so a recoloured item is not a duplicate.
+    """
+    if phash is None:
+        return None
+    with metrics.stage("near_dup_lookup"):
+        upload_ids = near_dup_index.candidates(username, phash)
+        if not upload_ids:
+            return None
+        signature = near_duplicates.color_signature(img)
+        for upload_id in upload_ids:
+            cur.execute("SELECT image_path, position, style, color FROM uploads WHERE id = %s", (upload_id,))
+            row = cur.fetchone()
+            if row and near_duplicates.same_colors(signature, row[0]):
+                return row
+    return None
 
 
 @app.route('/signup', methods=['POST'])
@@ -450,6 +207,7 @@ def login():
 
 
 @app.route('/classify', methods=['POST'])
+@admission_controlled('bulk')
 def classify():
     image_file = request.files.get('image')
     username = request.form.get('username')
@@ -461,16 +219,19 @@ def classify():
         return jsonify({'error': 'Unsupported file type'}), 400
 
     image_bytes = image_file.read()
-    image_hash = hashlib.md5(image_bytes).hexdigest()
+    with metrics.stage("hash"):
+        image_hash = hashlib.md5(image_bytes).hexdigest()
 
     # Check duplicates
-    cur.execute(
-        "SELECT image_path, position, style, color FROM uploads WHERE username = %s AND md5_hash = %s",
-        (username, image_hash)
-    )
-    existing = cur.fetchone()
+    with metrics.stage("db_lookup"):
+        cur.execute(
+            "SELECT image_path, position, style, color FROM uploads WHERE username = %s AND md5_hash = %s",
+            (username, image_hash)
+        )
+        existing = cur.fetchone()
     if existing:
-        image_url = f"http://localhost:5000/image/{os.path.basename(existing[0])}"
+        metrics.inc("duplicate_uploads_total", endpoint="classify")
+        image_url = blob_store.image_url(existing[0])
         return jsonify({
             'position': existing[1],
             'style': existing[2],
@@ -479,41 +240,68 @@ def classify():
             'image_url': image_url
         })
 
-    # Save new image
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = secure_filename(f"{username}_{timestamp}_{image_file.filename}")
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-
-    with open(file_path, 'wb') as f:
-        f.write(image_bytes)
-
     try:
-        img = Image.open(file_path)
+        with metrics.stage("decode"):
+            img = Image.open(io.BytesIO(image_bytes))
+            img.load()
     except Exception:
-        if os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({'error': 'Invalid image file'}), 400
 
-    # Use efficient multi-attribute classification
-    classification = classify_all_attributes_efficient(img)
-    position = classification["position"]
-    style = classification["style"]
-    color = classification["color"]
+    # Resized / recompressed copy of an earlier upload: reuse its classification
+    phash = perceptual_hash(img)
+    near = find_near_duplicate(username, phash, img)
+    if near:
+        img.close()
+        metrics.inc("near_duplicate_uploads_total", endpoint="classify")
+        image_url = blob_store.image_url(near[0])
+        return jsonify({
+            'position': near[1],
+            'style': near[2],
+            'color': near[3],
+            'message': 'Near-duplicate of an image already uploaded.',
+            'image_url': image_url
+        })
+
+    # Save new image (stored once per unique content, shared across users)
+    ext = os.path.splitext(secure_filename(image_file.filename))[1]
+    with metrics.stage("store"):
+        file_path = blob_store.add(image_bytes, ext, image_hash)
 
-    cur.execute(
-        "INSERT INTO uploads (username, image_path, position, style, color, md5_hash, uploaded_at) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-        (username, file_path, position, style, color, image_hash, datetime.datetime.now())
-    )
-    conn.commit()
+    # The uploads row owns the reference taken above; give it back if no row is written
+    try:
+        # Use efficient multi-attribute classification
+        with metrics.stage("classify"):
+            classification = classify_all_attributes_efficient(img, image_hash=image_hash)
+        position = classification["position"]
+        style = classification["style"]
+        color = classification["color"]
+
+        with metrics.stage("insert"):
+            cur.execute(
+                "INSERT INTO uploads (username, image_path, position, style, color, md5_hash, uploaded_at, phash) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
+                (username, file_path, position, style, color, image_hash, datetime.datetime.now(),
+                 near_duplicates.to_signed(phash) if phash is not None else None)
+            )
+            upload_id = cur.fetchone()[0]
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        blob_store.release(file_path)
+        raise
+    finally:
+        img.close()
+    if phash is not None:
+        near_dup_index.add(username, phash, upload_id)
 
     # Also index the image for chatbot functionality
     try:
-        add_image_for_user(username, file_path, style, color)
-        print(f"Image indexed for chatbot: {filename}")
+        add_image_for_user(username, file_path, style, color, position, image_hash=image_hash, source="upload")
+        print(f"Image indexed for chatbot: {file_path}")
     except Exception as e:
+        metrics.inc("index_failures_total", endpoint="classify")
         print(f"Warning: Failed to index image for chatbot: {e}")
 
-    image_url = f"http://localhost:5000/image/{filename}"
+    image_url = blob_store.image_url(file_path)
     return jsonify({
         'position': position,
         'style': style,
@@ -535,7 +323,7 @@ def get_history(username):
         for upload in uploads:
             results.append({
                 'id': upload[0],
-                'image_url': f"http://localhost:5000/image/{os.path.basename(upload[1])}",
+                'image_url': blob_store.image_url(upload[1]),
                 'position': upload[2],
                 'style': upload[3],
                 'color': upload[4],
@@ -554,23 +342,43 @@ def delete_upload():
     upload_id = data.get('upload_id')
 
     try:
-        cur.execute("SELECT image_path FROM uploads WHERE id = %s", (upload_id,))
+        cur.execute("SELECT image_path, username FROM uploads WHERE id = %s", (upload_id,))
         img = cur.fetchone()
-        if img:
-            image_path = img[0]
-            if os.path.exists(image_path):
-                os.remove(image_path)
 
         cur.execute("DELETE FROM uploads WHERE id = %s", (upload_id,))
+        if img:
+            cur.execute("SELECT 1 FROM uploads WHERE username = %s AND image_path = %s LIMIT 1", img[::-1])
+            still_uploaded = cur.fetchone() is not None
         conn.commit()
-        return jsonify({'status': 'success'})
     except Exception as e:
+        conn.rollback()
         return jsonify({'status': 'error', 'message': str(e)})
 
+    if img:
+        # Only once the row is gone: other users (or chatbot uploads) may still share the stored file
+        blob_store.release(img[0])
+        near_dup_index.forget(img[1])
+
+        # Drop the chatbot index entry unless another upload of the same image remains
+        if not still_uploaded:
+            try:
+                remove_path(img[1], img[0])
+            except Exception as e:
+                metrics.inc("index_failures_total", endpoint="delete_upload")
+                print(f"Warning: Failed to remove image from chatbot index: {e}")
+    return jsonify({'status': 'success'})
+
+
+def _send_upload(filename):
+    """Serve a stored image; the store's .refs/.lock sidecars are not images"""
+    if not allowed_file(filename):
+        abort(404)
+    return send_from_directory(os.path.join(os.getcwd(), UPLOAD_FOLDER), filename)
+
 
 @app.route('/image/<filename>')
 def get_image(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return _send_upload(filename)
 
 
 @app.route('/get-suggestions', methods=['POST'])
@@ -592,7 +400,7 @@ def get_suggestions():
     results = cur.fetchall()
 
     suggestions = [{
-        'image_url': f"http://localhost:5000/image/{os.path.basename(r[0])}",
+        'image_url': blob_store.image_url(r[0]),
         'uploaded_at': r[1],
         'style': r[2],
         'position': r[3]
@@ -601,9 +409,57 @@ def get_suggestions():
     return jsonify({'suggestions': suggestions})
 
 
+@app.route('/get-outfits', methods=['POST'])
+def get_outfits():
+    """Recommend upper + lower outfits (and full-body pieces) from a user's wardrobe."""
+    data = request.get_json() or {}
+    username = data.get('username')
+    destination = data.get('destination')
+
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+
+    try:
+        top_n = max(1, min(int(data.get('top_n', 10)), 100))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_n must be an integer'}), 400
+
+    try:
+        # The uploads table is the source of truth for position/style/color
+        cur.execute(
+            "SELECT image_path, position, style, color FROM uploads WHERE username = %s",
+            (username,)
+        )
+        attributes = {
+            os.path.abspath(r[0]): {'position': r[1], 'style': r[2], 'color': r[3]}
+            for r in cur.fetchall()
+        }
+
+        recommendation = recommend_outfits(username, top_n=top_n, style=destination, attributes=attributes)
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    def item_json(item):
+        return {
+            'image_url': blob_store.image_url(item['path']),
+            'position': item.get('position'),
+            'style': item.get('style'),
+            'color': item.get('color')
+        }
+
+    return jsonify({
+        'outfits': [
+            {'score': o['score'], 'upper': item_json(o['upper']), 'lower': item_json(o['lower'])}
+            for o in recommendation['outfits']
+        ],
+        'full': [item_json(item) for item in recommendation['full']]
+    })
+
+
 @app.route('/uploaded_images/<path:filename>')
 def serve_uploaded_image(filename):
-    return send_from_directory(os.path.join(os.getcwd(), 'uploaded_images'), filename)
+    return _send_upload(filename)
 
 
 @app.route('/toggle_favorite', methods=['POST'])
@@ -613,7 +469,7 @@ def toggle_favorite():
     username = data.get('username')
 
     try:
-        cur.execute("SELECT favorite FROM uploads WHERE id = %s AND username = %s", (upload_id, username))
+        cur.execute("SELECT favorite, image_path FROM uploads WHERE id = %s AND username = %s", (upload_id, username))
         result = cur.fetchone()
 
         if not result:
@@ -626,6 +482,12 @@ def toggle_favorite():
                    (new_favorite, upload_id, username))
         conn.commit()
 
+        # Keep the chatbot index's favorite filter in sync
+        try:
+            set_item_attributes(username, result[1], favorite=new_favorite)
+        except Exception as e:
+            print(f"Warning: Failed to update favorite in chatbot index: {e}")
+
         return jsonify({'status': 'success', 'favorite': new_favorite})
     except Exception as e:
         conn.rollback()
@@ -635,42 +497,32 @@ def toggle_favorite():
 @app.route('/check-duplicates', methods=['GET'])
 def check_duplicates():
     try:
-        cur.execute("""
-            SELECT image_path, COUNT(*) as count
-            FROM uploads
-            GROUP BY image_path
-            HAVING COUNT(*) > 1
-            ORDER BY count DESC
-        """)
-        duplicates = cur.fetchall()
+        duplicates = duplicate_cleanup.find_duplicates(conn, request.args.get('username'))
 
         if duplicates:
             return jsonify({
                 'status': 'found',
-                'duplicates': [{'image_path': d[0], 'count': d[1]} for d in duplicates]
+                'duplicates': duplicates
             })
         else:
             return jsonify({'status': 'clean', 'message': 'No duplicates found'})
     except Exception as e:
+        conn.rollback()
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @app.route('/clean-duplicates', methods=['POST'])
 def clean_duplicates():
+    data = request.get_json(silent=True) or {}
     try:
-        cur.execute("""
-            DELETE FROM uploads 
-            WHERE id NOT IN (
-                SELECT MAX(id) 
-                FROM uploads 
-                GROUP BY image_path
-            )
-        """)
-        deleted_count = cur.rowcount
-        conn.commit()
+        # Per user and in id-range chunks, each committed on its own
+        summary = duplicate_cleanup.clean_duplicates(
+            conn, data.get('username'), on_user_done=near_dup_index.forget
+        )
         return jsonify({
             'status': 'success',
-            'message': f'Removed {deleted_count} duplicate entries'
+            'message': f"Removed {summary['rows_removed']} duplicate entries",
+            **summary
         })
     except Exception as e:
         conn.rollback()
@@ -689,7 +541,7 @@ def index_existing_images():
         
         # Get all existing uploads for the user
         cur.execute(
-            "SELECT image_path, position, style, color FROM uploads WHERE username = %s",
+            "SELECT image_path, position, style, color, md5_hash FROM uploads WHERE username = %s",
             (username,)
         )
         uploads = cur.fetchall()
@@ -697,10 +549,11 @@ def index_existing_images():
         indexed_count = 0
         errors = []
         
-        for image_path, position, style, color in uploads:
+        for image_path, position, style, color, md5_hash in uploads:
             if os.path.exists(image_path):
                 try:
-                    add_image_for_user(username, image_path, style, color)
+                    add_image_for_user(username, image_path, style, color, position, image_hash=md5_hash,
+                                       source="upload")
                     indexed_count += 1
                 except Exception as e:
                     errors.append(f"Failed to index {os.path.basename(image_path)}: {str(e)}")
@@ -716,114 +569,8 @@ def index_existing_images():
         return jsonify({'error': 'Database error', 'details': str(e)}), 500
 
 
-@app.route('/test-classification', methods=['POST'])
-def test_classification():
-    """Test different classification methods for comparison."""
-    image_file = request.files.get('image')
-    
-    if not image_file:
-        return jsonify({'error': 'Image missing'}), 400
-    
-    if not allowed_file(image_file.filename):
-        return jsonify({'error': 'Unsupported file type'}), 400
-    
-    try:
-        # Save temporary image for testing
-        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"test_{timestamp}_{secure_filename(image_file.filename)}"
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        
-        with open(file_path, 'wb') as f:
-            f.write(image_file.read())
-        
-        img = Image.open(file_path)
-        
-        # Test different classification methods
-        results = {}
-        
-        # Method 1: Original individual classification
-        start_time = datetime.datetime.now()
-        position1 = classify_attribute(img, POSITION_CATEGORIES, clean=True)
-        style1 = classify_attribute(img, STYLE_CATEGORIES, clean=True)
-        color1 = classify_attribute(img, COLOR_CATEGORIES, clean=True)
-        time1 = (datetime.datetime.now() - start_time).total_seconds()
-        
-        results['method1_individual'] = {
-            'position': position1,
-            'style': style1,
-            'color': color1,
-            'time_seconds': time1,
-            'method': 'Individual CLIP calls'
-        }
-        
-        # Method 2: Efficient multi-attribute classification
-        start_time = datetime.datetime.now()
-        classification2 = classify_all_attributes_efficient(img)
-        time2 = (datetime.datetime.now() - start_time).total_seconds()
-        
-        results['method2_efficient'] = {
-            'position': classification2["position"],
-            'style': classification2["style"],
-            'color': classification2["color"],
-            'time_seconds': time2,
-            'method': 'Single CLIP call with all categories'
-        }
-        
-        # Method 3: Enhanced confidence-boosted classification
-        start_time = datetime.datetime.now()
-        classification3 = classify_with_confidence_boost(img, "all")
-        time3 = (datetime.datetime.now() - start_time).total_seconds()
-        
-        results['method3_enhanced'] = {
-            'position': classification3["position"],
-            'style': classification3["style"],
-            'color': classification3["color"],
-            'time_seconds': time3,
-            'method': 'Enhanced prompts with confidence boosting'
-        }
-        
-        # Clean up test file
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
-        return jsonify({
-            'status': 'success',
-            'results': results,
-            'recommendation': get_recommendation(results)
-        })
-        
-    except Exception as e:
-        # Clean up on error
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-
-
-def get_recommendation(results):
-    """Get recommendation based on classification results."""
-    # Find fastest method
-    fastest = min(results.values(), key=lambda x: x['time_seconds'])
-    
-    # Check for consistency across methods
-    positions = [r['position'] for r in results.values()]
-    styles = [r['style'] for r in results.values()]
-    colors = [r['color'] for r in results.values()]
-    
-    position_consistent = len(set(positions)) == 1 and positions[0] != 'unknown'
-    style_consistent = len(set(styles)) == 1 and styles[0] != 'unknown'
-    color_consistent = len(set(colors)) == 1 and colors[0] != 'unknown'
-    
-    consistency_score = sum([position_consistent, style_consistent, color_consistent])
-    
-    if consistency_score >= 2:
-        return f"High confidence results. Recommended method: {fastest['method']} (fastest: {fastest['time_seconds']:.3f}s)"
-    elif consistency_score >= 1:
-        return f"Moderate confidence. Recommended method: {fastest['method']} (fastest: {fastest['time_seconds']:.3f}s)"
-    else:
-        return f"Low confidence. Recommended method: Enhanced prompts for better accuracy (fastest: {fastest['time_seconds']:.3f}s)"
-
-
 @app.route('/classify-enhanced', methods=['POST'])
+@admission_controlled('bulk')
 def classify_enhanced():
     """Enhanced classification endpoint using the best performing method."""
     image_file = request.files.get('image')
@@ -845,7 +592,7 @@ def classify_enhanced():
     )
     existing = cur.fetchone()
     if existing:
-        image_url = f"http://localhost:5000/image/{os.path.basename(existing[0])}"
+        image_url = blob_store.image_url(existing[0])
         return jsonify({
             'position': existing[1],
             'style': existing[2],
@@ -854,31 +601,54 @@ def classify_enhanced():
             'image_url': image_url
         })
     
-    # Save new image
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = secure_filename(f"{username}_{timestamp}_{image_file.filename}")
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    
-    with open(file_path, 'wb') as f:
-        f.write(image_bytes)
-    
     try:
-        img = Image.open(file_path)
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
     except Exception:
-        if os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({'error': 'Invalid image file'}), 400
     
-    # Use enhanced classification
-    classification = classify_with_confidence_boost(img, "all")
+    # Resized / recompressed copy of an earlier upload: reuse its classification
+    phash = perceptual_hash(img)
+    near = find_near_duplicate(username, phash, img)
+    if near:
+        img.close()
+        metrics.inc("near_duplicate_uploads_total", endpoint="classify-enhanced")
+        image_url = blob_store.image_url(near[0])
+        return jsonify({
+            'position': near[1],
+            'style': near[2],
+            'color': near[3],
+            'message': 'Near-duplicate of an image already uploaded.',
+            'image_url': image_url
+        })
     
-    cur.execute(
-        "INSERT INTO uploads (username, image_path, position, style, color, md5_hash, uploaded_at) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-        (username, file_path, classification["position"], classification["style"], classification["color"], image_hash, datetime.datetime.now())
-    )
-    conn.commit()
+    # Save new image (stored once per unique content, shared across users)
+    ext = os.path.splitext(secure_filename(image_file.filename))[1]
+    file_path = blob_store.add(image_bytes, ext, image_hash)
     
-    image_url = f"http://localhost:5000/image/{filename}"
+    # The uploads row owns the reference taken above; give it back if no row is written
+    try:
+        # Use enhanced classification
+        with metrics.stage("classify"):
+            classification = classify_with_confidence_boost(img, "all", image_hash=image_hash)
+        
+        cur.execute(
+            "INSERT INTO uploads (username, image_path, position, style, color, md5_hash, uploaded_at, phash) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
+            (username, file_path, classification["position"], classification["style"], classification["color"], image_hash, datetime.datetime.now(),
+             near_duplicates.to_signed(phash) if phash is not None else None)
+        )
+        upload_id = cur.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        blob_store.release(file_path)
+        raise
+    finally:
+        img.close()
+    if phash is not None:
+        near_dup_index.add(username, phash, upload_id)
+    
+    image_url = blob_store.image_url(file_path)
     return jsonify({
         'position': classification["position"],
         'style': classification["style"],
@@ -887,9 +657,197 @@ def classify_enhanced():
         'method': 'Enhanced CLIP classification'
     })
 
+@app.route('/classify-batch', methods=['POST'])
+@admission_controlled('bulk')
+def classify_batch():
+    """Classify many images from one multipart request (field "images").
+
+    Duplicates are found with one query, new images are classified in batched
+    forward passes, inserted with one statement and commit, and added to the
+    chatbot index with one save. Returns one result per image, in order.
+    """
+    image_files = request.files.getlist('images')
+    username = request.form.get('username')
+
+    if not image_files or not username:
+        return jsonify({'error': 'Images or username missing'}), 400
+
+    if len(image_files) > MAX_BATCH_IMAGES:
+        return jsonify({'error': f'At most {MAX_BATCH_IMAGES} images per batch'}), 400
+
+    results = [{'filename': f.filename} for f in image_files]
+    uploads = []        # (row in results, bytes, md5) of images still to process
+    first_by_hash = {}  # md5 -> row of its first occurrence in this batch
+
+    for row, image_file in enumerate(image_files):
+        if not allowed_file(image_file.filename):
+            results[row].update(status='error', error='Unsupported file type')
+            continue
+        image_bytes = image_file.read()
+        if len(image_bytes) > MAX_UPLOAD_BYTES:
+            results[row].update(status='error', error='Upload too large')
+            continue
+        image_hash = hashlib.md5(image_bytes).hexdigest()
+        if image_hash in first_by_hash:
+            results[row].update(status='duplicate', message='Duplicate image in this batch.',
+                                duplicate_of=first_by_hash[image_hash])
+            continue
+        first_by_hash[image_hash] = row
+        uploads.append((row, image_bytes, image_hash))
+
+    def reuse(row, existing, status, message):
+        results[row].update(
+            status=status, message=message, image_url=blob_store.image_url(existing[0]),
+            position=existing[1], style=existing[2], color=existing[3]
+        )
+
+    try:
+        # Check duplicates for the whole batch at once
+        with metrics.stage("db_lookup"):
+            cur.execute(
+                "SELECT md5_hash, image_path, position, style, color FROM uploads WHERE username = %s AND md5_hash = ANY(%s)",
+                (username, [h for _, _, h in uploads])
+            )
+            existing = {r[0]: r[1:] for r in cur.fetchall()}
+
+        new_uploads = []  # (row, bytes, md5, decoded image, phash)
+        for row, image_bytes, image_hash in uploads:
+            if image_hash in existing:
+                metrics.inc("duplicate_uploads_total", endpoint="classify-batch")
+                reuse(row, existing[image_hash], 'duplicate', 'Duplicate image already uploaded.')
+                continue
+            try:
+                img = Image.open(io.BytesIO(image_bytes))
+                img.load()
+            except Exception:
+                results[row].update(status='error', error='Invalid image file')
+                continue
+            phash = perceptual_hash(img)
+            near = find_near_duplicate(username, phash, img)
+            if near:
+                img.close()
+                metrics.inc("near_duplicate_uploads_total", endpoint="classify-batch")
+                reuse(row, near, 'near_duplicate', 'Near-duplicate of an image already uploaded.')
+                continue
+            new_uploads.append((row, image_bytes, image_hash, img, phash))
+
+        if not new_uploads:
+            return jsonify({'results': results, 'count': len(results), 'classified': 0})
+
+        # Classify every new image in batched forward passes
+        with metrics.stage("classify"):
+            classifications = classify_all_attributes_batch(
+                [u[3] for u in new_uploads], [u[2] for u in new_uploads]
+            )
+        for u in new_uploads:
+            u[3].close()
+
+        paths = []
+        try:
+            for row, image_bytes, image_hash, _, _ in new_uploads:
+                ext = os.path.splitext(secure_filename(image_files[row].filename))[1]
+                paths.append(blob_store.add(image_bytes, ext, image_hash))
+        except Exception:
+            for path in paths:
+                blob_store.release(path)
+            raise
+
+        # One INSERT for all rows, one commit
+        now = datetime.datetime.now()
+        rows = [
+            (username, path, c["position"], c["style"], c["color"], image_hash, now,
+             near_duplicates.to_signed(phash) if phash is not None else None)
+            for path, c, (_, _, image_hash, _, phash) in zip(paths, classifications, new_uploads)
+        ]
+        with metrics.stage("insert"):
+            try:
+                inserted = execute_values(
+                    cur,
+                    "INSERT INTO uploads (username, image_path, position, style, color, md5_hash, uploaded_at, phash) VALUES %s RETURNING id",
+                    rows, page_size=len(rows), fetch=True
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for path in paths:
+                    blob_store.release(path)
+                raise
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'status': 'error', 'message': str(e), 'results': results}), 500
+
+    for (row, _, image_hash, _, phash), (upload_id,), path, c in zip(new_uploads, inserted, paths, classifications):
+        if phash is not None:
+            near_dup_index.add(username, phash, upload_id)
+        results[row].update(
+            status='classified', id=upload_id, image_url=blob_store.image_url(path),
+            position=c["position"], style=c["style"], color=c["color"]
+        )
+
+    # Index all new images for the chatbot with one save
+    try:
+        add_images_for_user(username, [
+            {"path": path, "style": c["style"], "color": c["color"], "position": c["position"],
+             "image_hash": u[2], "source": "upload"}
+            for path, c, u in zip(paths, classifications, new_uploads)
+        ])
+    except Exception as e:
+        metrics.inc("index_failures_total", endpoint="classify-batch")
+        print(f"Warning: Failed to index batch for chatbot: {e}")
+
+    # In-batch duplicates mirror their first occurrence
+    for result in results:
+        if 'duplicate_of' in result:
+            first = results[result.pop('duplicate_of')]
+            for key in ('image_url', 'position', 'style', 'color'):
+                if key in first:
+                    result[key] = first[key]
+
+    return jsonify({'results': results, 'count': len(results), 'classified': len(new_uploads)})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe.
+
+    With WARM_UP_MODELS=1: 200 once all models are loaded, 503 while they are
+    not. In lazy mode models only load on the first inference request, so the
+    app is ready to serve (and lazy-load) right away; the body still shows
+    each model's state.
+    """
+    models = model_registry.status()
+    is_ready = model_registry.is_ready() if WARM_UP_MODELS else True
+    return jsonify({
+        'ready': is_ready,
+        'mode': 'eager' if WARM_UP_MODELS else 'lazy',
+        'models': models,
+        'admission': admission.controller.status()
+    }), 200 if is_ready else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics (enable with METRICS_ENABLED=1)."""
+    if not metrics.ENABLED:
+        body = "# metrics disabled, set METRICS_ENABLED=1 to enable\n"
+    else:
+        body = metrics.render_prometheus()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/debug/memory', methods=['GET'])
+def debug_memory():
+    """Memory use per endpoint/stage and top allocation sites (enable with MEMORY_PROFILING=1)."""
+    if not memory_accounting.ENABLED:
+        return jsonify({'error': 'memory profiling disabled, set MEMORY_PROFILING=1 to enable'}), 404
+    top = request.args.get('top', default=memory_accounting.TOP_SITES, type=int)
+    reset = request.args.get('reset') == '1'
+    return jsonify(memory_accounting.report(limit=top, reset=reset))
+
+
 @app.route('/image/<path:filename>')
 def serve_image(filename):
-    return send_from_directory("uploaded_images", filename)
+    return _send_upload(filename)
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,357 @@
+"""
+ASGI serving mode.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+Cheap, I/O-bound routes (/history, /toggle_favorite, /chatbot/status,
+/ready) run on the event loop against Postgres through asyncpg, so they stay
+fast while uploads are being processed. /classify and /classify-enhanced do
+their database and file work on the loop too, but hand decoding, hashing,
+classification and embedding to a bounded process pool whose workers keep
+the models loaded (see inference_pool.py). Uploads go through the same
+admission controller as the Flask routes (503 + Retry-After when overloaded)
+and the size limit is enforced while the body streams in. /ready turns 200
+once every pool worker has reported its models loaded. Every other route is
+served by the unchanged Flask app, mounted underneath.
+
+Needs the optional packages starlette, uvicorn, asyncpg, a2wsgi and
+python-multipart.
+"""
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import os
+import queue
+import time
+from collections import defaultdict
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from werkzeug.utils import secure_filename
+
+import admission
+import blob_store
+import inference_pool
+import metrics
+import near_duplicates
+import query_cache
+from app import MAX_UPLOAD_BYTES, app as flask_app, allowed_file, near_dup_index
+from per_user_index import set_item_attributes
+
+# Inference jobs allowed in flight (running + queued) before new ones wait
+MAX_PENDING = int(os.environ.get("ASGI_MAX_PENDING", str(inference_pool.POOL_WORKERS * 4)))
+
+# Serializes index writes per user (the index is a load-modify-save file)
+_user_locks = defaultdict(asyncio.Lock)
+
+
+async def _run_inference(request, fn, *args):
+    """Run fn(*args) in the process pool, bounded by MAX_PENDING"""
+    state = request.app.state
+    async with state.pending:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(state.pool, fn, *args)
+
+
+def _reuse_response(row, message):
+    return JSONResponse({
+        'position': row['position'],
+        'style': row['style'],
+        'color': row['color'],
+        'message': message,
+        'image_url': blob_store.image_url(row['image_path'])
+    })
+
+
+async def _find_near_duplicate(db, username, phash, signature):
+    """Earlier upload row that is visually identical (same hash and colours), or None"""
+    if phash is None:
+        return None
+    if not near_dup_index.is_loaded(username):
+        rows = await db.fetch(
+            "SELECT id, phash FROM uploads WHERE username = $1 AND phash IS NOT NULL", username
+        )
+        near_dup_index.load(username, [(r['id'], near_duplicates.from_signed(r['phash'])) for r in rows])
+    with metrics.stage("near_dup_lookup"):
+        for upload_id in near_dup_index.candidates(username, phash):
+            row = await db.fetchrow("SELECT image_path, position, style, color FROM uploads WHERE id = $1", upload_id)
+            if row and await run_in_threadpool(near_duplicates.same_colors, signature, row['image_path']):
+                return row
+    return None
+
+
+async def _admitted(request, lane, handler):
+    """Run handler() under the shared admission controller (the Flask routes use
+    the same one); 503 + Retry-After when overloaded"""
+    if not admission.ENABLED:
+        return await handler()
+    endpoint = request.url.path
+    try:
+        waited = await run_in_threadpool(admission.controller.acquire, lane)
+    except admission.Overloaded as e:
+        metrics.inc("admission_rejected_total", endpoint=endpoint, lane=lane, reason=str(e))
+        return JSONResponse({'error': 'Server busy, please retry shortly', 'retry_after': e.retry_after},
+                            status_code=503, headers={'Retry-After': str(e.retry_after)})
+
+    metrics.observe("admission_wait_seconds", waited, endpoint=endpoint, lane=lane)
+    start = time.perf_counter()
+    try:
+        return await handler()
+    finally:
+        admission.controller.release(time.perf_counter() - start)
+
+
+async def _read_body_limited(request, limit):
+    """Buffer the request body, counting bytes as they arrive (chunked bodies
+    have no Content-Length); False once it exceeds limit"""
+    if int(request.headers.get('content-length') or 0) > limit:
+        return False
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            return False
+        chunks.append(chunk)
+    # request.form() parses from the buffered body
+    request._body = b"".join(chunks)
+    return True
+
+
+# -----------------------------
+# UPLOADS
+# -----------------------------
+async def _classify_upload(request, enhanced):
+    endpoint = "classify-enhanced" if enhanced else "classify"
+    if not await _read_body_limited(request, MAX_UPLOAD_BYTES):
+        return JSONResponse({'error': 'Upload too large'}, status_code=413)
+
+    form = await request.form()
+    image_file = form.get('image')
+    username = form.get('username')
+
+    if not image_file or not username:
+        return JSONResponse({'error': 'Image or username missing'}, status_code=400)
+
+    if not allowed_file(image_file.filename):
+        return JSONResponse({'error': 'Unsupported file type'}, status_code=400)
+
+    image_bytes = await image_file.read()
+    image_hash = hashlib.md5(image_bytes).hexdigest()
+    db = request.app.state.db
+
+    # Check duplicates
+    existing = await db.fetchrow(
+        "SELECT image_path, position, style, color FROM uploads WHERE username = $1 AND md5_hash = $2",
+        username, image_hash
+    )
+    if existing:
+        metrics.inc("duplicate_uploads_total", endpoint=endpoint)
+        return _reuse_response(existing, 'Duplicate image already uploaded.')
+
+    try:
+        phash, signature = await _run_inference(request, inference_pool.decode_and_hash, image_bytes)
+    except ValueError:
+        return JSONResponse({'error': 'Invalid image file'}, status_code=400)
+
+    # Resized / recompressed copy of an earlier upload: reuse its classification
+    near = await _find_near_duplicate(db, username, phash, signature)
+    if near:
+        metrics.inc("near_duplicate_uploads_total", endpoint=endpoint)
+        return _reuse_response(near, 'Near-duplicate of an image already uploaded.')
+
+    ext = os.path.splitext(secure_filename(image_file.filename))[1]
+    file_path = await run_in_threadpool(blob_store.add, image_bytes, ext, image_hash)
+
+    # The uploads row owns the reference taken above; give it back if no row is written
+    try:
+        with metrics.stage("classify"):
+            classification = await _run_inference(
+                request, inference_pool.classify, image_bytes, image_hash, enhanced
+            )
+        position = classification["position"]
+        style = classification["style"]
+        color = classification["color"]
+
+        upload_id = await db.fetchval(
+            "INSERT INTO uploads (username, image_path, position, style, color, md5_hash, uploaded_at, phash) "
+            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8) RETURNING id",
+            username, file_path, position, style, color, image_hash, datetime.datetime.now(),
+            near_duplicates.to_signed(phash) if phash is not None else None
+        )
+    except BaseException:
+        await run_in_threadpool(blob_store.release, file_path)
+        raise
+    if phash is not None:
+        near_dup_index.add(username, phash, upload_id)
+
+    response = {
+        'position': position,
+        'style': style,
+        'color': color,
+        'image_url': blob_store.image_url(file_path)
+    }
+    if enhanced:
+        response['method'] = 'Enhanced CLIP classification'
+        return JSONResponse(response)
+
+    # Also index the image for chatbot functionality
+    try:
+        async with _user_locks[username]:
+            await _run_inference(
+                request, inference_pool.index_image, username, file_path, style, color, position, image_hash
+            )
+    except Exception as e:
+        metrics.inc("index_failures_total", endpoint=endpoint)
+        print(f"Warning: Failed to index image for chatbot: {e}")
+
+    return JSONResponse(response)
+
+
+async def classify(request):
+    return await _admitted(request, 'bulk', lambda: _classify_upload(request, enhanced=False))
+
+
+async def classify_enhanced(request):
+    return await _admitted(request, 'bulk', lambda: _classify_upload(request, enhanced=True))
+
+
+# -----------------------------
+# CHEAP ROUTES
+# -----------------------------
+async def get_history(request):
+    username = request.path_params['username']
+    try:
+        uploads = await request.app.state.db.fetch(
+            "SELECT id, image_path, position, style, color, uploaded_at, favorite FROM uploads "
+            "WHERE username = $1 ORDER BY uploaded_at DESC",
+            username
+        )
+        return JSONResponse([{
+            'id': u['id'],
+            'image_url': blob_store.image_url(u['image_path']),
+            'position': u['position'],
+            'style': u['style'],
+            'color': u['color'],
+            'uploaded_at': u['uploaded_at'].isoformat(),
+            'favorite': u['favorite'] if u['favorite'] is not None else False
+        } for u in uploads])
+    except Exception as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=500)
+
+
+async def toggle_favorite(request):
+    data = await request.json()
+    upload_id = data.get('upload_id')
+    username = data.get('username')
+
+    try:
+        async with request.app.state.db.acquire() as db, db.transaction():
+            result = await db.fetchrow(
+                "SELECT favorite, image_path FROM uploads WHERE id = $1 AND username = $2 FOR UPDATE",
+                upload_id, username
+            )
+            if not result:
+                return JSONResponse({'status': 'error', 'message': 'Upload not found'}, status_code=404)
+
+            new_favorite = not (result['favorite'] or False)
+            await db.execute(
+                "UPDATE uploads SET favorite = $1 WHERE id = $2 AND username = $3",
+                new_favorite, upload_id, username
+            )
+    except Exception as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=500)
+
+    # Keep the chatbot index's favorite filter in sync
+    try:
+        async with _user_locks[username]:
+            await run_in_threadpool(set_item_attributes, username, result['image_path'], favorite=new_favorite)
+    except Exception as e:
+        print(f"Warning: Failed to update favorite in chatbot index: {e}")
+
+    return JSONResponse({'status': 'success', 'favorite': new_favorite})
+
+
+async def chatbot_status(request):
+    return JSONResponse({
+        'status': 'active',
+        'message': 'Chatbot service is running',
+        'query_cache': query_cache.cache.stats()
+    })
+
+
+async def ready(request):
+    """200 once every pool worker has loaded its models, 503 before."""
+    workers = list(request.app.state.workers.values())
+    is_ready = len(workers) == inference_pool.POOL_WORKERS and all(w['ready'] for w in workers)
+    return JSONResponse({
+        'ready': is_ready,
+        'workers': workers,
+        'admission': admission.controller.status()
+    }, status_code=200 if is_ready else 503)
+
+
+# -----------------------------
+# APP
+# -----------------------------
+def _next_worker_status(ready_queue):
+    try:
+        return ready_queue.get(timeout=1)
+    except queue.Empty:
+        return None
+
+
+async def _warm_workers(app):
+    """Start every pool worker and record the status each one reports (by pid)
+    from its initializer once its models are loaded"""
+    loop = asyncio.get_running_loop()
+    for _ in range(inference_pool.POOL_WORKERS):
+        loop.run_in_executor(app.state.pool, inference_pool.worker_pid)
+    while len(app.state.workers) < inference_pool.POOL_WORKERS:
+        status = await run_in_threadpool(_next_worker_status, app.state.ready_queue)
+        if status is not None:
+            app.state.workers[status['pid']] = status
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.db = await asyncpg.create_pool(
+        database=os.environ.get("DB_NAME", "loga"),
+        user=os.environ.get("DB_USER", "postgres"),
+        password=os.environ.get("DB_PASSWORD", "loga"),
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=int(os.environ.get("DB_PORT", "5432")),
+    )
+    app.state.pool, app.state.ready_queue = inference_pool.create_pool()
+    app.state.pending = asyncio.Semaphore(MAX_PENDING)
+    app.state.workers = {}   # pid -> status reported by that worker
+    warm = asyncio.create_task(_warm_workers(app))
+    try:
+        yield
+    finally:
+        warm.cancel()
+        app.state.pool.shutdown(cancel_futures=True)
+        await app.state.db.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/classify', classify, methods=['POST']),
+        Route('/classify-enhanced', classify_enhanced, methods=['POST']),
+        Route('/history/{username}', get_history, methods=['GET']),
+        Route('/toggle_favorite', toggle_favorite, methods=['POST']),
+        Route('/chatbot/status', chatbot_status, methods=['GET']),
+        Route('/ready', ready, methods=['GET']),
+        # Everything else: the Flask app, run in a thread pool
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Accuracy-vs-latency comparison of CLIP inference backends.
+
+Runs every image in a local directory through the PyTorch reference backend
+and the ONNX Runtime backends (fp32 and int8), then reports per-image latency,
+cosine similarity of the embeddings against PyTorch, and top-1 agreement of
+the zero-shot position/style/color classification.
+
+Usage: python bench_backends.py <image_dir> [--model MODEL] [--limit N] [--json OUT]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from classification import (
+    CLASSIFIER_MODEL_NAME, POSITION_CATEGORIES, STYLE_CATEGORIES, COLOR_CATEGORIES
+)
+from inference_backend import ZeroShotClassifier, load_backend
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+BACKENDS = {
+    "torch": {"kind": "torch"},
+    "torchscript": {"kind": "torchscript"},
+    "onnx": {"kind": "onnx", "quantize": False},
+    "onnx-int8": {"kind": "onnx", "quantize": True},
+}
+
+ATTRIBUTES = {
+    "position": POSITION_CATEGORIES,
+    "style": STYLE_CATEGORIES,
+    "color": COLOR_CATEGORIES,
+}
+
+
+def load_images(image_dir, limit=None):
+    """Load RGB images from a directory (sorted for repeatable runs)"""
+    names = sorted(
+        n for n in os.listdir(image_dir)
+        if os.path.splitext(n)[1].lower() in IMAGE_EXTENSIONS
+    )
+    images = []
+    for name in names[:limit]:
+        with Image.open(os.path.join(image_dir, name)) as img:
+            images.append(img.convert("RGB"))
+    return images
+
+
+def percentile(values, pct):
+    return float(np.percentile(np.asarray(values), pct)) if values else 0.0
+
+
+def run_backend(name, model_name, images):
+    """Embed and classify every image one at a time, timing each call"""
+    options = dict(BACKENDS[name])
+    kind = options.pop("kind")
+
+    start = time.perf_counter()
+    backend = load_backend(model_name, kind=kind, **options)
+    load_seconds = time.perf_counter() - start
+
+    # Warm-up so the first image does not include lazy initialization
+    backend.image_features(images[:1])
+
+    latencies = []
+    embeddings = []
+    for img in images:
+        start = time.perf_counter()
+        embeddings.append(backend.image_features([img])[0])
+        latencies.append(time.perf_counter() - start)
+    embeddings = np.stack(embeddings)
+
+    classifier = ZeroShotClassifier(backend)
+    labels = {
+        attr: classifier.scores(embeddings, categories).argmax(axis=1)
+        for attr, categories in ATTRIBUTES.items()
+    }
+
+    return {
+        "load_seconds": load_seconds,
+        "latencies": latencies,
+        "embeddings": embeddings,
+        "labels": labels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("image_dir")
+    parser.add_argument("--model", default=CLASSIFIER_MODEL_NAME)
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--json", dest="json_out", help="write results to this file")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.backends.split(",") if n.strip()]
+    if "torch" not in names:
+        names.insert(0, "torch")   # reference for accuracy
+    unknown = [n for n in names if n not in BACKENDS]
+    if unknown:
+        print(f"Unknown backends: {', '.join(unknown)}")
+        sys.exit(1)
+
+    images = load_images(args.image_dir, args.limit)
+    if not images:
+        print(f"No images found in {args.image_dir}")
+        sys.exit(1)
+    print(f"Comparing {', '.join(names)} on {len(images)} images with {args.model}")
+
+    runs = {name: run_backend(name, args.model, images) for name in names}
+    reference = runs["torch"]
+
+    report = {"model": args.model, "images": len(images), "backends": {}}
+    print(f"\n{'backend':<10} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'speedup':>8} "
+          f"{'cos min':>8} {'cos mean':>9} {'pos':>6} {'style':>6} {'color':>6}")
+
+    ref_p50 = percentile(reference["latencies"], 50)
+    for name, run in runs.items():
+        cosines = np.sum(run["embeddings"] * reference["embeddings"], axis=1)
+        agreement = {
+            attr: float(np.mean(run["labels"][attr] == reference["labels"][attr]))
+            for attr in ATTRIBUTES
+        }
+        p50 = percentile(run["latencies"], 50)
+        entry = {
+            "load_seconds": round(run["load_seconds"], 3),
+            "latency_ms": {
+                "mean": statistics.mean(run["latencies"]) * 1000,
+                "p50": p50 * 1000,
+                "p95": percentile(run["latencies"], 95) * 1000,
+            },
+            "speedup_vs_torch": ref_p50 / p50 if p50 else None,
+            "cosine_vs_torch": {"min": float(cosines.min()), "mean": float(cosines.mean())},
+            "top1_agreement_vs_torch": agreement,
+        }
+        report["backends"][name] = entry
+
+        print(f"{name:<10} {entry['load_seconds']:>8.2f} {entry['latency_ms']['p50']:>8.1f} "
+              f"{entry['latency_ms']['p95']:>8.1f} {entry['speedup_vs_torch']:>7.2f}x "
+              f"{entry['cosine_vs_torch']['min']:>8.4f} {entry['cosine_vs_torch']['mean']:>9.4f} "
+              f"{agreement['position']:>6.1%} {agreement['style']:>6.1%} {agreement['color']:>6.1%}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark for backend entry points.
+
+Each module is imported in a fresh interpreter so the numbers reflect real
+process startup. Non-inference entry points must not load torch/transformers
+and should import well under a second. Any import error fails the run.
+
+"app" connects to Postgres (DB_* variables) when imported, so it is skipped
+unless --with-db is given and a database is reachable.
+
+Usage: python bench_import_time.py [--repeat N] [--budget SECONDS] [--with-db]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that should never need a model at import time
+ENTRY_POINTS = [
+    "model_registry",
+    "clip_embed_utils",
+    "classification",
+    "per_user_index",
+    "chatbot_routes",
+    "clean_duplicate_indexes",
+    "app",
+]
+
+# Entry points that open a database connection at import time
+DB_ENTRY_POINTS = {"app"}
+
+HEAVY_MODULES = ["torch", "transformers"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy_loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def time_import(module):
+    """Import module in a fresh interpreter and return its timing info"""
+    code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        last_line = (proc.stderr.strip().splitlines() or ["unknown error"])[-1]
+        return {"error": last_line}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="max acceptable median import time in seconds")
+    parser.add_argument("--json", dest="json_out", help="write results to this file")
+    parser.add_argument("--with-db", action="store_true",
+                        help="also time entry points that connect to Postgres on import")
+    args = parser.parse_args()
+
+    results = {}
+    failed = False
+
+    for module in ENTRY_POINTS:
+        if module in DB_ENTRY_POINTS and not args.with_db:
+            results[module] = {"skipped": "needs a database, run with --with-db"}
+            print(f"{module:<26} SKIP  (needs a database, run with --with-db)")
+            continue
+
+        runs = [time_import(module) for _ in range(args.repeat)]
+        errors = [r["error"] for r in runs if "error" in r]
+        if errors:
+            failed = True
+            results[module] = {"error": errors[0]}
+            print(f"{module:<26} ERROR  {errors[0]}")
+            continue
+
+        median = statistics.median(r["seconds"] for r in runs)
+        heavy = sorted({m for r in runs for m in r["heavy_loaded"]})
+        ok = median <= args.budget and not heavy
+        failed = failed or not ok
+        results[module] = {"median_seconds": round(median, 4), "heavy_loaded": heavy, "ok": ok}
+
+        flag = "OK  " if ok else "SLOW"
+        extra = f"  (loaded: {', '.join(heavy)})" if heavy else ""
+        print(f"{module:<26} {flag}  {median * 1000:8.1f} ms{extra}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
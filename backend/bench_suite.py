@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Offline performance benchmark suite.
+
+Runs the classification, embedding and per-user index functions against a
+local image corpus (no server or database needed) and reports p50/p95/p99
+latency and throughput for each. Index operations are measured at several
+index sizes using synthetic vectors. Results are written as JSON so runs can
+be compared to catch regressions.
+
+Usage: python bench_suite.py <image_dir> [--repeat N] [--index-sizes 0,1000,10000]
+                             [--out results.json] [--compare previous.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+TEXT_QUERIES = [
+    "formal office shirt",
+    "red traditional dress",
+    "casual blue jeans",
+    "black evening gown",
+    "white summer top",
+]
+
+
+def list_images(image_dir, limit=None):
+    names = sorted(
+        n for n in os.listdir(image_dir)
+        if os.path.splitext(n)[1].lower() in IMAGE_EXTENSIONS
+    )
+    return [os.path.join(image_dir, n) for n in names[:limit]]
+
+
+def summarize(latencies):
+    """Latency percentiles in milliseconds plus throughput in calls/second"""
+    arr = np.asarray(latencies) * 1000.0
+    total = float(np.sum(latencies))
+    return {
+        "n": len(latencies),
+        "mean_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "throughput_per_s": len(latencies) / total if total else None,
+    }
+
+
+def measure(fn, inputs, repeat):
+    """Call fn once per input, repeat times, and return per-call latencies"""
+    latencies = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def build_synthetic_index(per_user_index, user_id, size, image_dir):
+    """Populate a user index with random unit vectors to simulate a large wardrobe"""
+    idx = per_user_index._create_new_index()
+    meta = {"_next_id": 1, "items": {}}
+    if size:
+        rng = np.random.default_rng(size)
+        vecs = rng.standard_normal((size, per_user_index.FAISS_DIM)).astype("float32")
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        ids = np.arange(1, size + 1, dtype="int64")
+        idx.add_with_ids(vecs, ids)
+        for i in ids:
+            meta["items"][str(i)] = {
+                "path": os.path.join(image_dir, f"synthetic_{i}.jpg"),
+                "style": "casual",
+                "color": "black"
+            }
+        meta["_next_id"] = size + 1
+    per_user_index.save_user_index(user_id, idx, meta)
+
+
+def run_suite(image_paths, repeat, index_sizes):
+    # Imported here so `--help` and `--compare` work without loading anything heavy
+    import embedding_cache
+    import model_registry
+    import per_user_index
+    from classification import (
+        POSITION_CATEGORIES, STYLE_CATEGORIES, COLOR_CATEGORIES,
+        classify_attribute, classify_all_attributes_efficient, classify_with_confidence_boost
+    )
+    from clip_embed_utils import embed_image, embed_text
+
+    # Measure inference, not embedding-cache hits
+    embedding_cache.ENABLED = False
+
+    images = []
+    for path in image_paths:
+        with Image.open(path) as img:
+            images.append(img.convert("RGB"))
+
+    print("Loading models...")
+    start = time.perf_counter()
+    errors = model_registry.warm_up()
+    if errors:
+        raise RuntimeError(f"Model warm-up failed: {errors}")
+    print(f"Models ready in {time.perf_counter() - start:.1f}s")
+
+    # One untimed call per function so lazy initialization is not measured
+    classify_all_attributes_efficient(images[0])
+    embed_image(image_paths[0])
+    embed_text(TEXT_QUERIES[0])
+
+    results = {}
+
+    def record(name, latencies):
+        results[name] = summarize(latencies)
+        r = results[name]
+        print(f"{name:<48} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms  "
+              f"p99 {r['p99_ms']:9.2f} ms  {r['throughput_per_s']:8.2f}/s")
+
+    record("classify_attribute[position]",
+           measure(lambda img: classify_attribute(img, POSITION_CATEGORIES, clean=True), images, repeat))
+    record("classify_attribute[style]",
+           measure(lambda img: classify_attribute(img, STYLE_CATEGORIES, clean=True), images, repeat))
+    record("classify_attribute[color]",
+           measure(lambda img: classify_attribute(img, COLOR_CATEGORIES, clean=True), images, repeat))
+    record("classify_all_attributes_efficient",
+           measure(classify_all_attributes_efficient, images, repeat))
+    record("classify_with_confidence_boost",
+           measure(lambda img: classify_with_confidence_boost(img, "all"), images, repeat))
+    record("embed_image", measure(embed_image, image_paths, repeat))
+    record("embed_text", measure(embed_text, TEXT_QUERIES, repeat))
+
+    # Index operations run against a throwaway index directory
+    original_index_dir = per_user_index.INDEX_DIR
+    tmp_dir = tempfile.mkdtemp(prefix="bench_indexes_")
+    per_user_index.INDEX_DIR = tmp_dir
+    try:
+        for size in index_sizes:
+            user_id = f"bench_{size}"
+
+            add_latencies = []
+            for _ in range(repeat):
+                # Fresh index each round so every path is a new (non-duplicate) add
+                build_synthetic_index(per_user_index, user_id, size, tmp_dir)
+                add_latencies.extend(
+                    measure(lambda p: per_user_index.add_image_for_user(user_id, p, "casual", "black"),
+                            image_paths, 1)
+                )
+            record(f"add_image_for_user[index={size}]", add_latencies)
+
+            record(f"query_user[index={size}]",
+                   measure(lambda q: per_user_index.query_user(user_id, q, top_k=3), TEXT_QUERIES, repeat))
+    finally:
+        per_user_index.INDEX_DIR = original_index_dir
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results
+
+
+def compare(current, previous):
+    """Print p50/p95 changes relative to a previous run"""
+    print(f"\n{'benchmark':<48} {'p50 change':>11} {'p95 change':>11}")
+    for name, now in current["results"].items():
+        before = previous.get("results", {}).get(name)
+        if not before:
+            print(f"{name:<48} {'new':>11}")
+            continue
+        deltas = [
+            (now[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            for key in ("p50_ms", "p95_ms")
+        ]
+        print(f"{name:<48} {deltas[0]:>+10.1f}% {deltas[1]:>+10.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("image_dir")
+    parser.add_argument("--limit", type=int, default=20, help="max images from the corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--index-sizes", default="0,1000,10000")
+    parser.add_argument("--out", default=None, help="write JSON results here")
+    parser.add_argument("--compare", default=None, help="previous JSON results to diff against")
+    args = parser.parse_args()
+
+    image_paths = list_images(args.image_dir, args.limit)
+    if not image_paths:
+        print(f"No images found in {args.image_dir}")
+        sys.exit(1)
+    index_sizes = [int(s) for s in args.index_sizes.split(",") if s.strip()]
+
+    results = run_suite(image_paths, args.repeat, index_sizes)
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "clip_backend": os.environ.get("CLIP_BACKEND", "torch"),
+            "images": len(image_paths),
+            "repeat": args.repeat,
+            "index_sizes": index_sizes,
+        },
+        "results": results,
+    }
+
+    out = args.out or f"bench_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
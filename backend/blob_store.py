@@ -0,0 +1,192 @@
+"""
+Content-addressed image storage.
+
+Every image is stored once, keyed by the MD5 of its bytes, no matter how many
+users or routes uploaded it:
+
+    uploaded_images/ab/cd/abcd...ef.jpg        the image (hash + original extension)
+    uploaded_images/ab/cd/abcd...ef.jpg.refs   reference count
+    uploaded_images/.lock                      file lock serializing ref updates
+
+The two-level fan-out keeps each directory small, so lookups stay fast with
+hundreds of thousands of images. A reference is held by each uploads row and
+by each image added through /chatbot/upload; release() deletes the blob when
+the last one goes away.
+
+Images saved before this layout (flat uploaded_images/<name>) have no .refs
+file and are treated as singly referenced. migrate_blob_store.py moves them
+into the store.
+"""
+import fcntl
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+ROOT = "uploaded_images"
+
+_REFS_SUFFIX = ".refs"
+_lock = threading.Lock()
+
+
+# -----------------------------
+# PATHS
+# -----------------------------
+def content_hash(data):
+    """MD5 of image bytes, matching uploads.md5_hash"""
+    return hashlib.md5(data).hexdigest()
+
+
+def blob_path(digest, ext):
+    """Path of a blob in the fan-out layout, e.g. uploaded_images/ab/cd/<digest>.jpg"""
+    return os.path.join(ROOT, digest[:2], digest[2:4], digest + ext.lower())
+
+
+def _find_blob(digest):
+    """Existing blob for a digest under any extension, or None"""
+    for path in glob.glob(os.path.join(ROOT, digest[:2], digest[2:4], digest + ".*")):
+        # Skip .refs sidecars and their temp files: a blob has exactly one dot
+        if os.path.basename(path).count(".") == 1:
+            return path
+    return None
+
+
+def is_blob(path):
+    """True when path lives in the fan-out layout (not a legacy flat file)"""
+    rel = os.path.relpath(os.path.abspath(path), os.path.abspath(ROOT))
+    return len(rel.split(os.sep)) == 3
+
+
+def relative_path(path):
+    """Path relative to ROOT, as used in /image/<path> URLs"""
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(ROOT)).replace(os.sep, "/")
+
+
+def image_url(path):
+    """Public URL of a stored image (served by GET /image/<path>)"""
+    return f"http://localhost:5000/image/{relative_path(path)}"
+
+
+# -----------------------------
+# REFERENCE COUNTS
+# -----------------------------
+@contextmanager
+def _locked():
+    os.makedirs(ROOT, exist_ok=True)
+    with _lock, open(os.path.join(ROOT, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_refs(path):
+    try:
+        with open(path + _REFS_SUFFIX) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        # Legacy files (and blobs written before their first ref) count as one
+        return 1 if os.path.exists(path) else 0
+
+
+def _write_refs(path, count):
+    tmp = f"{path}{_REFS_SUFFIX}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(count))
+    os.replace(tmp, path + _REFS_SUFFIX)
+
+
+def refcount(path):
+    with _locked():
+        return _read_refs(path)
+
+
+def set_refs(path, count):
+    """Overwrite a blob's reference count (used by the migration to recount)"""
+    with _locked():
+        _write_refs(path, count)
+
+
+def incref(path):
+    with _locked():
+        count = (_read_refs(path) if os.path.exists(path + _REFS_SUFFIX) else 0) + 1
+        _write_refs(path, count)
+        return count
+
+
+def release(path):
+    """Drop one reference; deletes the image once nothing refers to it.
+
+    Returns the remaining count.
+    """
+    with _locked():
+        count = max(_read_refs(path) - 1, 0)
+        if count:
+            _write_refs(path, count)
+            return count
+        for p in (path, path + _REFS_SUFFIX):
+            if os.path.exists(p):
+                os.remove(p)
+        return 0
+
+
+# -----------------------------
+# STORING IMAGES
+# -----------------------------
+def add(data, ext, digest=None):
+    """Store image bytes (if not already stored) and take a reference.
+
+    ext is the original file extension (".jpg"); identical bytes uploaded
+    under another extension reuse the existing blob. Returns the blob path.
+    """
+    digest = digest or content_hash(data)
+    path = _find_blob(digest)
+    tmp = None
+    if path is None:
+        path = blob_path(digest, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write outside the lock; readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+    with _locked():
+        existing = _find_blob(digest)
+        if existing is None and tmp is None:
+            # Released and deleted since we looked; write it back
+            with open(path, "wb") as f:
+                f.write(data)
+        elif existing is None:
+            os.replace(tmp, path)
+            tmp = None
+        else:
+            path = existing
+        count = (_read_refs(path) if os.path.exists(path + _REFS_SUFFIX) else 0) + 1
+        _write_refs(path, count)
+
+    if tmp is not None:
+        os.remove(tmp)
+    return path
+
+
+def import_file(src, digest=None):
+    """Move an existing file into the store without taking a reference.
+
+    The source is renamed into place, or removed if identical bytes are
+    already stored. Returns the blob path.
+    """
+    if digest is None:
+        with open(src, "rb") as f:
+            digest = content_hash(f.read())
+    with _locked():
+        path = _find_blob(digest)
+        if path is None:
+            path = blob_path(digest, os.path.splitext(src)[1])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(src, path)
+        elif os.path.abspath(src) != os.path.abspath(path):
+            os.remove(src)
+    return path
@@ -1,8 +1,13 @@
 from flask import Blueprint, request, jsonify
-from per_user_index import add_image_for_user, query_user
+from per_user_index import (
+    FILTER_ATTRIBUTES, add_image_for_user, query_user, query_user_batch,
+    similar_items, load_user_index, load_user_index_for_query, find_item_id
+)
 import os
-import uuid
 from werkzeug.utils import secure_filename
+import blob_store
+import query_cache
+from admission import admission_controlled
 
 # Create blueprint for chatbot routes
 chatbot_bp = Blueprint('chatbot', __name__)
@@ -11,12 +16,58 @@ chatbot_bp = Blueprint('chatbot', __name__)
 UPLOAD_DIR = "uploaded_images"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+MAX_RESULTS = 3
+MAX_BATCH_QUERIES = 16
+
+# Cross-user "more like this" returns other users' photos and loads their
+# indexes, so it is off unless the deployment opts in, and capped
+SIMILAR_ALL_USERS = os.environ.get("SIMILAR_ALL_USERS", "0") == "1"
+SIMILAR_MAX_USERS = int(os.environ.get("SIMILAR_MAX_USERS", "20"))
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _parse_filters(data):
+    """Read optional style/color/position/favorite filters from a request body"""
+    filters = data.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise ValueError('filters must be an object')
+    unknown = set(filters) - set(FILTER_ATTRIBUTES)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+    return filters
+
+def _format_results(results, limit=MAX_RESULTS):
+    """Format index hits for the frontend, dropping repeated image URLs"""
+    formatted_results = []
+    seen_urls = set()
+
+    for result in results:
+        image_url = blob_store.image_url(result['path'])
+
+        # Skip if we've already seen this URL
+        if image_url not in seen_urls:
+            seen_urls.add(image_url)
+            formatted_results.append({
+                'url': image_url,
+                'style': result.get('style', 'Unknown'),
+                'color': result.get('color', 'Unknown'),
+                'position': result.get('position'),
+                'favorite': result.get('favorite', False),
+                'score': result.get('score', 0.0)
+            })
+            if 'user_id' in result:
+                formatted_results[-1]['user_id'] = result['user_id']
+
+            if len(formatted_results) >= limit:
+                break
+
+    return formatted_results
+
 @chatbot_bp.route('/chatbot/upload', methods=['POST'])
+@admission_controlled('bulk')
 def chatbot_upload():
     """Upload image for chatbot indexing"""
     try:
@@ -38,26 +89,33 @@ def chatbot_upload():
         # Get optional metadata
         style = request.form.get('style', 'Unknown')
         color = request.form.get('color', 'Unknown')
+        position = request.form.get('position')
         
-        # Generate unique filename
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
-         # STORE ALL IMAGES IN uploaded_images/ (FLAT)
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-
-        # Save file
-        file.save(file_path)
+        # Store once per unique content (shared with /classify and other users)
+        image_bytes = file.read()
+        image_hash = blob_store.content_hash(image_bytes)
+        ext = os.path.splitext(secure_filename(file.filename))[1]
+        file_path = blob_store.add(image_bytes, ext, image_hash)
         
-        # Add to user's index
-        nid = add_image_for_user(user_id, file_path, style, color)
+        # Add to user's index; the index item keeps the reference taken above
+        try:
+            _, meta = load_user_index(user_id)
+            already_indexed = find_item_id(meta, os.path.basename(file_path)) is not None
+            nid = add_image_for_user(user_id, file_path, style, color, position, image_hash=image_hash,
+                                     source="chatbot")
+        except Exception:
+            blob_store.release(file_path)
+            raise
         
+        if nid is None or already_indexed:
+            blob_store.release(file_path)
         if nid is None:
             return jsonify({'error': 'Failed to process image'}), 500
         
         return jsonify({
             'message': 'Image uploaded and indexed successfully',
             'image_id': nid,
-            'filename': unique_filename
+            'filename': os.path.basename(file_path)
         }), 200
         
     except Exception as e:
@@ -82,30 +140,16 @@ def chatbot_query():
         if not query_text:
             return jsonify({'error': 'Query text required'}), 400
         
-        # Query user's index - limit to top 3 results
-        results = query_user(user_id, query_text, top_k=3)
-        
-        # Format results for frontend with additional deduplication
-        formatted_results = []
-        seen_urls = set()
-        
-        for result in results:
-            filename = os.path.basename(result['path'])
-            image_url = f'http://localhost:5000/image/{filename}'
-            
-            # Skip if we've already seen this URL
-            if image_url not in seen_urls:
-                seen_urls.add(image_url)
-                formatted_results.append({
-                    'url': image_url,
-                    'style': result.get('style', 'Unknown'),
-                    'color': result.get('color', 'Unknown'),
-                    'score': result.get('score', 0.0)
-                })
-                
-                # Stop at 3 results
-                if len(formatted_results) >= 3:
-                    break
+        try:
+            filters = _parse_filters(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Repeat queries against an unchanged index skip inference and admission
+        cache_key = query_cache.cache.key(user_id, query_text, MAX_RESULTS, filters)
+        formatted_results = query_cache.cache.get(cache_key)
+        if formatted_results is None:
+            return _run_query(user_id, query_text, filters, cache_key)
         
         return jsonify({
             'results': formatted_results,
@@ -116,10 +160,127 @@ def chatbot_query():
     except Exception as e:
         return jsonify({'error': f'Query failed: {str(e)}'}), 500
 
+@admission_controlled('interactive')
+def _run_query(user_id, query_text, filters, cache_key):
+    # Query user's index - limit to top 3 results
+    results = query_user(user_id, query_text, top_k=MAX_RESULTS, filters=filters)
+    formatted_results = _format_results(results)
+    query_cache.cache.put(cache_key, formatted_results)
+    
+    return jsonify({
+        'results': formatted_results,
+        'query': query_text,
+        'count': len(formatted_results)
+    }), 200
+
+@chatbot_bp.route('/chatbot/query-batch', methods=['POST'])
+def chatbot_query_batch():
+    """Query chatbot with several related queries in one request"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+        
+        user_id = data.get('user_id')
+        queries = data.get('queries')
+        
+        if not user_id:
+            return jsonify({'error': 'User ID required'}), 400
+        
+        if not isinstance(queries, list):
+            return jsonify({'error': 'queries must be a list of strings'}), 400
+        
+        queries = [str(q).strip() for q in queries]
+        if not queries or not all(queries):
+            return jsonify({'error': 'Query text required for every query'}), 400
+        
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per batch'}), 400
+        
+        try:
+            filters = _parse_filters(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        cache_keys = [query_cache.cache.key(user_id, q, MAX_RESULTS, filters) for q in queries]
+        cached = [query_cache.cache.get(key) for key in cache_keys]
+        if any(results is None for results in cached):
+            return _run_query_batch(user_id, queries, filters, cache_keys, cached)
+        return _batch_response(queries, cached)
+        
+    except Exception as e:
+        return jsonify({'error': f'Batch query failed: {str(e)}'}), 500
+
+@admission_controlled('interactive')
+def _run_query_batch(user_id, queries, filters, cache_keys, cached):
+    # One forward pass + one index search for the queries not in the cache
+    misses = [i for i, results in enumerate(cached) if results is None]
+    batch_results = query_user_batch(user_id, [queries[i] for i in misses], top_k=MAX_RESULTS, filters=filters)
+    
+    for i, results in zip(misses, batch_results):
+        cached[i] = _format_results(results)
+        query_cache.cache.put(cache_keys[i], cached[i])
+    
+    return _batch_response(queries, cached)
+
+def _batch_response(queries, formatted):
+    responses = [
+        {'results': results, 'query': query_text, 'count': len(results)}
+        for query_text, results in zip(queries, formatted)
+    ]
+    return jsonify({'responses': responses, 'count': len(responses)}), 200
+
+@chatbot_bp.route('/chatbot/similar', methods=['POST'])
+def chatbot_similar():
+    """Find wardrobe items similar to an already-indexed item ("more like this")"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+        
+        user_id = data.get('user_id')
+        image_id = data.get('image_id')
+        filename = data.get('filename')
+        all_users = bool(data.get('all_users', False))
+        
+        if not user_id:
+            return jsonify({'error': 'User ID required'}), 400
+        
+        if image_id is None and not filename:
+            return jsonify({'error': 'image_id or filename required'}), 400
+        
+        if all_users and not SIMILAR_ALL_USERS:
+            return jsonify({'error': 'Searching all users is disabled on this server'}), 403
+        
+        try:
+            filters = _parse_filters(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if image_id is None:
+            _, meta = load_user_index_for_query(user_id)
+            image_id = find_item_id(meta, os.path.basename(filename))
+            if image_id is None:
+                return jsonify({'error': 'Image not found in index'}), 404
+        
+        results = similar_items(user_id, int(image_id), top_k=MAX_RESULTS,
+                                all_users=all_users, filters=filters, max_users=SIMILAR_MAX_USERS)
+        formatted_results = _format_results(results)
+        
+        return jsonify({
+            'results': formatted_results,
+            'image_id': int(image_id),
+            'count': len(formatted_results)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Similar search failed: {str(e)}'}), 500
+
 @chatbot_bp.route('/chatbot/status', methods=['GET'])
 def chatbot_status():
     """Check chatbot service status"""
     return jsonify({
         'status': 'active',
-        'message': 'Chatbot service is running'
+        'message': 'Chatbot service is running',
+        'query_cache': query_cache.cache.stats()
     }), 200
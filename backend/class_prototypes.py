@@ -0,0 +1,124 @@
+"""
+Prompt-ensemble class prototypes.
+
+For every attribute value (e.g. style "formal") the text embeddings of all
+PROMPT_TEMPLATES x CLASS_DESCRIPTIONS phrasings are averaged into a single
+unit vector. Classifying an image is then one image embedding times one
+small (classes x dim) matrix per attribute, so adding templates or phrasings
+improves the prototypes without making requests any slower.
+
+Prototypes are built once per model and cached in CLIP_PROTOTYPE_DIR under a
+key that hashes the templates and descriptions, so editing either rebuilds
+them automatically.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+PROTOTYPE_DIR = os.environ.get("CLIP_PROTOTYPE_DIR", "prototype_cache")
+
+PROMPT_TEMPLATES = [
+    "a photo of {}.",
+    "a product photo of {}.",
+    "a catalog photo of {}.",
+    "a close-up photo of {}.",
+    "a cropped photo of {}.",
+    "a photo of a person wearing {}.",
+    "{} on a plain background.",
+    "a low resolution photo of {}.",
+]
+
+_COLOR_SHADES = {
+    "red": "bright red", "blue": "deep blue", "green": "forest green",
+    "black": "jet black", "white": "pure white", "yellow": "sunny yellow",
+    "orange": "vibrant orange", "purple": "royal purple", "brown": "warm brown",
+    "pink": "soft pink", "gray": "cool gray",
+}
+
+# attribute -> clean label -> phrasings filled into every template
+CLASS_DESCRIPTIONS = {
+    "position": {
+        "upper": ["an upper body garment", "a shirt", "a blouse", "a top", "a t-shirt", "a sweater", "a jacket"],
+        "lower": ["a lower body garment", "pants", "a skirt", "trousers", "jeans", "shorts"],
+        "full": ["a full body garment", "a dress", "a gown", "a jumpsuit", "a onesie", "a saree"],
+    },
+    "style": {
+        "formal": ["formal business attire", "professional office wear", "corporate clothing", "a suit"],
+        "traditional": ["traditional ethnic clothing", "cultural heritage dress", "ceremonial wear"],
+        "casual": ["casual everyday clothing", "relaxed street wear", "a comfortable outfit"],
+    },
+    "color": {
+        color: [f"{color} clothing", f"a {color} dress", f"a {color} shirt", f"{shade} clothing"]
+        for color, shade in _COLOR_SHADES.items()
+    },
+}
+
+# Texts per text-tower call while building
+_BUILD_BATCH = 256
+
+
+class Prototypes:
+    """Per-attribute prototype matrices plus the model's logit scale"""
+
+    def __init__(self, labels, matrices, logit_scale):
+        self.labels = labels          # attribute -> [label, ...]
+        self.matrices = matrices      # attribute -> (classes, dim) float32
+        self.logit_scale = logit_scale
+
+    def scores(self, image_feats, attribute):
+        """Softmax probabilities over an attribute's labels, one row per image"""
+        logits = self.logit_scale * (np.atleast_2d(image_feats) @ self.matrices[attribute].T)
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def classify(self, image_feats, attributes=None):
+        """[{attribute: label}, ...], one dict per image row"""
+        attributes = attributes or list(self.labels)
+        image_feats = np.atleast_2d(image_feats)
+        best = {attr: self.scores(image_feats, attr).argmax(axis=1) for attr in attributes}
+        return [
+            {attr: self.labels[attr][best[attr][row]] for attr in attributes}
+            for row in range(image_feats.shape[0])
+        ]
+
+
+def _cache_path(model_name):
+    from inference_backend import backend_variant
+
+    spec = json.dumps({"templates": PROMPT_TEMPLATES, "classes": CLASS_DESCRIPTIONS}, sort_keys=True)
+    digest = hashlib.sha1(spec.encode()).hexdigest()[:12]
+    return os.path.join(PROTOTYPE_DIR, f"{model_name.replace('/', '__')}@{backend_variant()}_{digest}.npz")
+
+
+def build_prototypes(backend, model_name):
+    """Load cached prototypes for a model, or build and cache them with backend"""
+    path = _cache_path(model_name)
+    labels = {attr: list(classes) for attr, classes in CLASS_DESCRIPTIONS.items()}
+
+    if os.path.exists(path):
+        with np.load(path) as data:
+            matrices = {attr: data[attr].astype("float32") for attr in labels}
+        return Prototypes(labels, matrices, backend.logit_scale)
+
+    matrices = {}
+    for attr, classes in CLASS_DESCRIPTIONS.items():
+        rows = []
+        for descriptions in classes.values():
+            texts = [t.format(d) for t in PROMPT_TEMPLATES for d in descriptions]
+            feats = np.concatenate([
+                backend.text_features(texts[i:i + _BUILD_BATCH])
+                for i in range(0, len(texts), _BUILD_BATCH)
+            ])
+            proto = feats.mean(axis=0)
+            rows.append(proto / (np.linalg.norm(proto) + 1e-10))
+        matrices[attr] = np.stack(rows).astype("float32")
+
+    os.makedirs(PROTOTYPE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, **matrices)
+    os.replace(tmp, path)
+    print(f"Built class prototypes for {model_name}: {path}")
+    return Prototypes(labels, matrices, backend.logit_scale)
@@ -0,0 +1,304 @@
+"""
+CLIP zero-shot classification of garment position, style and color.
+"""
+import numpy as np
+
+import class_prototypes
+import embedding_cache
+import model_registry
+from inference_backend import ZeroShotClassifier, load_backend
+
+# Zero-shot classifier on CLIP-Base, loaded lazily on first use
+CLASSIFIER_MODEL_NAME = "openai/clip-vit-base-patch32"
+
+# Images per forward pass in classifier_batch
+CLASSIFY_BATCH_SIZE = 16
+
+
+def _load_classifier():
+    return ZeroShotClassifier(load_backend(CLASSIFIER_MODEL_NAME))
+
+
+model_registry.register("classifier", _load_classifier)
+
+# Averaged multi-prompt class prototypes, built (or read from disk) after the classifier
+model_registry.register(
+    "prototypes",
+    lambda: class_prototypes.build_prototypes(model_registry.get("classifier").backend, CLASSIFIER_MODEL_NAME)
+)
+
+DEFAULT_LABELS = {"position": "upper", "style": "casual", "color": "black"}
+
+
+def classifier(images, candidate_labels, image_hash=None):
+    """Run the zero-shot classifier, loading it on first call.
+
+    When image_hash is given the image features come from the shared
+    embedding cache, so only the (cheap) label scoring runs on a hit.
+    """
+    clf = model_registry.get("classifier")
+    if image_hash is None or not embedding_cache.ENABLED:
+        return clf(images=images, candidate_labels=candidate_labels)
+
+    feats = embedding_cache.cached_embedding(
+        CLASSIFIER_MODEL_NAME, image_hash,
+        lambda: clf.backend.image_features([images])[0]
+    )
+    return clf.classify_features(feats, candidate_labels)[0]
+
+
+def image_features_batch(images, image_hashes=None):
+    """Classifier image features, (n, dim). Cached features are reused; the
+    rest go through CLIP in batches of CLASSIFY_BATCH_SIZE."""
+    clf = model_registry.get("classifier")
+
+    def compute(positions):
+        feats = []
+        for start in range(0, len(positions), CLASSIFY_BATCH_SIZE):
+            chunk = positions[start:start + CLASSIFY_BATCH_SIZE]
+            feats.extend(clf.backend.image_features([images[i] for i in chunk]))
+        return feats
+
+    keys = list(image_hashes or [None] * len(images))
+    return np.stack(embedding_cache.cached_embeddings(CLASSIFIER_MODEL_NAME, keys, compute))
+
+
+def classifier_batch(images, candidate_labels, image_hashes=None):
+    """Zero-shot results for several images, one result list per image,
+    with all images scored against the labels at once."""
+    clf = model_registry.get("classifier")
+    return clf.classify_features(image_features_batch(images, image_hashes), candidate_labels)
+
+
+# Improved prompt-engineered categories for better CLIP performance
+POSITION_CATEGORIES = [
+    "upper body clothing, shirt, blouse, top",
+    "lower body clothing, pants, skirt, trousers",
+    "full body clothing, dress, gown, jumpsuit"
+]
+
+STYLE_CATEGORIES = [
+    "formal business attire, professional clothing, office wear",
+    "traditional ethnic clothing, cultural dress, heritage wear",
+    "casual everyday clothing, relaxed wear, comfortable outfit"
+]
+
+COLOR_CATEGORIES = [
+    "red clothing, red dress, red shirt",
+    "blue clothing, blue dress, blue shirt", 
+    "green clothing, green dress, green shirt",
+    "black clothing, black dress, black shirt",
+    "white clothing, white dress, white shirt",
+    "yellow clothing, yellow dress, yellow shirt",
+    "orange clothing, orange dress, orange shirt",
+    "purple clothing, purple dress, purple shirt",
+    "brown clothing, brown dress, brown shirt",
+    "pink clothing, pink dress, pink shirt",
+    "gray clothing, gray dress, gray shirt"
+]
+
+# Enhanced classification function with better prompt handling
+def classify_attribute(image, categories, clean=False, image_hash=None):
+    """Classify attribute using CLIP with improved prompt engineering."""
+    try:
+        results = classifier(images=image, candidate_labels=categories, image_hash=image_hash)
+        if results and len(results) > 0:
+            # Sort by confidence score
+            sorted_results = sorted(results, key=lambda x: x['score'], reverse=True)
+            top_result = sorted_results[0]
+            
+            # Very low threshold to ensure we get results
+            if top_result['score'] > 0.05:  # Much lower threshold
+                label = top_result['label']
+                
+                if clean:  # Map back to simple labels for JSON response
+                    if "color" in label:
+                        # Extract color from prompt with more flexible matching
+                        color_map = {
+                            "red": "red", "blue": "blue", "green": "green", 
+                            "black": "black", "white": "white", "yellow": "yellow",
+                            "orange": "orange", "purple": "purple", "brown": "brown",
+                            "pink": "pink", "gray": "gray"
+                        }
+                        for color, clean_color in color_map.items():
+                            if color in label.lower():
+                                return clean_color
+                        # If no color found, return most common
+                        return "black"
+                    elif "clothing" in label or "garment" in label:
+                        if any(word in label.lower() for word in ["upper", "shirt", "blouse", "top", "t-shirt"]):
+                            return "upper"
+                        elif any(word in label.lower() for word in ["lower", "pants", "skirt", "trousers", "jeans"]):
+                            return "lower"
+                        elif any(word in label.lower() for word in ["full", "dress", "gown", "jumpsuit", "onesie"]):
+                            return "full"
+                        # Default to upper body if unclear
+                        return "upper"
+                    elif any(word in label.lower() for word in ["formal", "business", "professional", "office", "corporate", "attire"]):
+                        return "formal"
+                    elif any(word in label.lower() for word in ["traditional", "ethnic", "cultural", "heritage", "ceremonial"]):
+                        return "traditional"
+                    elif any(word in label.lower() for word in ["casual", "everyday", "relaxed", "comfortable", "street", "outfit"]):
+                        return "casual"
+                    # Default to casual if unclear
+                    return "casual"
+                
+                return label
+            else:
+                # Return sensible defaults instead of unknown
+                if "color" in categories[0]:
+                    return "black"
+                elif "clothing" in categories[0]:
+                    return "upper"
+                else:
+                    return "casual"
+        # Return sensible defaults instead of unknown
+        if "color" in categories[0]:
+            return "black"
+        elif "clothing" in categories[0]:
+            return "upper"
+        else:
+            return "casual"
+    except Exception as e:
+        print(f"Classification error: {e}")
+        # Return sensible defaults instead of unknown
+        if "color" in categories[0]:
+            return "black"
+        elif "clothing" in categories[0]:
+            return "upper"
+        else:
+            return "casual"
+
+
+# Position, style and color labels scored together in one CLIP call
+ALL_ATTRIBUTE_LABELS = [
+    # Position categories
+    "upper body shirt blouse top",
+    "lower body pants skirt trousers", 
+    "full body dress gown jumpsuit",
+    # Style categories
+    "formal business professional office",
+    "traditional ethnic cultural heritage",
+    "casual everyday relaxed comfortable",
+    # Color categories
+    "red clothing", "blue clothing", "green clothing",
+    "black clothing", "white clothing", "yellow clothing",
+    "orange clothing", "purple clothing", "brown clothing",
+    "pink clothing", "gray clothing"
+]
+
+
+def _attributes_from_results(results):
+    """Fold scored ALL_ATTRIBUTE_LABELS results into position/style/color"""
+    if not results or len(results) == 0:
+        # Return sensible defaults instead of unknown
+        return {"position": "upper", "style": "casual", "color": "black"}
+    
+    # Sort by confidence score
+    sorted_results = sorted(results, key=lambda x: x['score'], reverse=True)
+    
+    # Initialize results with defaults instead of unknown
+    classification = {"position": "upper", "style": "casual", "color": "black"}
+    
+    # Process results with very low threshold for better coverage
+    for result in sorted_results:
+        if result['score'] < 0.05:  # Very low threshold
+            continue
+            
+        label = result['label'].lower()
+        
+        # Determine position with more flexible matching
+        if any(word in label for word in ["upper", "shirt", "blouse", "top", "t-shirt", "garment"]):
+            classification["position"] = "upper"
+        elif any(word in label for word in ["lower", "pants", "skirt", "trousers", "jeans", "garment"]):
+            classification["position"] = "lower"
+        elif any(word in label for word in ["full", "dress", "gown", "jumpsuit", "onesie", "garment"]):
+            classification["position"] = "full"
+        
+        # Determine style with more flexible matching
+        if any(word in label for word in ["formal", "business", "professional", "office", "corporate", "attire"]):
+            classification["style"] = "formal"
+        elif any(word in label for word in ["traditional", "ethnic", "cultural", "heritage", "ceremonial"]):
+            classification["style"] = "traditional"
+        elif any(word in label for word in ["casual", "everyday", "relaxed", "comfortable", "street", "outfit"]):
+            classification["style"] = "casual"
+        
+        # Determine color with more flexible matching
+        color_map = {
+            "red": "red", "blue": "blue", "green": "green",
+            "black": "black", "white": "white", "yellow": "yellow",
+            "orange": "orange", "purple": "purple", "brown": "brown",
+            "pink": "pink", "gray": "gray"
+        }
+        for color, clean_color in color_map.items():
+            if color in label:
+                classification["color"] = clean_color
+                break
+    
+    return classification
+
+
+def classify_all_attributes_efficient(image, image_hash=None):
+    """Efficiently classify all attributes in a single CLIP call for better performance."""
+    try:
+        # Single CLIP call for all categories
+        results = classifier(images=image, candidate_labels=ALL_ATTRIBUTE_LABELS, image_hash=image_hash)
+        return _attributes_from_results(results)
+        
+    except Exception as e:
+        print(f"Multi-attribute classification error: {e}")
+        # Return sensible defaults instead of unknown
+        return {"position": "upper", "style": "casual", "color": "black"}
+
+
+def classify_all_attributes_batch(images, image_hashes=None, strict=False):
+    """classify_all_attributes_efficient for many images with batched forward passes.
+
+    Returns one {"position", "style", "color"} dict per image, in order. On
+    errors every image gets default labels, unless strict=True, which raises
+    instead (for callers that must not store made-up labels).
+    """
+    try:
+        per_image = classifier_batch(images, ALL_ATTRIBUTE_LABELS, image_hashes)
+        return [_attributes_from_results(results) for results in per_image]
+    except Exception as e:
+        if strict:
+            raise
+        print(f"Batch multi-attribute classification error: {e}")
+        return [{"position": "upper", "style": "casual", "color": "black"} for _ in images]
+
+
+def classify_with_confidence_boost(image, attribute_type="all", image_hash=None):
+    """Classify with a prompt ensemble at single-prompt cost.
+
+    The image embedding is scored against averaged multi-prompt class
+    prototypes (see class_prototypes), one small matrix per attribute.
+    """
+    try:
+        if attribute_type != "all" and attribute_type not in DEFAULT_LABELS:
+            return "casual"
+        feats = image_features_batch([image], [image_hash])
+        prototypes = model_registry.get("prototypes")
+        
+        if attribute_type == "all":
+            return prototypes.classify(feats)[0]
+        return prototypes.classify(feats, [attribute_type])[0][attribute_type]
+            
+    except Exception as e:
+        print(f"Enhanced classification error: {e}")
+        return {"position": "unknown", "style": "unknown", "color": "unknown"}
+
+
+def classify_with_confidence_boost_batch(images, image_hashes=None, strict=False):
+    """classify_with_confidence_boost(image, "all") for many images with batched forward passes.
+
+    strict=True raises on errors instead of returning "unknown" labels.
+    """
+    try:
+        feats = image_features_batch(images, image_hashes)
+        return model_registry.get("prototypes").classify(feats)
+    except Exception as e:
+        if strict:
+            raise
+        print(f"Batch enhanced classification error: {e}")
+        return [{"position": "unknown", "style": "unknown", "color": "unknown"} for _ in images]
@@ -1,38 +1,78 @@
-import torch
-import numpy as np
 from PIL import Image
-from transformers import CLIPModel, CLIPProcessor
 
-device = "cpu"   # Safer for your system, change to cuda if needed
+import embedding_cache
+import model_registry
+from inference_backend import load_backend
 
-model = CLIPModel.from_pretrained("openai/clip-vit-large-patch14").to(device)
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-large-patch14")
+EMBED_MODEL_NAME = "openai/clip-vit-large-patch14"
 
+# Images per forward pass in embed_images
+EMBED_BATCH_SIZE = 16
 
-def embed_image(path):
-    """Generate embedding for an image using CLIP model"""
+# CLIP-Large backend (torch or onnx, see inference_backend), loaded on first use
+model_registry.register("embedder", lambda: load_backend(EMBED_MODEL_NAME))
+
+
+def embed_image(path, image_hash=None):
+    """Generate embedding for an image using CLIP model.
+
+    Embeddings are looked up in the content-addressed cache by image_hash
+    (the MD5 of the file, computed when not given) before running CLIP.
+    """
     try:
-        img = Image.open(path).convert("RGB")
-        inputs = processor(images=img, return_tensors="pt").to(device)
-        with torch.no_grad():
-            feats = model.get_image_features(**inputs)
-        v = feats.cpu().numpy()[0].astype("float32")
-        v /= (np.linalg.norm(v) + 1e-10)
-        return v
+        def compute():
+            backend = model_registry.get("embedder")
+            img = Image.open(path).convert("RGB")
+            return backend.image_features([img])[0]
+
+        if embedding_cache.ENABLED and image_hash is None:
+            image_hash = embedding_cache.file_hash(path)
+        return embedding_cache.cached_embedding(EMBED_MODEL_NAME, image_hash, compute)
     except Exception as e:
         print(f"Error embedding image {path}: {e}")
         return None
 
 
+def embed_images(paths, image_hashes=None):
+    """Embeddings for several images; cache misses go through CLIP in batches.
+
+    Returns a list aligned with paths (None where an image failed).
+    """
+    try:
+        hashes = list(image_hashes or [None] * len(paths))
+        if embedding_cache.ENABLED:
+            hashes = [h or embedding_cache.file_hash(p) for p, h in zip(paths, hashes)]
+
+        def compute(positions):
+            backend = model_registry.get("embedder")
+            feats = []
+            for start in range(0, len(positions), EMBED_BATCH_SIZE):
+                chunk = positions[start:start + EMBED_BATCH_SIZE]
+                images = [Image.open(paths[i]).convert("RGB") for i in chunk]
+                feats.extend(backend.image_features(images))
+            return feats
+
+        return embedding_cache.cached_embeddings(EMBED_MODEL_NAME, hashes, compute)
+    except Exception as e:
+        print(f"Error embedding {len(paths)} images: {e}")
+        return [None] * len(paths)
+
+
 def embed_text(text):
     """Generate embedding for text using CLIP model"""
     try:
-        inputs = processor(text=[text], return_tensors="pt").to(device)
-        with torch.no_grad():
-            feats = model.get_text_features(**inputs)
-        v = feats.cpu().numpy()[0].astype("float32")
-        v /= (np.linalg.norm(v) + 1e-10)
-        return v
+        backend = model_registry.get("embedder")
+        return backend.text_features([text])[0]
     except Exception as e:
         print(f"Error embedding text '{text}': {e}")
         return None
+
+
+def embed_texts(texts):
+    """Generate embeddings for several texts in one forward pass; returns (n, dim) array"""
+    try:
+        backend = model_registry.get("embedder")
+        return backend.text_features(list(texts))
+    except Exception as e:
+        print(f"Error embedding {len(texts)} texts: {e}")
+        return None
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Chunked duplicate-upload cleanup.
+
+A duplicate is an upload row whose user already has a newer row for the same
+image_path; the newest row is kept. Work is done one user at a time and, per
+user, in keyset pages of --chunk-size of that user's own rows, newest first
+(id < last id seen, ORDER BY id DESC). Within a page a ROW_NUMBER() window
+finds repeats; a row is also a duplicate when a newer page already had its
+image_path. Each page's DELETE is committed on its own, so no statement
+locks or scans the whole table and the cost follows the user's row count,
+not the span of their ids.
+
+In the same pass every deleted row's blob reference is released (the file
+goes once nothing refers to it), the user's chatbot index drops items whose
+image is gone and repeated items for the same image, and the user's
+near-duplicate hashes are reloaded.
+
+Used by /check-duplicates and /clean-duplicates, or run directly:
+
+    python duplicate_cleanup.py [--user NAME] [--chunk-size 1000] [--dry-run]
+"""
+import argparse
+import os
+import time
+
+import psycopg2
+
+import blob_store
+import metrics
+
+CHUNK_SIZE = int(os.environ.get("DUPLICATE_CLEANUP_CHUNK", "1000"))
+
+metrics.describe("duplicate_rows_removed_total", "Duplicate upload rows deleted by the cleanup engine")
+
+# One keyset page of a user's rows, newest first, with each row's rank among
+# the page's rows for the same image (rn > 1: a newer copy is in the page)
+_PAGE = """
+    SELECT id, image_path,
+           ROW_NUMBER() OVER (PARTITION BY image_path ORDER BY id DESC) AS rn
+    FROM (
+        SELECT id, image_path FROM uploads
+        WHERE username = %(username)s AND id < %(before)s
+        ORDER BY id DESC
+        LIMIT %(limit)s
+    ) page
+    ORDER BY id DESC
+"""
+
+# Larger than any uploads.id, the starting point of the keyset walk
+_NO_ID = 2 ** 63 - 1
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.environ.get("DB_NAME", "loga"),
+        user=os.environ.get("DB_USER", "postgres"),
+        password=os.environ.get("DB_PASSWORD", "loga"),
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=os.environ.get("DB_PORT", "5432"),
+    )
+
+
+def _usernames(conn, username=None):
+    if username is not None:
+        return [username]
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT username FROM uploads ORDER BY username")
+        users = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    return users
+
+
+# -----------------------------
+# CHECK
+# -----------------------------
+def find_duplicates(conn, username=None):
+    """[{'username', 'image_path', 'count'}, ...] for images uploaded more than once, one query per user"""
+    duplicates = []
+    with conn.cursor() as cur:
+        for user in _usernames(conn, username):
+            cur.execute(
+                "SELECT image_path, COUNT(*) FROM uploads WHERE username = %s "
+                "GROUP BY image_path HAVING COUNT(*) > 1",
+                (user,)
+            )
+            duplicates.extend(
+                {'username': user, 'image_path': path, 'count': count}
+                for path, count in cur.fetchall()
+            )
+            conn.commit()
+    duplicates.sort(key=lambda d: d['count'], reverse=True)
+    return duplicates
+
+
+# -----------------------------
+# CLEAN
+# -----------------------------
+def _clean_user(conn, username, chunk_size, dry_run):
+    """Remove one user's duplicates page by page; returns (rows, files, vectors) removed"""
+    rows = files = 0
+    gone_paths = []
+    seen = set()    # image paths whose newest row is already kept
+    before = _NO_ID
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(_PAGE, {'username': username, 'before': before, 'limit': chunk_size})
+            page = cur.fetchall()
+            if not page:
+                conn.commit()
+                break
+            before = page[-1][0]
+            duplicate_ids = [upload_id for upload_id, path, rn in page if rn > 1 or path in seen]
+            seen.update(path for _, path, _ in page)
+
+            if dry_run or not duplicate_ids:
+                deleted = [None] * len(duplicate_ids) if dry_run else []
+            else:
+                cur.execute(
+                    "DELETE FROM uploads WHERE username = %s AND id = ANY(%s) RETURNING id, image_path",
+                    (username, duplicate_ids)
+                )
+                deleted = cur.fetchall()
+        conn.commit()
+        rows += len(deleted)
+        if dry_run:
+            continue
+
+        # Only after the commit: each deleted row held a reference to its image
+        for _, image_path in deleted:
+            if blob_store.release(image_path) == 0:
+                files += 1
+                gone_paths.append(image_path)
+
+    vectors = 0
+    if rows and not dry_run:
+        metrics.inc("duplicate_rows_removed_total", value=rows)
+        from per_user_index import prune_items
+        try:
+            vectors = prune_items(username, gone_paths)
+        except Exception as e:
+            print(f"Warning: failed to prune index for {username}: {e}")
+    return rows, files, vectors
+
+
+def clean_duplicates(conn, username=None, chunk_size=CHUNK_SIZE, dry_run=False, on_user_done=None):
+    """Delete duplicate uploads (all users, or one) and purge their files and vectors.
+
+    on_user_done(username) is called after each user with changes, e.g. to
+    drop cached per-user state. Returns a summary dict.
+    """
+    users = _usernames(conn, username)
+    start = time.perf_counter()
+    summary = {'users': len(users), 'rows_removed': 0, 'files_removed': 0, 'vectors_removed': 0}
+
+    for done, user in enumerate(users, 1):
+        rows, files, vectors = _clean_user(conn, user, chunk_size, dry_run)
+        summary['rows_removed'] += rows
+        summary['files_removed'] += files
+        summary['vectors_removed'] += vectors
+        if rows and not dry_run and on_user_done:
+            on_user_done(user)
+
+        elapsed = time.perf_counter() - start
+        if rows or done == len(users):
+            print(f"[duplicates] {done}/{len(users)} users, {summary['rows_removed']} rows "
+                  f"{'found' if dry_run else 'removed'}, {summary['rows_removed'] / elapsed:.1f} rows/s")
+
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--user", help="only clean this username")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="user rows per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="count duplicates without deleting anything")
+    args = parser.parse_args()
+
+    conn = connect()
+    summary = clean_duplicates(conn, args.user, args.chunk_size, args.dry_run)
+    conn.close()
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Content-addressed embedding cache shared across users.
+
+Image embeddings are stored once per (image hash, model name, backend
+variant), so the same photo uploaded by several users, re-indexed by
+/index-existing-images or re-added during an index rebuild is looked up
+instead of run through CLIP.
+
+The backend variant (inference_backend.backend_variant(), e.g. "torch" or
+"onnx-int8") is part of the key because backends produce slightly different
+vectors; switching CLIP_BACKEND starts a separate cache instead of mixing them.
+
+Layout per model and variant under EMBEDDING_CACHE_DIR:
+
+    <model>@<variant>/vectors.f32   append-only float32 rows, memory-mapped for reads
+    <model>@<variant>/offsets.log   append-only "<hash> <row>" lines (the offset table)
+    <model>@<variant>/.lock         file lock serializing writers across processes
+
+A vector is written before its offset line, so readers never see an offset
+that points at a missing row.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "1") == "1"
+CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "embedding_cache")
+
+
+class EmbeddingStore:
+    """Append-only hash -> vector store for one model"""
+
+    def __init__(self, model_name, root=None):
+        self.model_name = model_name
+        self.dir = os.path.join(root or CACHE_DIR, model_name.replace("/", "__"))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.offsets_path = os.path.join(self.dir, "offsets.log")
+        self.lock_path = os.path.join(self.dir, ".lock")
+
+        self.dim = None
+        self.offsets = {}
+        self._offsets_read = 0      # bytes of offsets.log already parsed
+        self._vectors = None        # memmap over vectors.f32
+        self._lock = threading.Lock()
+
+    # -----------------------------
+    # INTERNALS
+    # -----------------------------
+    def _refresh(self):
+        """Pick up rows appended by this or other processes since the last read"""
+        if not os.path.exists(self.offsets_path):
+            return
+        size = os.path.getsize(self.offsets_path)
+        if size > self._offsets_read:
+            with open(self.offsets_path, "rb") as f:
+                f.seek(self._offsets_read)
+                chunk = f.read(size - self._offsets_read)
+            # Only consume complete lines; a partial line is finished by its writer
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].decode().splitlines():
+                parts = line.split()
+                if len(parts) == 3 and parts[0] == "#dim":
+                    self.dim = int(parts[1])
+                elif len(parts) == 2:
+                    self.offsets[parts[0]] = int(parts[1])
+            self._offsets_read += end
+            self._vectors = None
+
+        if self._vectors is None and self.dim and os.path.exists(self.vectors_path):
+            rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            if rows:
+                self._vectors = np.memmap(self.vectors_path, dtype="float32", mode="r",
+                                          shape=(rows, self.dim))
+
+    # -----------------------------
+    # PUBLIC API
+    # -----------------------------
+    def get(self, key):
+        """Cached vector for key, or None"""
+        with self._lock:
+            row = self.offsets.get(key)
+            if row is None or self._vectors is None or row >= self._vectors.shape[0]:
+                self._refresh()
+                row = self.offsets.get(key)
+            if row is None or self._vectors is None or row >= self._vectors.shape[0]:
+                return None
+            return np.array(self._vectors[row], dtype="float32")
+
+    def put(self, key, vector):
+        """Store a vector under key (no-op if already present)"""
+        vector = np.ascontiguousarray(vector, dtype="float32").ravel()
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if key in self.offsets:
+                    return
+                if self.dim is None:
+                    self.dim = vector.shape[0]
+                    with open(self.offsets_path, "a") as f:
+                        f.write(f"#dim {self.dim} float32\n")
+                elif vector.shape[0] != self.dim:
+                    raise ValueError(f"Vector dim {vector.shape[0]} != cached dim {self.dim}")
+
+                row_bytes = self.dim * 4
+                with open(self.vectors_path, "ab") as f:
+                    size = f.seek(0, os.SEEK_END)
+                    if size % row_bytes:
+                        # Drop a partial row left behind by an interrupted writer
+                        size -= size % row_bytes
+                        f.truncate(size)
+                    row = size // row_bytes
+                    f.write(vector.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.offsets_path, "a") as f:
+                    f.write(f"{key} {row}\n")
+                self._refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self.offsets)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(model_name):
+    """Shared EmbeddingStore for a model under the configured backend"""
+    from inference_backend import backend_variant
+
+    key = f"{model_name}@{backend_variant()}"
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = EmbeddingStore(key)
+        return store
+
+
+def cached_embedding(model_name, key, compute):
+    """Return the cached vector for key, computing and storing it on a miss.
+
+    compute() is only called on a miss and may return None on failure.
+    """
+    if not ENABLED or not key:
+        return compute()
+
+    store = get_store(model_name)
+    vec = store.get(key)
+    if vec is not None:
+        return vec
+
+    vec = compute()
+    if vec is not None:
+        try:
+            store.put(key, vec)
+        except Exception as e:
+            print(f"Warning: failed to cache embedding {key}: {e}")
+    return vec
+
+
+def cached_embeddings(model_name, keys, compute):
+    """Vectors for several keys at once, computing all misses in one call.
+
+    compute(positions) receives the positions (into keys) of every miss and
+    must return one vector per position, e.g. from a single batched forward
+    pass. Returns a list of vectors aligned with keys.
+    """
+    vecs = [None] * len(keys)
+    store = get_store(model_name) if ENABLED else None
+    if store is not None:
+        for i, key in enumerate(keys):
+            if key:
+                vecs[i] = store.get(key)
+
+    missing = [i for i, vec in enumerate(vecs) if vec is None]
+    if missing:
+        for i, vec in zip(missing, compute(missing)):
+            vecs[i] = vec
+            if store is not None and keys[i]:
+                try:
+                    store.put(keys[i], vec)
+                except Exception as e:
+                    print(f"Warning: failed to cache embedding {keys[i]}: {e}")
+    return vecs
+
+
+def file_hash(path):
+    """MD5 of a file's bytes, matching uploads.md5_hash"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
@@ -0,0 +1,203 @@
+"""
+Immutable, versioned snapshots of the per-user chatbot indexes.
+
+Writers publish every saved index to INDEX_SNAPSHOT_DIR (a directory on
+shared storage; a local directory works for testing):
+
+    <INDEX_SNAPSHOT_DIR>/<user>/v00000042/index.faiss
+    <INDEX_SNAPSHOT_DIR>/<user>/v00000042/meta.json
+    <INDEX_SNAPSHOT_DIR>/<user>/MANIFEST.json     {"version": 42, ...}
+
+A version is written into a temporary directory and renamed into place
+before the manifest is switched to it (write tmp + os.replace), so readers
+only ever see complete snapshots. Published versions are never modified;
+the newest INDEX_SNAPSHOT_KEEP are kept.
+
+Reader nodes (INDEX_SNAPSHOT_READER=1) answer chatbot queries from the
+latest snapshot. Each version is pulled into INDEX_SNAPSHOT_CACHE (when set)
+and memory-mapped read-only; the manifest is only re-read when a stat shows
+it changed.
+"""
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import faiss
+
+SNAPSHOT_DIR = os.environ.get("INDEX_SNAPSHOT_DIR", "")
+SNAPSHOT_CACHE = os.environ.get("INDEX_SNAPSHOT_CACHE", "")
+SNAPSHOT_KEEP = int(os.environ.get("INDEX_SNAPSHOT_KEEP", "3"))
+READER = os.environ.get("INDEX_SNAPSHOT_READER", "0") == "1"
+
+MANIFEST = "MANIFEST.json"
+INDEX_FILE = "index.faiss"
+META_FILE = "meta.json"
+
+
+def _version_name(version):
+    return f"v{version:08d}"
+
+
+def _user_dir(root, user_id):
+    return os.path.join(root, str(user_id))
+
+
+def _fsync_file(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def read_manifest(user_id, root=None):
+    """The user's manifest dict, or None when nothing was published yet"""
+    path = os.path.join(_user_dir(root or SNAPSHOT_DIR, user_id), MANIFEST)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def manifest_token(user_id, root=None):
+    """Stat-based token that changes whenever a new version is published, None if none was"""
+    try:
+        st = os.stat(os.path.join(_user_dir(root or SNAPSHOT_DIR, user_id), MANIFEST))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def list_users(root=None):
+    """User ids with at least one published snapshot"""
+    root = root or SNAPSHOT_DIR
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.exists(os.path.join(root, name, MANIFEST)))
+
+
+# -----------------------------
+# PUBLISH
+# -----------------------------
+def publish(user_id, idx, meta, root=None):
+    """Write idx + meta as the user's next snapshot version; returns the version"""
+    user_dir = _user_dir(root or SNAPSHOT_DIR, user_id)
+    os.makedirs(user_dir, exist_ok=True)
+
+    tmp_dir = os.path.join(user_dir, f".tmp-{os.getpid()}-{uuid.uuid4().hex}")
+    os.makedirs(tmp_dir)
+    try:
+        faiss.write_index(idx, os.path.join(tmp_dir, INDEX_FILE))
+        with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+            json.dump(meta, f)
+        for name in (INDEX_FILE, META_FILE):
+            _fsync_file(os.path.join(tmp_dir, name))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # The files are complete; publishing is a rename plus a manifest switch
+    with _locked(user_dir):
+        manifest = read_manifest(user_id, root) or {"version": 0}
+        version = manifest["version"] + 1
+        while os.path.exists(os.path.join(user_dir, _version_name(version))):
+            version += 1
+        os.rename(tmp_dir, os.path.join(user_dir, _version_name(version)))
+
+        path = os.path.join(user_dir, MANIFEST)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "path": _version_name(version),
+                       "items": len(meta.get("items", {})), "published_at": time.time()}, f)
+        os.replace(tmp, path)
+        _prune_versions(user_dir)
+    return version
+
+
+@contextlib.contextmanager
+def _locked(user_dir):
+    with open(os.path.join(user_dir, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _prune_versions(user_dir):
+    versions = sorted(name for name in os.listdir(user_dir) if name[:1] == "v" and name[1:].isdigit())
+    for name in versions[:-SNAPSHOT_KEEP]:
+        shutil.rmtree(os.path.join(user_dir, name), ignore_errors=True)
+
+
+# -----------------------------
+# READ
+# -----------------------------
+class SnapshotReader:
+    """Serves the latest published snapshot per user, memory-mapped"""
+
+    def __init__(self, root=None, cache_dir=None):
+        self.root = root or SNAPSHOT_DIR
+        self.cache_dir = cache_dir if cache_dir is not None else SNAPSHOT_CACHE
+        self._loaded = {}   # user -> (manifest stat key, version, idx, meta)
+        self._lock = threading.Lock()
+
+    def _pull(self, user_id, name):
+        """Local directory holding version `name`, copied from shared storage if configured"""
+        src = os.path.join(_user_dir(self.root, user_id), name)
+        if not self.cache_dir:
+            return src
+        dst = os.path.join(_user_dir(self.cache_dir, user_id), name)
+        if not os.path.isdir(dst):
+            tmp = f"{dst}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+            shutil.copytree(src, tmp)
+            try:
+                os.rename(tmp, dst)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)   # another process pulled it
+            _prune_versions(os.path.dirname(dst))
+        return dst
+
+    def latest(self, user_id):
+        """(version, idx, meta) of the user's newest snapshot, or None if none exists"""
+        key = manifest_token(user_id, self.root)
+        if key is None:
+            return None
+
+        with self._lock:
+            loaded = self._loaded.get(user_id)
+            if loaded and loaded[0] == key:
+                return loaded[1:]
+
+            manifest = read_manifest(user_id, self.root)
+            if loaded and loaded[1] == manifest["version"]:
+                self._loaded[user_id] = (key,) + loaded[1:]
+                return loaded[1:]
+
+            local = self._pull(user_id, manifest["path"])
+            idx = faiss.read_index(os.path.join(local, INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            with open(os.path.join(local, META_FILE)) as f:
+                meta = json.load(f)
+            self._loaded[user_id] = (key, manifest["version"], idx, meta)
+            return manifest["version"], idx, meta
+
+
+reader = SnapshotReader()
+
+
+def main():
+    """Publish every local index once, e.g. when first enabling snapshots"""
+    from per_user_index import list_indexed_users, load_user_index
+
+    if not SNAPSHOT_DIR:
+        raise SystemExit("Set INDEX_SNAPSHOT_DIR to the shared snapshot directory")
+    for user_id in list_indexed_users():
+        idx, meta = load_user_index(user_id)
+        print(f"{user_id}: published version {publish(user_id, idx, meta)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Process-pool workers for the async serving mode (asgi_app.py).
+
+Each worker process loads the CLIP models once in its initializer and keeps
+them resident, so decoding, hashing, classification and embedding never run
+on the event loop. Functions here must stay importable without the web app
+(workers are started with the "spawn" method and import only this module).
+"""
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# Number of worker processes, each holding its own copy of the models
+POOL_WORKERS = int(os.environ.get("ASGI_POOL_WORKERS", "2"))
+
+# Models each worker loads up front
+WORKER_MODELS = ("classifier", "prototypes", "embedder")
+
+
+# -----------------------------
+# WORKER SIDE
+# -----------------------------
+def _init_worker(ready_queue=None):
+    """Load models once per worker process, then report this worker's status"""
+    import model_registry
+    # Imported for their side effect of registering the models warmed below
+    import classification  # noqa: F401 (registers "classifier" and "prototypes")
+    import clip_embed_utils  # noqa: F401 (registers "embedder")
+
+    errors = model_registry.warm_up(list(WORKER_MODELS))
+    if errors:
+        print(f"Worker {os.getpid()} failed to load models: {errors}")
+    if ready_queue is not None:
+        ready_queue.put(worker_status())
+
+
+def _decode(image_bytes):
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    return img
+
+
+def decode_and_hash(image_bytes):
+    """Validate an upload and return (perceptual hash, colour signature),
+    both None when near-duplicate detection is disabled.
+
+    Raises ValueError for bytes that are not a readable image.
+    """
+    import near_duplicates
+
+    try:
+        img = _decode(image_bytes)
+    except Exception as e:
+        raise ValueError("Invalid image file") from e
+    if not near_duplicates.ENABLED:
+        return None, None
+    return near_duplicates.phash(img), near_duplicates.color_signature(img)
+
+
+def classify(image_bytes, image_hash, enhanced=False):
+    """{"position", "style", "color"} for an upload"""
+    from classification import classify_all_attributes_efficient, classify_with_confidence_boost
+
+    img = _decode(image_bytes)
+    if enhanced:
+        return classify_with_confidence_boost(img, "all", image_hash=image_hash)
+    return classify_all_attributes_efficient(img, image_hash=image_hash)
+
+
+def index_image(user_id, image_path, style, color, position, image_hash):
+    """Embed an image and add it to the user's chatbot index"""
+    from per_user_index import add_image_for_user
+
+    return add_image_for_user(user_id, image_path, style, color, position, image_hash=image_hash,
+                              source="upload")
+
+
+def worker_pid():
+    """Cheap job used to make the executor start its processes"""
+    return os.getpid()
+
+
+def worker_status():
+    """Model load state as seen from inside a worker"""
+    import model_registry
+
+    return {
+        "pid": os.getpid(),
+        "ready": model_registry.is_ready(list(WORKER_MODELS)),
+        "models": model_registry.status(),
+    }
+
+
+# -----------------------------
+# PARENT SIDE
+# -----------------------------
+def create_pool(workers=POOL_WORKERS):
+    """(ProcessPoolExecutor, ready queue): each worker loads the models on start
+    and then puts its worker_status() on the queue, exactly once per process"""
+    ctx = multiprocessing.get_context("spawn")
+    ready_queue = ctx.Queue()
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(ready_queue,),
+    )
+    return pool, ready_queue
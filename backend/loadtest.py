@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Self-contained load test for the backend.
+
+Starts a throwaway Postgres cluster (initdb/pg_ctl in a temporary directory)
+and the app with the deterministic fake CLIP backend (CLIP_BACKEND=fake, no
+model weights), seeds a few users with uploads, then drives a mixed
+upload/query/history workload at a fixed concurrency for a fixed time and
+reports throughput, latency percentiles and error rates per operation.
+Everything (database, images, indexes, caches) lives in the temporary
+directory and is removed afterwards.
+
+The app's SQL is Postgres-specific, so a local Postgres is required: the
+initdb/pg_ctl binaries on PATH (or under /usr/lib/postgresql/*/bin), or
+--external-db to use the DB_* environment variables (point them at a
+scratch database; tables are created if missing). --url skips all setup and
+loads an already running server.
+
+Usage: python loadtest.py [--concurrency 8] [--duration 30] [--mix upload=2,query=6,history=2]
+                          [--users 5] [--seed-uploads 5] [--fake-latency-ms 20]
+                          [--server flask|asgi] [--out results.json]
+"""
+import argparse
+import collections
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+from PIL import Image
+
+from bench_suite import TEXT_QUERIES
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_NAME = "loadtest"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL,
+    image_path TEXT NOT NULL,
+    position TEXT,
+    style TEXT,
+    color TEXT,
+    md5_hash TEXT,
+    uploaded_at TIMESTAMP
+);
+"""
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+# -----------------------------
+# POSTGRES STAND-IN
+# -----------------------------
+def _pg_bin(name):
+    found = shutil.which(name) or sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+    if not found:
+        raise SystemExit(f"{name} not found; install Postgres or run with --external-db / --url")
+    return found if isinstance(found, str) else found[-1]
+
+
+class TempPostgres:
+    """A private Postgres cluster in a temporary directory, trust auth on localhost"""
+
+    def __init__(self, workdir):
+        self.data_dir = os.path.join(workdir, "pgdata")
+        self.port = _free_port()
+
+    def start(self):
+        subprocess.run([_pg_bin("initdb"), "-D", self.data_dir, "-U", "postgres", "--auth=trust"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([_pg_bin("pg_ctl"), "-D", self.data_dir, "-w", "-l", self.data_dir + ".log",
+                        "-o", f"-p {self.port} -k {self.data_dir} -c listen_addresses=localhost", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        import psycopg2
+        conn = psycopg2.connect(dbname="postgres", user="postgres", host="localhost", port=self.port)
+        conn.autocommit = True
+        conn.cursor().execute(f"CREATE DATABASE {DB_NAME}")
+        conn.close()
+        return {"DB_NAME": DB_NAME, "DB_USER": "postgres", "DB_PASSWORD": "",
+                "DB_HOST": "localhost", "DB_PORT": str(self.port)}
+
+    def stop(self):
+        subprocess.run([_pg_bin("pg_ctl"), "-D", self.data_dir, "-m", "fast", "stop"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def create_schema(db_env):
+    import psycopg2
+    conn = psycopg2.connect(dbname=db_env["DB_NAME"], user=db_env["DB_USER"], password=db_env["DB_PASSWORD"],
+                            host=db_env["DB_HOST"], port=db_env["DB_PORT"])
+    with conn, conn.cursor() as cur:
+        cur.execute(SCHEMA)
+    conn.close()
+
+
+# -----------------------------
+# APP UNDER TEST
+# -----------------------------
+def start_server(kind, port, workdir, db_env, fake_latency_ms):
+    """Run the app from workdir (so uploads/indexes/caches land there) with the fake backend"""
+    env = dict(os.environ, **db_env)
+    env.update({
+        "CLIP_BACKEND": "fake",
+        "CLIP_FAKE_LATENCY_MS": str(fake_latency_ms),
+        "METRICS_ENABLED": "1",
+        "WARM_UP_MODELS": "1",
+        "INDEX_DIR": os.path.join(workdir, "indexes"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embedding_cache"),
+        "CLIP_PROTOTYPE_DIR": os.path.join(workdir, "prototype_cache"),
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    if kind == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi_app:app", "--port", str(port), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-c",
+               f"from app import app; app.run(port={port}, threaded=True, debug=False, use_reloader=False)"]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/ready", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except urllib.error.HTTPError:
+            pass   # 503 while models load
+        except OSError:
+            pass   # not listening yet
+        time.sleep(0.5)
+    raise SystemExit(f"Server at {base_url} did not become ready within {timeout}s")
+
+
+# -----------------------------
+# REQUESTS
+# -----------------------------
+def _request(url, data=None, headers=None, timeout=60):
+    """(status, body bytes); HTTP errors are returned, not raised"""
+    req = urllib.request.Request(url, data=data, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, content_type) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: {content_type}\r\n\r\n'.encode())
+        body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def synthetic_jpeg(rng, size=160):
+    """A random blocky 'garment' photo; different bytes on every call"""
+    blocks = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+    img = Image.fromarray(blocks).resize((size, size), Image.NEAREST)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+class Workload:
+    """The operations a simulated client performs"""
+
+    def __init__(self, base_url, users, dup_ratio):
+        self.base_url = base_url
+        self.users = users
+        self.dup_ratio = dup_ratio
+        self._recent = collections.deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def upload(self, rng, user):
+        with self._lock:
+            reuse = self._recent and rng.random() < self.dup_ratio
+            data = rng.choice(list(self._recent)) if reuse else None
+        if data is None:
+            data = synthetic_jpeg(np.random.default_rng(rng.getrandbits(64)))
+            with self._lock:
+                self._recent.append(data)
+        body, headers = _multipart({"username": user}, {"image": ("photo.jpg", data, "image/jpeg")})
+        return _request(f"{self.base_url}/classify", body, headers)
+
+    def query(self, rng, user):
+        body = json.dumps({"user_id": user, "query": rng.choice(TEXT_QUERIES)}).encode()
+        return _request(f"{self.base_url}/chatbot/query", body, {"Content-Type": "application/json"})
+
+    def history(self, rng, user):
+        return _request(f"{self.base_url}/history/{user}")
+
+
+# -----------------------------
+# RUN + REPORT
+# -----------------------------
+def run_load(workload, mix, concurrency, duration, seed=0):
+    """Drive the mix from `concurrency` client threads; returns {op: [(status, seconds), ...]}"""
+    ops, weights = zip(*mix.items())
+    samples = collections.defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(n):
+        rng = random.Random(seed * 1000 + n)
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights)[0]
+            user = rng.choice(workload.users)
+            start = time.perf_counter()
+            try:
+                status, _ = getattr(workload, op)(rng, user)
+            except Exception:
+                status = None   # connection error / timeout
+            with lock:
+                samples[op].append((status, time.perf_counter() - start))
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples
+
+
+def summarize(samples, elapsed):
+    """Per-operation and overall counts, rates and latency percentiles"""
+    report = {}
+    everything = [s for op_samples in samples.values() for s in op_samples]
+    for op, op_samples in sorted(samples.items()) + [("all", everything)]:
+        if not op_samples:
+            continue
+        statuses = [status for status, _ in op_samples]
+        ok_latencies = np.array([t for status, t in op_samples if status and status < 400]) * 1000.0
+        rejected = sum(1 for s in statuses if s == 503)
+        errors = sum(1 for s in statuses if s is None or (s >= 400 and s != 503))
+        report[op] = {
+            "requests": len(op_samples),
+            "throughput_per_s": round(len(op_samples) / elapsed, 2),
+            "ok": len(op_samples) - rejected - errors,
+            "rejected_503": rejected,
+            "errors": errors,
+            "error_rate": round(errors / len(op_samples), 4),
+        }
+        if ok_latencies.size:
+            for p in (50, 90, 95, 99):
+                report[op][f"p{p}_ms"] = round(float(np.percentile(ok_latencies, p)), 1)
+            report[op]["max_ms"] = round(float(ok_latencies.max()), 1)
+    return report
+
+
+def print_report(report):
+    cols = [("requests", "requests"), ("throughput_per_s", "req/s"), ("ok", "ok"), ("rejected_503", "503"),
+            ("errors", "errors"), ("p50_ms", "p50 ms"), ("p95_ms", "p95 ms"), ("p99_ms", "p99 ms"),
+            ("max_ms", "max ms")]
+    print(f"{'op':<10}" + "".join(f"{title:>10}" for _, title in cols))
+    for op, row in report.items():
+        print(f"{op:<10}" + "".join(f"{row.get(key, '-'):>10}" for key, _ in cols))
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        if op not in ("upload", "query", "history"):
+            raise SystemExit(f"Unknown operation in --mix: {op}")
+        mix[op] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--mix", default="upload=2,query=6,history=2", help="operation weights")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--seed-uploads", type=int, default=5, help="uploads per user before measuring")
+    parser.add_argument("--dup-ratio", type=float, default=0.1, help="share of uploads that repeat an earlier image")
+    parser.add_argument("--fake-latency-ms", type=float, default=20, help="simulated CLIP time per call")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--external-db", action="store_true", help="use the DB_* environment instead of a temp cluster")
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--out", help="write the report (and server metrics) as JSON")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="dress_loadtest_")
+    postgres = server = None
+    try:
+        base_url = args.url
+        if not base_url:
+            if args.external_db:
+                db_env = {k: os.environ.get(k, d) for k, d in (
+                    ("DB_NAME", "loga"), ("DB_USER", "postgres"), ("DB_PASSWORD", "loga"),
+                    ("DB_HOST", "localhost"), ("DB_PORT", "5432"))}
+            else:
+                postgres = TempPostgres(workdir)
+                db_env = postgres.start()
+            create_schema(db_env)
+            port = _free_port()
+            server = start_server(args.server, port, workdir, db_env, args.fake_latency_ms)
+            base_url = f"http://localhost:{port}"
+        wait_ready(base_url)
+
+        users = [f"loadtest_user_{i}" for i in range(args.users)]
+        workload = Workload(base_url, users, args.dup_ratio)
+        seed_rng = random.Random(0)
+        for user in users:
+            for _ in range(args.seed_uploads):
+                workload.upload(seed_rng, user)
+
+        print(f"Running {args.mix} at concurrency {args.concurrency} for {args.duration:.0f}s against {base_url}")
+        start = time.perf_counter()
+        samples = run_load(workload, mix, args.concurrency, args.duration)
+        report = summarize(samples, time.perf_counter() - start)
+        print_report(report)
+
+        if args.out:
+            _, server_metrics = _request(f"{base_url}/metrics")
+            with open(args.out, "w") as f:
+                json.dump({"config": vars(args), "results": report,
+                           "server_metrics": server_metrics.decode()}, f, indent=2)
+            print(f"Wrote {args.out}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+        if postgres:
+            postgres.stop()
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
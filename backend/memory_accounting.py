@@ -0,0 +1,194 @@
+"""
+Opt-in memory accounting for finding which route makes workers grow.
+
+With MEMORY_PROFILING=1 the app traces Python allocations with tracemalloc
+and samples the process RSS. For every request and every metrics.stage()
+block it records:
+
+- retained: traced bytes still allocated when the request/stage ends
+  (a steadily positive total for one endpoint is the leak signature),
+- peak: the traced high-water mark above the starting point,
+- rss: change in resident set size (includes native memory such as FAISS
+  indexes, decoded images and model weights, which tracemalloc cannot see).
+
+GET /debug/memory returns these per endpoint and stage together with the
+allocation sites that grew most since profiling started (or since the last
+?reset=1). The same summary is logged every MEMORY_LOG_INTERVAL seconds.
+
+Tracing slows allocations down noticeably, so leave it off in production.
+tracemalloc's peak is process-wide: with concurrent requests the peaks
+overlap, so hunt peaks at concurrency 1.
+"""
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import metrics
+
+ENABLED = os.environ.get("MEMORY_PROFILING", "0") == "1"
+TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "10"))
+LOG_INTERVAL = float(os.environ.get("MEMORY_LOG_INTERVAL", "300"))
+TOP_SITES = 10
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Frames that only show the profiler itself
+_IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>")
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _Usage:
+    """Running totals for one endpoint or stage"""
+
+    __slots__ = ("count", "retained_total", "retained_max", "peak_max", "rss_total")
+
+    def __init__(self):
+        self.count = 0
+        self.retained_total = 0
+        self.retained_max = 0
+        self.peak_max = 0
+        self.rss_total = 0
+
+    def add(self, retained, peak, rss):
+        self.count += 1
+        self.retained_total += retained
+        self.retained_max = max(self.retained_max, retained)
+        self.peak_max = max(self.peak_max, peak)
+        self.rss_total += rss
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "retained_bytes_total": self.retained_total,
+            "retained_bytes_avg": self.retained_total // self.count if self.count else 0,
+            "retained_bytes_max": self.retained_max,
+            "peak_bytes_max": self.peak_max,
+            "rss_bytes_total": self.rss_total,
+        }
+
+
+_lock = threading.Lock()
+_endpoints = defaultdict(_Usage)
+_stages = defaultdict(_Usage)
+_baseline = None
+_started_at = None
+
+
+# -----------------------------
+# RECORDING
+# -----------------------------
+def _sample():
+    return tracemalloc.get_traced_memory()[0], rss_bytes()
+
+
+def request_started():
+    """Starting point for request_finished; resets the traced peak"""
+    tracemalloc.reset_peak()
+    return _sample()
+
+
+def request_finished(endpoint, start):
+    current, rss = _sample()
+    peak = tracemalloc.get_traced_memory()[1]
+    with _lock:
+        _endpoints[endpoint].add(current - start[0], max(peak - start[0], 0), rss - start[1])
+
+
+class _StageListener:
+    """Called by metrics.stage() around every pipeline stage"""
+
+    def enter(self, name):
+        return _sample()
+
+    def exit(self, name, start):
+        current, rss = _sample()
+        peak = tracemalloc.get_traced_memory()[1]
+        with _lock:
+            _stages[name].add(current - start[0], max(peak - start[0], 0), rss - start[1])
+
+
+# -----------------------------
+# REPORTING
+# -----------------------------
+def top_sites(limit=TOP_SITES):
+    """Allocation sites (file:line) that grew most since the baseline snapshot"""
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, name) for name in _IGNORED_FILES]
+    )
+    stats = snapshot.compare_to(_baseline, "lineno") if _baseline else snapshot.statistics("lineno")
+    return [
+        {
+            "site": str(stat.traceback[0]),
+            "size_bytes": stat.size,
+            "size_diff_bytes": getattr(stat, "size_diff", stat.size),
+            "count_diff": getattr(stat, "count_diff", stat.count),
+        }
+        for stat in stats[:limit]
+    ]
+
+
+def report(limit=TOP_SITES, reset=False):
+    """Everything /debug/memory shows; reset=True starts a new baseline and clears the totals"""
+    global _baseline
+    current, peak = tracemalloc.get_traced_memory()
+    with _lock:
+        endpoints = {name: usage.as_dict() for name, usage in _endpoints.items()}
+        stages = {name: usage.as_dict() for name, usage in _stages.items()}
+    result = {
+        "rss_bytes": rss_bytes(),
+        "traced_bytes": current,
+        "traced_peak_bytes": peak,
+        "profiling_seconds": round(time.time() - _started_at, 1),
+        "endpoints": endpoints,
+        "stages": stages,
+        "top_sites": top_sites(limit),
+    }
+    if reset:
+        _baseline = tracemalloc.take_snapshot()
+        with _lock:
+            _endpoints.clear()
+            _stages.clear()
+    return result
+
+
+def _log_periodically():
+    while True:
+        time.sleep(LOG_INTERVAL)
+        try:
+            summary = report(limit=5)
+        except Exception as e:
+            print(f"Memory report failed: {e}")
+            continue
+        print(f"[memory] rss {summary['rss_bytes'] / 2**20:.1f} MiB, traced {summary['traced_bytes'] / 2**20:.1f} MiB")
+        worst = sorted(summary["endpoints"].items(), key=lambda kv: kv[1]["retained_bytes_total"], reverse=True)
+        for endpoint, usage in worst[:5]:
+            print(f"[memory]   {endpoint}: {usage['count']} requests, "
+                  f"{usage['retained_bytes_total'] / 2**10:.0f} KiB retained, "
+                  f"peak {usage['peak_bytes_max'] / 2**10:.0f} KiB")
+        for site in summary["top_sites"]:
+            print(f"[memory]   {site['size_diff_bytes'] / 2**10:+.0f} KiB  {site['site']}")
+
+
+def start():
+    """Start tracing, take the baseline and attach to metrics stages and the periodic log"""
+    global _baseline, _started_at
+    if tracemalloc.is_tracing():
+        return
+    tracemalloc.start(TRACE_FRAMES)
+    _baseline = tracemalloc.take_snapshot()
+    _started_at = time.time()
+    metrics.set_stage_listener(_StageListener())
+    if LOG_INTERVAL > 0:
+        threading.Thread(target=_log_periodically, name="memory-log", daemon=True).start()
+    print(f"Memory profiling on (tracemalloc, {TRACE_FRAMES} frames)")
@@ -0,0 +1,198 @@
+"""
+Lightweight in-process metrics: counters and latency histograms per pipeline
+stage, rendered in Prometheus text format for the /metrics endpoint.
+
+Disabled unless METRICS_ENABLED=1. When disabled, stage() hands back a shared
+no-op context manager and inc()/observe() return immediately, so leaving the
+instrumentation in hot paths costs next to nothing.
+"""
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+
+PREFIX = "dress"
+
+# Latency buckets in seconds (upper bounds), spanning sub-millisecond FAISS
+# searches up to multi-second CPU inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NOOP = contextlib.nullcontext()
+
+_lock = threading.Lock()
+_counters = {}      # (name, labels) -> float
+_histograms = {}    # (name, labels) -> _Histogram
+_help = {}          # name -> help text
+_stage_listener = None   # notified around every stage (memory profiling)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# -----------------------------
+# RECORDING
+# -----------------------------
+def enable(enabled=True):
+    """Turn metrics on/off at runtime (e.g. from scripts and benchmarks)"""
+    global ENABLED
+    ENABLED = enabled
+
+
+def describe(name, help_text):
+    """Attach a HELP line to a metric"""
+    _help[name] = help_text
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Record one observation in a histogram"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        with _lock:
+            hist = _histograms.setdefault(key, _Histogram(buckets))
+    hist.observe(value)
+
+
+def set_stage_listener(listener):
+    """Have listener.enter(name) -> token and listener.exit(name, token)
+    called around every stage, even with metrics disabled (None detaches)"""
+    global _stage_listener
+    _stage_listener = listener
+
+
+class _StageTimer:
+    __slots__ = ("name", "start", "listener", "token")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.listener = _stage_listener
+        if self.listener is not None:
+            self.token = self.listener.enter(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe("stage_duration_seconds", time.perf_counter() - self.start, stage=self.name)
+        if exc_type is not None:
+            inc("stage_errors_total", stage=self.name)
+        if self.listener is not None:
+            self.listener.exit(self.name, self.token)
+        return False
+
+
+def stage(name):
+    """Time a block of code as a named pipeline stage:
+
+        with metrics.stage("embed"):
+            vec = embed_image(path)
+    """
+    if not ENABLED and _stage_listener is None:
+        return _NOOP
+    return _StageTimer(name)
+
+
+def reset():
+    """Drop all recorded values"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# -----------------------------
+# EXPORT
+# -----------------------------
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render_prometheus():
+    """All metrics in Prometheus text exposition format"""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items(), key=lambda kv: kv[0])
+
+    lines = []
+    seen = set()
+
+    for (name, labels), value in counters:
+        full = f"{PREFIX}_{name}"
+        if full not in seen:
+            seen.add(full)
+            if name in _help:
+                lines.append(f"# HELP {full} {_help[name]}")
+            lines.append(f"# TYPE {full} counter")
+        lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), hist in histograms:
+        full = f"{PREFIX}_{name}"
+        if full not in seen:
+            seen.add(full)
+            if name in _help:
+                lines.append(f"# HELP {full} {_help[name]}")
+            lines.append(f"# TYPE {full} histogram")
+        with hist.lock:
+            counts = list(hist.counts)
+            total, count = hist.sum, hist.count
+        cumulative = 0
+        for bound, n in zip(hist.buckets, counts):
+            cumulative += n
+            lines.append(f"{full}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{full}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{full}_sum{_format_labels(labels)} {total!r}")
+        lines.append(f"{full}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe("stage_duration_seconds", "Time spent in each pipeline stage")
+describe("stage_errors_total", "Pipeline stages that raised an exception")
+describe("request_duration_seconds", "HTTP request latency by endpoint")
+describe("requests_total", "HTTP requests by endpoint and status code")
+describe("duplicate_uploads_total", "Uploads answered from an existing identical upload")
+describe("index_failures_total", "Uploads that could not be added to the chatbot index")
+describe("near_duplicate_uploads_total", "Uploads answered from a perceptually identical earlier upload")
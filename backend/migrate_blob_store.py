@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Move existing uploads into the content-addressed blob store.
+
+Legacy images live flat in uploaded_images/ ({username}_{timestamp}_{name}
+from /classify, {uuid}_{name} from /chatbot/upload), one copy per upload.
+This script moves each one to uploaded_images/ab/cd/<md5><ext> (identical
+files collapse into one), rewrites uploads.image_path and the per-user index
+metadata, then recounts every blob's references from scratch. It is safe to
+run again, e.g. after an interrupted run.
+
+Run from the backend directory with the server stopped:
+
+    python migrate_blob_store.py [--dry-run]
+"""
+import argparse
+import os
+from collections import Counter
+
+import psycopg2
+
+import blob_store
+from per_user_index import list_indexed_users, load_user_index, save_user_index
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.environ.get("DB_NAME", "loga"),
+        user=os.environ.get("DB_USER", "postgres"),
+        password=os.environ.get("DB_PASSWORD", "loga"),
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=os.environ.get("DB_PORT", "5432"),
+    )
+
+
+def migrate(dry_run=False):
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute("SELECT id, username, image_path, md5_hash FROM uploads")
+    uploads = cur.fetchall()
+    metas = {user: load_user_index(user) for user in list_indexed_users()}
+
+    # Legacy file (absolute path) -> known MD5, if the uploads row has one
+    legacy = {}
+    for _, _, image_path, md5_hash in uploads:
+        if image_path and not blob_store.is_blob(image_path):
+            legacy[os.path.abspath(image_path)] = md5_hash
+    for _, meta in metas.values():
+        for item in meta["items"].values():
+            if not blob_store.is_blob(item["path"]):
+                legacy.setdefault(os.path.abspath(item["path"]), None)
+
+    # 1. Move files into the store
+    moved = {}
+    missing = 0
+    for old_path, md5_hash in legacy.items():
+        if not os.path.exists(old_path):
+            missing += 1
+            continue
+        if dry_run:
+            moved[old_path] = old_path
+            continue
+        new_path = blob_store.import_file(old_path, md5_hash)
+        moved[old_path] = os.path.relpath(new_path)
+    print(f"{len(moved)} legacy files moved into the store ({missing} already missing)")
+    if dry_run:
+        print("Dry run, nothing changed")
+        return
+
+    # 2. Point uploads rows at the new paths
+    updates = [
+        (moved[os.path.abspath(image_path)], upload_id)
+        for upload_id, _, image_path, _ in uploads
+        if image_path and os.path.abspath(image_path) in moved
+    ]
+    cur.executemany("UPDATE uploads SET image_path = %s WHERE id = %s", updates)
+    conn.commit()
+    print(f"{len(updates)} uploads rows updated")
+
+    # 3. Point index items at the new paths
+    for user, (idx, meta) in metas.items():
+        changed = False
+        for item in meta["items"].values():
+            new_path = moved.get(os.path.abspath(item["path"]))
+            if new_path:
+                item["path"] = os.path.abspath(new_path)
+                changed = True
+        if changed:
+            save_user_index(user, idx, meta)
+
+    # 4. Recount references: one per uploads row, one per chatbot-only index item
+    cur.execute("SELECT username, image_path FROM uploads")
+    rows = cur.fetchall()
+    counts = Counter()
+    upload_paths = {}
+    for username, image_path in rows:
+        if image_path and blob_store.is_blob(image_path):
+            counts[os.path.abspath(image_path)] += 1
+            upload_paths.setdefault(username, set()).add(os.path.abspath(image_path))
+    for user, (_, meta) in metas.items():
+        for path in {item["path"] for item in meta["items"].values()}:
+            if blob_store.is_blob(path) and path not in upload_paths.get(user, ()):
+                counts[path] += 1
+    for path, count in counts.items():
+        if os.path.exists(path):
+            blob_store.set_refs(path, count)
+    print(f"Reference counts written for {len(counts)} stored images")
+
+    cur.close()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be moved")
+    args = parser.parse_args()
+    migrate(args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
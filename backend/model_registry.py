@@ -0,0 +1,118 @@
+"""
+Lazy model registry.
+
+Models are registered by name together with a loader function and are only
+built on first use (or on an explicit warm-up call), so importing the app or
+running CLI scripts does not pay the cost of loading CLIP.
+"""
+import threading
+import time
+
+# name -> loader callable
+_LOADERS = {}
+
+# name -> loaded model object
+_MODELS = {}
+
+# name -> {"state": ..., "load_seconds": ..., "error": ...}
+_STATUS = {}
+
+_lock = threading.Lock()
+_name_locks = {}
+
+
+# -----------------------------
+# REGISTRATION
+# -----------------------------
+def register(name, loader):
+    """Register a loader for a model; nothing is loaded until first use"""
+    with _lock:
+        _LOADERS[name] = loader
+        _name_locks.setdefault(name, threading.Lock())
+        if name not in _MODELS:
+            _STATUS[name] = {"state": "unloaded", "load_seconds": None, "error": None}
+
+
+def registered_models():
+    """Names of all registered models"""
+    return list(_LOADERS)
+
+
+# -----------------------------
+# LOADING
+# -----------------------------
+def get(name):
+    """Return the model registered under name, loading it on first use"""
+    model = _MODELS.get(name)
+    if model is not None:
+        return model
+
+    if name not in _LOADERS:
+        raise KeyError(f"No model registered under '{name}'")
+
+    # One lock per model so two different models can load in parallel,
+    # while concurrent callers of the same model wait for a single load.
+    with _name_locks[name]:
+        model = _MODELS.get(name)
+        if model is not None:
+            return model
+
+        _STATUS[name] = {"state": "loading", "load_seconds": None, "error": None}
+        start = time.perf_counter()
+        try:
+            model = _LOADERS[name]()
+        except Exception as e:
+            _STATUS[name] = {"state": "error", "load_seconds": None, "error": str(e)}
+            raise
+
+        _MODELS[name] = model
+        _STATUS[name] = {
+            "state": "ready",
+            "load_seconds": round(time.perf_counter() - start, 3),
+            "error": None
+        }
+        print(f"Model '{name}' loaded in {_STATUS[name]['load_seconds']}s")
+        return model
+
+
+def warm_up(names=None):
+    """Load the given models (default: all registered) ahead of the first request"""
+    errors = {}
+    for name in names or registered_models():
+        try:
+            get(name)
+        except Exception as e:
+            errors[name] = str(e)
+    return errors
+
+
+def warm_up_in_background(names=None):
+    """Start loading models in a daemon thread and return immediately"""
+    thread = threading.Thread(target=warm_up, args=(names,), daemon=True)
+    thread.start()
+    return thread
+
+
+def unload(name):
+    """Drop a loaded model so it is rebuilt on next use"""
+    with _lock:
+        _MODELS.pop(name, None)
+        if name in _LOADERS:
+            _STATUS[name] = {"state": "unloaded", "load_seconds": None, "error": None}
+
+
+# -----------------------------
+# STATUS
+# -----------------------------
+def is_loaded(name):
+    return name in _MODELS
+
+
+def is_ready(names=None):
+    """True when every given model (default: all registered) is loaded"""
+    return all(is_loaded(name) for name in (names or registered_models()))
+
+
+def status():
+    """Snapshot of load state for every registered model"""
+    return {name: dict(_STATUS[name]) for name in registered_models()}
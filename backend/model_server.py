@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Shared CLIP model server.
+
+One process owns the CLIP weights and serves embeddings to any number of
+HTTP workers over a Unix socket. Requests from all connected workers are
+grouped by (operation, model) and run as a single batched forward pass.
+
+Workers talk to it through inference_backend.RemoteBackend, enabled with
+CLIP_BACKEND=remote and MODEL_SERVER_SOCKET=<path>. The server and its
+workers must share a secret in MODEL_SERVER_AUTHKEY; the server refuses to
+start without one, and its socket is only accessible to its own user.
+
+Usage: python model_server.py [--socket PATH] [--backend torch|onnx]
+                              [--max-batch N] [--max-wait-ms MS]
+"""
+import argparse
+import os
+import queue
+import stat
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import numpy as np
+from PIL import Image
+
+import model_registry
+from classification import CLASSIFIER_MODEL_NAME
+from clip_embed_utils import EMBED_MODEL_NAME
+from inference_backend import MODEL_SERVER_SOCKET, load_backend, require_authkey
+
+SERVED_MODELS = [EMBED_MODEL_NAME, CLASSIFIER_MODEL_NAME]
+
+OPERATIONS = {"image_features", "text_features"}
+
+
+class _Pending:
+    """One worker request waiting for its slice of a batch"""
+
+    def __init__(self, op, model, items):
+        self.op = op
+        self.model = model
+        self.items = items
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# -----------------------------
+# BATCHER
+# -----------------------------
+class Batcher:
+    """Collects requests from all connections and runs them in batches"""
+
+    def __init__(self, max_batch=32, max_wait_ms=5):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.batches_run = 0
+        self.items_run = 0
+
+    def submit(self, op, model, items):
+        pending = _Pending(op, model, items)
+        self.requests.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise RuntimeError(pending.error)
+        return pending.result
+
+    def _collect(self):
+        """Take the next request plus compatible ones that arrive within max_wait"""
+        first = self.requests.get()
+        batch = [first]
+        size = len(first.items)
+        leftovers = []
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                nxt = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if (nxt.op, nxt.model) == (first.op, first.model):
+                batch.append(nxt)
+                size += len(nxt.items)
+            else:
+                leftovers.append(nxt)
+
+        # Requests for another model/op go back in line for the next batch
+        for pending in leftovers:
+            self.requests.put(pending)
+        return batch
+
+    def _run(self, batch):
+        op, model = batch[0].op, batch[0].model
+        items = [item for pending in batch for item in pending.items]
+        backend = model_registry.get(model)
+
+        if op == "image_features":
+            feats = backend.image_features([Image.fromarray(arr) for arr in items])
+        else:
+            feats = backend.text_features(items)
+
+        offset = 0
+        for pending in batch:
+            n = len(pending.items)
+            pending.result = feats[offset:offset + n]
+            offset += n
+
+        self.batches_run += 1
+        self.items_run += len(items)
+
+    def serve_forever(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run(batch)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = str(e)
+            for pending in batch:
+                pending.done.set()
+
+
+# -----------------------------
+# CONNECTION HANDLING
+# -----------------------------
+def _handle_connection(conn, batcher):
+    """Serve requests from one worker connection until it closes"""
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+
+            op = request.get("op")
+            model = request.get("model")
+            try:
+                if op != "stats" and model not in SERVED_MODELS:
+                    raise KeyError(f"Model '{model}' is not served here")
+
+                if op == "info":
+                    backend = model_registry.get(model)
+                    response = {"ok": True, "logit_scale": backend.logit_scale}
+                elif op == "stats":
+                    response = {
+                        "ok": True,
+                        "batches": batcher.batches_run,
+                        "items": batcher.items_run,
+                        "models": {name: model_registry.status()[name] for name in SERVED_MODELS}
+                    }
+                elif op in OPERATIONS:
+                    feats = batcher.submit(op, model, request["items"])
+                    response = {"ok": True, "features": np.asarray(feats, dtype="float32")}
+                else:
+                    raise ValueError(f"Unknown operation '{op}'")
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+
+            conn.send(response)
+    finally:
+        conn.close()
+
+
+def _private_socket_dir(socket_path):
+    """Create the socket's directory as 0700, or refuse one other users can write to"""
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    st = os.stat(socket_dir)
+    if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise SystemExit(f"{socket_dir} must be owned by this user and not group/world-writable; "
+                         f"point MODEL_SERVER_SOCKET at a private directory")
+
+
+def serve(socket_path=None, backend_kind=None, max_batch=32, max_wait_ms=5, preload=True):
+    try:
+        authkey = require_authkey()
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    socket_path = socket_path or MODEL_SERVER_SOCKET
+    _private_socket_dir(socket_path)
+    backend_kind = backend_kind or os.environ.get("MODEL_SERVER_BACKEND", "torch")
+
+    for model_name in SERVED_MODELS:
+        model_registry.register(
+            model_name, lambda name=model_name: load_backend(name, kind=backend_kind)
+        )
+    if preload:
+        errors = model_registry.warm_up(SERVED_MODELS)
+        if errors:
+            print(f"Warning: failed to preload models: {errors}")
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    batcher = Batcher(max_batch=max_batch, max_wait_ms=max_wait_ms)
+    threading.Thread(target=batcher.serve_forever, daemon=True).start()
+
+    # Owner-only from the moment it is bound
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(socket_path, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(old_umask)
+    os.chmod(socket_path, 0o600)
+    print(f"Model server listening on {socket_path} (backend={backend_kind}, "
+          f"max_batch={max_batch}, max_wait_ms={max_wait_ms})")
+    try:
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=_handle_connection, args=(conn, batcher), daemon=True).start()
+    finally:
+        listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET)
+    parser.add_argument("--backend", default=None, help="torch or onnx")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--no-preload", action="store_true")
+    args = parser.parse_args()
+
+    serve(args.socket, args.backend, args.max_batch, args.max_wait_ms, preload=not args.no_preload)
+
+
+if __name__ == "__main__":
+    main()
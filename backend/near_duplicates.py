@@ -0,0 +1,279 @@
+"""
+Near-duplicate detection for uploads.
+
+Exact MD5 dedup misses re-saved, resized or recompressed copies of the same
+photo. Each upload gets a 64-bit perceptual hash (pHash, DCT-based) and each
+user's hashes live in an in-memory multi-index hash table (or BK-tree for
+large radii), so finding an earlier upload within a small Hamming distance
+takes well under a millisecond.
+
+pHash only sees luminance, so a red and a blue shirt of the same shape hash
+alike. A hash match therefore only counts as a duplicate when the two images'
+coarse colour histograms agree as well (see same_colors).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+ENABLED = os.environ.get("NEAR_DUP_ENABLED", "1") == "1"
+
+# Max differing bits (out of 64) for two images to count as the same photo
+MAX_DISTANCE = int(os.environ.get("NEAR_DUP_MAX_DISTANCE", "6"))
+
+# Max colour-histogram distance (0 = identical, 1 = disjoint) for a hash match
+# to count; recompressed copies stay well below 0.05, recoloured items above 0.3
+MAX_COLOR_DISTANCE = float(os.environ.get("NEAR_DUP_MAX_COLOR_DISTANCE", "0.1"))
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+_U64 = (1 << 64) - 1
+
+
+# -----------------------------
+# PERCEPTUAL HASHES
+# -----------------------------
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis as an (n, n) matrix"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a PIL image"""
+    gray = image.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype="float64")
+    low = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].ravel()
+    # The DC term only reflects overall brightness, leave it out of the median
+    median = np.median(low[1:])
+    return _bits_to_int(low > median)
+
+
+def dhash(image):
+    """64-bit difference hash (horizontal gradient) of a PIL image"""
+    gray = image.convert("L").resize((_HASH_SIZE + 1, _HASH_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype="int16")
+    return _bits_to_int((pixels[:, 1:] > pixels[:, :-1]).ravel())
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def to_signed(h):
+    """Unsigned 64-bit hash -> value that fits a Postgres BIGINT"""
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def from_signed(h):
+    return h & _U64
+
+
+# -----------------------------
+# COLOUR CHECK
+# -----------------------------
+_COLOR_LEVELS = 4
+_COLOR_SIZE = 64
+_STORED_CACHE_SIZE = 1024
+
+_stored_signatures = OrderedDict()
+_stored_lock = threading.Lock()
+
+
+def color_signature(image):
+    """Normalized 64-bin RGB histogram (4 levels per channel) of a PIL image"""
+    rgb = image.convert("RGB").resize((_COLOR_SIZE, _COLOR_SIZE), Image.BILINEAR)
+    levels = np.asarray(rgb, dtype="uint16") // (256 // _COLOR_LEVELS)
+    bins = (levels[..., 0] * _COLOR_LEVELS + levels[..., 1]) * _COLOR_LEVELS + levels[..., 2]
+    hist = np.bincount(bins.ravel(), minlength=_COLOR_LEVELS ** 3).astype("float32")
+    return hist / hist.sum()
+
+
+def color_distance(a, b):
+    """Total variation distance between two colour signatures, in [0, 1]"""
+    return float(0.5 * np.abs(a - b).sum())
+
+
+def stored_color_signature(path):
+    """Colour signature of a stored image, or None when it cannot be read.
+
+    Blob paths are content-addressed, so signatures are cached by path.
+    """
+    with _stored_lock:
+        if path in _stored_signatures:
+            _stored_signatures.move_to_end(path)
+            return _stored_signatures[path]
+    try:
+        with Image.open(path) as img:
+            signature = color_signature(img)
+    except Exception:
+        return None
+    with _stored_lock:
+        _stored_signatures[path] = signature
+        while len(_stored_signatures) > _STORED_CACHE_SIZE:
+            _stored_signatures.popitem(last=False)
+    return signature
+
+
+def same_colors(signature, path):
+    """True when the stored image at path has (nearly) the same colours"""
+    other = stored_color_signature(path)
+    return other is not None and color_distance(signature, other) <= MAX_COLOR_DISTANCE
+
+
+# -----------------------------
+# BK-TREE
+# -----------------------------
+class BKTree:
+    """Metric tree over Hamming distance; each node is [hash, value, {dist: child}]"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, h, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [h, value, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, value, {}]
+                return
+            node = child
+
+    def search(self, h, max_distance):
+        """All (distance, value) pairs within max_distance, closest first"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= max_distance:
+                found.append((d, node[1]))
+            # Triangle inequality: only children in [d - r, d + r] can match
+            for dist, child in node[2].items():
+                if d - max_distance <= dist <= d + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+# -----------------------------
+# MULTI-INDEX HASH TABLE
+# -----------------------------
+class MultiIndexHashTable:
+    """Hash table keyed on each 8-bit chunk of a 64-bit hash.
+
+    If two hashes differ in at most 7 bits, at least one of their 8 chunks is
+    identical (pigeonhole), so probing the 8 exact-chunk buckets finds every
+    match. Much faster than a BK-tree for the small radii used here.
+    """
+
+    CHUNKS = 8
+
+    def __init__(self):
+        self.buckets = [{} for _ in range(self.CHUNKS)]
+        self.size = 0
+
+    @staticmethod
+    def _chunks(h):
+        return [(h >> (8 * i)) & 0xFF for i in range(MultiIndexHashTable.CHUNKS)]
+
+    def add(self, h, value):
+        self.size += 1
+        for bucket, chunk in zip(self.buckets, self._chunks(h)):
+            bucket.setdefault(chunk, []).append((h, value))
+
+    def search(self, h, max_distance):
+        """All (distance, value) pairs within max_distance (< 8), closest first"""
+        found = {}
+        for bucket, chunk in zip(self.buckets, self._chunks(h)):
+            for other, value in bucket.get(chunk, ()):
+                if value not in found:
+                    d = hamming(h, other)
+                    if d <= max_distance:
+                        found[value] = d
+        return sorted(((d, value) for value, d in found.items()), key=lambda pair: pair[0])
+
+
+# -----------------------------
+# PER-USER INDEX
+# -----------------------------
+class NearDuplicateIndex:
+    """Per-user hash lookup structures, built lazily from a loader.
+
+    Uses a multi-index hash table for radii below 8 bits and a BK-tree
+    otherwise.
+
+    load_user_hashes(username) must return [(upload_id, unsigned_hash), ...].
+    """
+
+    def __init__(self, load_user_hashes, max_distance=MAX_DISTANCE):
+        self.load_user_hashes = load_user_hashes
+        self.max_distance = max_distance
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def _tree(self, username):
+        tree = self._trees.get(username)
+        if tree is None:
+            tree = self.load(username, self.load_user_hashes(username))
+        return tree
+
+    def is_loaded(self, username):
+        return username in self._trees
+
+    def load(self, username, hashes):
+        """Build a user's tree from [(upload_id, unsigned_hash), ...] fetched elsewhere
+        (e.g. by an async database driver)"""
+        tree = MultiIndexHashTable() if self.max_distance < MultiIndexHashTable.CHUNKS else BKTree()
+        for upload_id, h in hashes:
+            tree.add(h, upload_id)
+        with self._lock:
+            return self._trees.setdefault(username, tree)
+
+    def candidates(self, username, h):
+        """upload_ids of earlier uploads within max_distance, closest first"""
+        return [upload_id for _, upload_id in self._tree(username).search(h, self.max_distance)]
+
+    def find(self, username, h):
+        """upload_id of the closest earlier upload within max_distance, or None"""
+        matches = self.candidates(username, h)
+        return matches[0] if matches else None
+
+    def add(self, username, h, upload_id):
+        with self._lock:
+            tree = self._trees.get(username)
+            if tree is not None:
+                tree.add(h, upload_id)
+
+    def forget(self, username):
+        """Drop a user's tree (e.g. after deletes); it is rebuilt on next use"""
+        with self._lock:
+            self._trees.pop(username, None)
+
+    def clear(self):
+        """Drop every tree (e.g. after a bulk cleanup)"""
+        with self._lock:
+            self._trees.clear()
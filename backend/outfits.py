@@ -0,0 +1,150 @@
+"""
+Outfit pairing engine.
+
+Builds upper + lower outfits from a user's wardrobe. Every upper x lower pair
+is scored at once with a matrix product of their stored CLIP vectors plus
+style and color compatibility terms, and only the top N pairs are fully
+sorted (np.argpartition), so wardrobes with thousands of items per category
+stay interactive.
+"""
+import numpy as np
+import faiss
+
+import metrics
+from per_user_index import load_user_index_for_query
+
+# Score weights
+SIMILARITY_WEIGHT = 1.0
+STYLE_WEIGHT = 0.3
+COLOR_WEIGHT = 0.2
+
+# Upper rows scored per block, bounds memory to BLOCK_ROWS x n_lower floats
+BLOCK_ROWS = 1024
+
+NEUTRAL_COLORS = {"black", "white", "gray", "brown"}
+
+
+def _color_compatibility(colors):
+    """Pairwise color score: neutrals go with anything, same color is a
+    monochrome look, two different bright colors clash"""
+    n = len(colors)
+    compat = np.zeros((n, n), dtype="float32")
+    for i, a in enumerate(colors):
+        for j, b in enumerate(colors):
+            if a in NEUTRAL_COLORS or b in NEUTRAL_COLORS:
+                compat[i, j] = 1.0
+            elif a == b:
+                compat[i, j] = 0.5
+    return compat
+
+
+def _codes(values):
+    """Integer codes for a list of labels plus the label vocabulary"""
+    vocab = sorted({v or "unknown" for v in values})
+    lookup = {v: i for i, v in enumerate(vocab)}
+    return np.array([lookup[v or "unknown"] for v in values], dtype="int64"), vocab
+
+
+def _wardrobe(user_id, attributes=None):
+    """Vectors and attributes for every indexed item of a user.
+
+    attributes optionally maps absolute image path -> {"position", "style",
+    "color"} (e.g. from the uploads table) and overrides the index metadata.
+    """
+    with metrics.stage("index_load"):
+        idx, meta = load_user_index_for_query(user_id)
+    if idx.ntotal == 0:
+        return None, []
+
+    ids = faiss.vector_to_array(idx.id_map)
+    vectors = idx.index.reconstruct_n(0, idx.ntotal)
+
+    items = []
+    rows = []
+    for row, item_id in enumerate(ids):
+        item = meta["items"].get(str(int(item_id)))
+        if not item:
+            continue
+        merged = dict(item)
+        merged.update((attributes or {}).get(item["path"], {}))
+        merged["id"] = int(item_id)
+        items.append(merged)
+        rows.append(row)
+
+    return vectors[rows], items
+
+
+def _top_pairs(upper_vecs, lower_vecs, upper_items, lower_items, top_n):
+    """Score all upper x lower pairs in blocks and keep the best top_n"""
+    styles, _ = _codes([i.get("style") for i in upper_items + lower_items])
+    style_codes_u, style_codes_l = styles[:len(upper_items)], styles[len(upper_items):]
+
+    colors, color_vocab = _codes([(i.get("color") or "").lower() for i in upper_items + lower_items])
+    color_codes_u, color_codes_l = colors[:len(upper_items)], colors[len(upper_items):]
+    compat = _color_compatibility(color_vocab)
+
+    best_scores = np.empty(0, dtype="float32")
+    best_pairs = np.empty((0, 2), dtype="int64")
+    n_lower = len(lower_items)
+
+    for start in range(0, len(upper_items), BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, len(upper_items))
+        scores = SIMILARITY_WEIGHT * (upper_vecs[start:stop] @ lower_vecs.T)
+        scores += STYLE_WEIGHT * (style_codes_u[start:stop, None] == style_codes_l[None, :])
+        scores += COLOR_WEIGHT * compat[color_codes_u[start:stop, None], color_codes_l[None, :]]
+
+        flat = scores.ravel()
+        k = min(top_n, flat.size)
+        top = np.argpartition(-flat, k - 1)[:k]
+        pairs = np.stack([top // n_lower + start, top % n_lower], axis=1)
+
+        best_scores = np.concatenate([best_scores, flat[top]])
+        best_pairs = np.concatenate([best_pairs, pairs])
+        if best_scores.size > top_n:
+            keep = np.argpartition(-best_scores, top_n - 1)[:top_n]
+            best_scores, best_pairs = best_scores[keep], best_pairs[keep]
+
+    order = np.argsort(-best_scores)
+    return best_scores[order], best_pairs[order]
+
+
+def recommend_outfits(user_id, top_n=10, style=None, attributes=None):
+    """Top-N upper + lower outfits for a user, plus matching full-body items.
+
+    style restricts the wardrobe to one style (e.g. a destination's dress code).
+    Returns {"outfits": [{"score", "upper", "lower"}], "full": [item, ...]}.
+    """
+    vectors, items = _wardrobe(user_id, attributes)
+    if not items:
+        return {"outfits": [], "full": []}
+
+    if style:
+        keep = [i for i, item in enumerate(items) if (item.get("style") or "").lower() == style.lower()]
+        vectors = vectors[keep]
+        items = [items[i] for i in keep]
+
+    by_position = {"upper": [], "lower": [], "full": []}
+    for row, item in enumerate(items):
+        position = (item.get("position") or "").lower()
+        if position in by_position:
+            by_position[position].append(row)
+
+    full = [items[row] for row in by_position["full"]][:top_n]
+    upper_rows, lower_rows = by_position["upper"], by_position["lower"]
+    if not upper_rows or not lower_rows or top_n <= 0:
+        return {"outfits": [], "full": full}
+
+    upper_items = [items[r] for r in upper_rows]
+    lower_items = [items[r] for r in lower_rows]
+    with metrics.stage("score"):
+        scores, pairs = _top_pairs(
+            np.ascontiguousarray(vectors[upper_rows]),
+            np.ascontiguousarray(vectors[lower_rows]),
+            upper_items, lower_items, top_n
+        )
+
+    outfits = [
+        {"score": float(score), "upper": upper_items[u], "lower": lower_items[l]}
+        for score, (u, l) in zip(scores, pairs)
+    ]
+    return {"outfits": outfits, "full": full}
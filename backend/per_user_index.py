@@ -1,17 +1,35 @@
+import fcntl
+import functools
 import os
 import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import faiss
 import numpy as np
-from clip_embed_utils import embed_image, embed_text
+import index_snapshots
+import metrics
+from clip_embed_utils import embed_image, embed_images, embed_text, embed_texts
 
 # -----------------------------
 # CONFIG
 # -----------------------------
-INDEX_DIR = "indexes"
+INDEX_DIR = os.environ.get("INDEX_DIR", "indexes")
 os.makedirs(INDEX_DIR, exist_ok=True)
 
 FAISS_DIM = 768   # CLIP ViT-Large Patch-14 outputs 1024-dim vectors
 
+# Item attributes that can be used to narrow a search
+FILTER_ATTRIBUTES = ("style", "color", "position", "favorite")
+
+# Indexes kept in memory per process for queries (0 disables the cache)
+INDEX_CACHE_USERS = int(os.environ.get("INDEX_CACHE_USERS", "64"))
+
+metrics.describe("index_cache_hits_total", "Queries served from an in-memory user index")
+metrics.describe("index_cache_misses_total", "Queries that had to (re)load a user index from disk")
+
 
 # -----------------------------
 # PATH HELPERS
@@ -23,6 +41,101 @@ def _user_paths(user_id):
     return idx_path, meta_path
 
 
+def _version_path(user_id):
+    return os.path.join(INDEX_DIR, f"{user_id}.version")
+
+
+# -----------------------------
+# WRITE LOCK (PER USER, CROSS-PROCESS)
+# -----------------------------
+class _UserLock:
+    """Thread lock plus a flock on indexes/<user>.lock; re-entrant per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+
+
+@contextmanager
+def user_lock(user_id):
+    """Serialize load-modify-save of a user's index across threads and processes"""
+    with _user_locks_guard:
+        lock = _user_locks.get(str(user_id))
+        if lock is None:
+            lock = _user_locks[str(user_id)] = _UserLock(os.path.join(INDEX_DIR, f"{user_id}.lock"))
+    with lock.thread_lock:
+        if lock.depth == 0:
+            lock.file = open(lock.path, "a")
+            fcntl.flock(lock.file, fcntl.LOCK_EX)
+        lock.depth += 1
+        try:
+            yield
+        finally:
+            lock.depth -= 1
+            if lock.depth == 0:
+                fcntl.flock(lock.file, fcntl.LOCK_UN)
+                lock.file.close()
+                lock.file = None
+
+
+def _locked_user(fn):
+    """Run fn(user_id, ...) under user_lock(user_id)"""
+    @functools.wraps(fn)
+    def wrapper(user_id, *args, **kwargs):
+        with user_lock(user_id):
+            return fn(user_id, *args, **kwargs)
+    return wrapper
+
+
+# -----------------------------
+# VERSIONS (CROSS-PROCESS COHERENCE)
+# -----------------------------
+# A write counts as "racy" while the version file's mtime is this recent:
+# two saves inside one timestamp tick could otherwise look identical to stat
+_RACY_NS = 100_000_000
+
+
+def _bump_version(user_id):
+    """Replace the user's version file with the next counter, after a save"""
+    path = _version_path(user_id)
+    try:
+        with open(path) as f:
+            counter = int(f.read() or 0)
+    except (FileNotFoundError, ValueError):
+        counter = 0
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(counter + 1))
+    os.replace(tmp, path)
+
+
+def index_version(user_id):
+    """Token that changes whenever any process saves the user's index.
+
+    Normally a single stat of the version file; only right after a write is
+    the counter read as well. None if the index was never saved.
+    """
+    path = _version_path(user_id)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    token = (st.st_ino, st.st_mtime_ns, st.st_size)
+    if time.time_ns() - st.st_mtime_ns < _RACY_NS:
+        try:
+            with open(path) as f:
+                token += (f.read(),)
+        except FileNotFoundError:
+            return None
+    return token
+
+
 # -----------------------------
 # INDEX MANAGEMENT
 # -----------------------------
@@ -51,33 +164,235 @@ def load_user_index(user_id):
     return idx, meta
 
 
+@_locked_user
 def save_user_index(user_id, idx, meta):
-    """Persist FAISS index + metadata"""
+    """Persist FAISS index + metadata (and publish a snapshot if configured).
+
+    Each file is written to a temporary name and renamed into place, so a
+    crash never leaves a truncated index behind.
+    """
     idx_path, meta_path = _user_paths(user_id)
-    faiss.write_index(idx, idx_path)
-    json.dump(meta, open(meta_path, "w"))
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    faiss.write_index(idx, idx_path + suffix)
+    with open(meta_path + suffix, "w") as f:
+        json.dump(meta, f)
+    os.replace(idx_path + suffix, idx_path)
+    os.replace(meta_path + suffix, meta_path)
+    # Tells every process's in-memory cache that this index changed
+    _bump_version(user_id)
+
+    if index_snapshots.SNAPSHOT_DIR:
+        try:
+            with metrics.stage("snapshot_publish"):
+                index_snapshots.publish(user_id, idx, meta)
+        except Exception as e:
+            print(f"Warning: failed to publish index snapshot for {user_id}: {e}")
+
+
+_index_cache = OrderedDict()   # user -> (version token, idx, meta), least recently used first
+_index_cache_lock = threading.Lock()
+
+
+def _cached_user_index(user_id):
+    """load_user_index served from memory while the user's version token is unchanged"""
+    version = index_version(user_id)
+    if version is None or INDEX_CACHE_USERS <= 0:
+        return load_user_index(user_id)
+
+    with _index_cache_lock:
+        cached = _index_cache.get(user_id)
+        if cached and cached[0] == version:
+            _index_cache.move_to_end(user_id)
+            metrics.inc("index_cache_hits_total")
+            return cached[1], cached[2]
+
+    metrics.inc("index_cache_misses_total")
+    idx, meta = load_user_index(user_id)
+    # Built before the entry is shared: queries must never mutate cached metadata
+    _filter_sets(meta)
+    # Another process may have saved while we read; re-check on the next query
+    if index_version(user_id) == version:
+        with _index_cache_lock:
+            _index_cache[user_id] = (version, idx, meta)
+            _index_cache.move_to_end(user_id)
+            while len(_index_cache) > INDEX_CACHE_USERS:
+                _index_cache.popitem(last=False)
+    return idx, meta
+
+
+def query_index_version(user_id):
+    """Version token of the index load_user_index_for_query would serve, None if there is none"""
+    if index_snapshots.READER:
+        return index_snapshots.manifest_token(user_id)
+    return index_version(user_id)
+
+
+def load_user_index_for_query(user_id):
+    """Read-only FAISS index + metadata for searches.
+
+    Reader nodes (INDEX_SNAPSHOT_READER=1) use the latest published snapshot;
+    otherwise the index is kept in memory and only reloaded after some
+    process saved it. Callers must not modify or save it.
+    """
+    if not index_snapshots.READER:
+        return _cached_user_index(user_id)
+    latest = index_snapshots.reader.latest(user_id)
+    if latest is None:
+        return _create_new_index(), {"_next_id": 1, "items": {}}
+    _, idx, meta = latest
+    return idx, meta
+
+
+# -----------------------------
+# ATTRIBUTE FILTERS
+# -----------------------------
+def _filter_key(value):
+    """Normalize an attribute value for the filter id sets"""
+    return str(value).strip().lower()
+
+
+def _build_filter_sets(items):
+    """Per-attribute id sets: {attribute: {value: [ids]}}"""
+    filters = {attr: {} for attr in FILTER_ATTRIBUTES}
+    for item_id, item in items.items():
+        _add_item_filters(filters, int(item_id), item)
+    return filters
+
+
+def _filter_sets(meta):
+    """The id sets stored in meta, rebuilt for older metadata (writers and cache loads only)"""
+    if "filters" not in meta:
+        meta["filters"] = _build_filter_sets(meta["items"])
+    return meta["filters"]
+
+
+def _add_to_filters(meta, item_id, item):
+    _add_item_filters(_filter_sets(meta), item_id, item)
+
+
+def _add_item_filters(filters, item_id, item):
+    for attr in FILTER_ATTRIBUTES:
+        value = item.get(attr)
+        if value is None:
+            continue
+        filters.setdefault(attr, {}).setdefault(_filter_key(value), []).append(item_id)
+
+
+def _remove_from_filters(meta, item_id, item):
+    filters = _filter_sets(meta)
+    for attr in FILTER_ATTRIBUTES:
+        value = item.get(attr)
+        if value is None:
+            continue
+        ids = filters.get(attr, {}).get(_filter_key(value))
+        if ids and item_id in ids:
+            ids.remove(item_id)
+
+
+def _filter_ids(meta, filters):
+    """Sorted array of ids matching every given filter, or None when unfiltered"""
+    active = {k: v for k, v in (filters or {}).items() if k in FILTER_ATTRIBUTES and v is not None}
+    if not active:
+        return None
+
+    # Read-only: query metadata may be shared between threads
+    sets = meta["filters"] if "filters" in meta else _build_filter_sets(meta["items"])
+    matching = None
+    for attr, value in active.items():
+        ids = np.unique(np.asarray(sets.get(attr, {}).get(_filter_key(value), []), dtype="int64"))
+        matching = ids if matching is None else np.intersect1d(matching, ids, assume_unique=True)
+        if matching.size == 0:
+            break
+    return matching
+
+
+def _search(idx, vecs, k, matching_ids=None):
+    """FAISS search, restricted to matching_ids through an IDSelector when given"""
+    vecs = np.ascontiguousarray(vecs, dtype="float32")
+    if matching_ids is None:
+        return idx.search(vecs, k)
+    selector = faiss.IDSelectorBatch(matching_ids)
+    return idx.search(vecs, k, params=faiss.SearchParameters(sel=selector))
+
+
+@_locked_user
+def set_item_attributes(user_id, image_path, **attributes):
+    """Update stored attributes (style, color, position, favorite) of an indexed image"""
+    abs_path = os.path.abspath(image_path)
+    idx, meta = load_user_index(user_id)
+
+    for item_id, item in meta["items"].items():
+        if item["path"] != abs_path:
+            continue
+        _remove_from_filters(meta, int(item_id), item)
+        item.update(attributes)
+        _add_to_filters(meta, int(item_id), item)
+        save_user_index(user_id, idx, meta)
+        return int(item_id)
+
+    return None
+
+
+@_locked_user
+def set_items_attributes(user_id, updates):
+    """set_item_attributes for many images with one load and one save.
+
+    updates maps image path -> {attribute: value}. Returns how many indexed
+    items were changed.
+    """
+    updates = {os.path.abspath(path): attrs for path, attrs in updates.items()}
+    idx, meta = load_user_index(user_id)
+
+    changed = 0
+    for item_id, item in meta["items"].items():
+        attrs = updates.get(item["path"])
+        if not attrs:
+            continue
+        _remove_from_filters(meta, int(item_id), item)
+        item.update(attrs)
+        _add_to_filters(meta, int(item_id), item)
+        changed += 1
+
+    if changed:
+        save_user_index(user_id, idx, meta)
+    return changed
 
 
 # -----------------------------
 # ADD IMAGE TO INDEX
 # -----------------------------
-def add_image_for_user(user_id, image_path, style=None, color=None):
-    """Add image embedding to user's FAISS index"""
+@_locked_user
+def add_image_for_user(user_id, image_path, style=None, color=None, position=None, image_hash=None,
+                       source=None):
+    """Add image embedding to user's FAISS index.
+
+    image_hash (MD5 of the file) lets the embedding come from the shared cache.
+    source records where the item came from ("upload" for rows in the uploads
+    table, "chatbot" for chatbot-only images); the reconciler uses it.
+    """
 
     # Ensure absolute path
     abs_path = os.path.abspath(image_path)
 
     # Load index + metadata
-    idx, meta = load_user_index(user_id)
+    with metrics.stage("index_load"):
+        idx, meta = load_user_index(user_id)
 
     # Prevent duplicates
     for item_id, item_data in meta["items"].items():
         if item_data["path"] == abs_path:
             print(f"Image already indexed: {abs_path}")
+            # Backfill position for items indexed before it was stored
+            if position is not None and item_data.get("position") is None:
+                _remove_from_filters(meta, int(item_id), item_data)
+                item_data["position"] = position
+                _add_to_filters(meta, int(item_id), item_data)
+                save_user_index(user_id, idx, meta)
             return int(item_id)
 
     # Generate CLIP embedding
-    vec = embed_image(abs_path)
+    with metrics.stage("embed"):
+        vec = embed_image(abs_path, image_hash)
     if vec is None:
         print("❌ embed_image returned None")
         return None
@@ -100,27 +415,233 @@ def add_image_for_user(user_id, image_path, style=None, color=None):
     meta["items"][str(nid)] = {
         "path": abs_path,
         "style": style,
-        "color": color
+        "color": color,
+        "position": position,
+        "favorite": False,
+        "hash": image_hash,
+        "source": source
     }
+    _add_to_filters(meta, nid, meta["items"][str(nid)])
 
     # Increment next id
     meta["_next_id"] = nid + 1
 
     # Save changes
-    save_user_index(user_id, idx, meta)
+    with metrics.stage("save"):
+        save_user_index(user_id, idx, meta)
 
     print(f"Indexed new image: {abs_path} with ID {nid}")
     print("Vector shape:", vec.shape)
     return nid
 
 
+def _add_items(idx, meta, items):
+    """Embed and add items not yet in idx/meta (in place).
+
+    Returns ({absolute path: item id or None}, number of items added).
+    """
+    paths = [os.path.abspath(item["path"]) for item in items]
+    path_ids = {item["path"]: int(item_id) for item_id, item in meta["items"].items()}
+
+    # First occurrence of each path not yet in the index
+    new_rows = []
+    for row, path in enumerate(paths):
+        if path not in path_ids:
+            path_ids[path] = None
+            new_rows.append(row)
+    if not new_rows:
+        return path_ids, 0
+
+    with metrics.stage("embed"):
+        vecs = embed_images([paths[r] for r in new_rows],
+                            [items[r].get("image_hash") for r in new_rows])
+
+    add_vecs, add_ids = [], []
+    for row, vec in zip(new_rows, vecs):
+        if vec is None or vec.shape[0] != FAISS_DIM:
+            print(f"❌ Could not embed {paths[row]}")
+            continue
+        nid = meta["_next_id"]
+        meta["_next_id"] = nid + 1
+        meta["items"][str(nid)] = {
+            "path": paths[row],
+            "style": items[row].get("style"),
+            "color": items[row].get("color"),
+            "position": items[row].get("position"),
+            "favorite": items[row].get("favorite", False),
+            "hash": items[row].get("image_hash"),
+            "source": items[row].get("source")
+        }
+        _add_to_filters(meta, nid, meta["items"][str(nid)])
+        add_vecs.append(vec)
+        add_ids.append(nid)
+        path_ids[paths[row]] = nid
+
+    if add_ids:
+        idx.add_with_ids(np.array(add_vecs, dtype="float32"), np.array(add_ids, dtype="int64"))
+    return path_ids, len(add_ids)
+
+
+@_locked_user
+def add_images_for_user(user_id, items):
+    """Add several images to a user's index with one load, one batched
+    embedding pass and one save.
+
+    items: dicts with "path" and optional "style", "color", "position",
+    "image_hash", "source". Returns the item id per input (None where
+    embedding failed); already-indexed paths return their existing id.
+    """
+    if not items:
+        return []
+
+    with metrics.stage("index_load"):
+        idx, meta = load_user_index(user_id)
+
+    path_ids, added = _add_items(idx, meta, items)
+    if added:
+        with metrics.stage("save"):
+            save_user_index(user_id, idx, meta)
+        print(f"Indexed {added} new images for user {user_id}")
+
+    return [path_ids[os.path.abspath(item["path"])] for item in items]
+
+
+# -----------------------------
+# REMOVE ITEMS
+# -----------------------------
+def _remove_items(idx, meta, item_ids):
+    """Drop vectors, metadata and filter entries for item_ids (in place)"""
+    item_ids = [int(i) for i in item_ids if str(i) in meta["items"]]
+    if not item_ids:
+        return 0
+    idx.remove_ids(np.array(item_ids, dtype="int64"))
+    for item_id in item_ids:
+        _remove_from_filters(meta, item_id, meta["items"].pop(str(item_id)))
+    return len(item_ids)
+
+
+@_locked_user
+def prune_items(user_id, gone_paths=()):
+    """Remove index items whose image was deleted, plus repeated items for
+    the same image (only the oldest is kept). Returns how many were removed."""
+    gone = {os.path.abspath(p) for p in gone_paths}
+    idx, meta = load_user_index(user_id)
+
+    seen = set()
+    stale = []
+    for item_id in sorted(meta["items"], key=int):
+        path = meta["items"][item_id]["path"]
+        if path in gone or path in seen:
+            stale.append(item_id)
+        seen.add(path)
+
+    removed = _remove_items(idx, meta, stale)
+    if removed:
+        save_user_index(user_id, idx, meta)
+    return removed
+
+
+@_locked_user
+def remove_path(user_id, image_path):
+    """Remove the upload item(s) indexed under image_path; returns how many were removed.
+
+    Items added through /chatbot/upload are kept: the chatbot still shows
+    them and they hold their own blob reference.
+    """
+    abs_path = os.path.abspath(image_path)
+    idx, meta = load_user_index(user_id)
+    stale = [item_id for item_id, item in meta["items"].items()
+             if item["path"] == abs_path and item.get("source") != "chatbot"]
+    removed = _remove_items(idx, meta, stale)
+    if removed:
+        save_user_index(user_id, idx, meta)
+    return removed
+
+
+# -----------------------------
+# RECONCILE WITH THE DATABASE
+# -----------------------------
+_SYNCED_ATTRIBUTES = ("style", "color", "position", "favorite")
+
+
+def _is_orphan(item, expected_paths):
+    """An item no uploads row accounts for. Chatbot-only items never are;
+    items of unknown origin only once their image is gone."""
+    if item["path"] in expected_paths or item.get("source") == "chatbot":
+        return False
+    return item.get("source") == "upload" or not os.path.exists(item["path"])
+
+
+@_locked_user
+def reconcile_user(user_id, rows):
+    """Bring a user's index in line with their uploads rows, in one load and one save.
+
+    rows: dicts with "path", "image_hash", "style", "color", "position",
+    "favorite". Items missing from the index are embedded in one batch,
+    orphaned items are removed, items whose image moved (same hash, new path)
+    are re-pointed and drifted attributes are updated. Returns counts.
+    """
+    stats = {"added": 0, "removed": 0, "repointed": 0, "updated": 0, "failed": 0}
+    expected = {os.path.abspath(row["path"]): row for row in rows}
+
+    with metrics.stage("index_load"):
+        idx, meta = load_user_index(user_id)
+
+    indexed = {item["path"] for item in meta["items"].values()}
+    missing = {path: row for path, row in expected.items() if path not in indexed}
+    orphans = {
+        item_id: item for item_id, item in meta["items"].items()
+        if _is_orphan(item, expected)
+    }
+
+    # Same content under a new path: move the item instead of re-embedding it
+    missing_by_hash = {row["image_hash"]: path for path, row in missing.items() if row.get("image_hash")}
+    for item_id, item in list(orphans.items()):
+        new_path = missing_by_hash.pop(item.get("hash"), None) if item.get("hash") else None
+        if new_path is not None:
+            item["path"] = new_path
+            item["source"] = "upload"
+            del orphans[item_id]
+            del missing[new_path]
+            stats["repointed"] += 1
+
+    stats["removed"] = _remove_items(idx, meta, list(orphans))
+
+    for item_id, item in meta["items"].items():
+        row = expected.get(item["path"])
+        if row is None:
+            continue
+        changes = {attr: row[attr] for attr in _SYNCED_ATTRIBUTES
+                   if row.get(attr) is not None and item.get(attr) != row[attr]}
+        if changes:
+            _remove_from_filters(meta, int(item_id), item)
+            item.update(changes)
+            _add_to_filters(meta, int(item_id), item)
+            stats["updated"] += 1
+
+    if missing:
+        items = [dict(row, path=path, source="upload") for path, row in missing.items()]
+        path_ids, stats["added"] = _add_items(idx, meta, items)
+        stats["failed"] = sum(1 for path in missing if path_ids.get(path) is None)
+
+    if stats["added"] or stats["removed"] or stats["repointed"] or stats["updated"]:
+        with metrics.stage("save"):
+            save_user_index(user_id, idx, meta)
+    return stats
+
+
 # -----------------------------
 # QUERY USER IMAGES
 # -----------------------------
-def query_user(user_id, text_query, top_k=3):
-    """Return images similar to text query"""
+def query_user(user_id, text_query, top_k=3, filters=None):
+    """Return images similar to text query.
+
+    filters narrows the search to items whose style/color/position/favorite
+    match, e.g. {"style": "formal", "favorite": True}.
+    """
 
-    vec = embed_text(text_query)
+    with metrics.stage("embed"):
+        vec = embed_text(text_query)
     if vec is None:
         print("❌ embed_text returned None")
         return []
@@ -129,20 +650,71 @@ def query_user(user_id, text_query, top_k=3):
         print(f"❌ ERROR: Text embedding dim {vec.shape[0]} != {FAISS_DIM}")
         return []
 
-    idx, meta = load_user_index(user_id)
+    with metrics.stage("index_load"):
+        idx, meta = load_user_index_for_query(user_id)
 
     if idx.ntotal == 0:
         print(f"No images indexed for user {user_id}")
         return []
 
+    matching_ids = _filter_ids(meta, filters)
+    candidates = idx.ntotal if matching_ids is None else matching_ids.size
+    if candidates == 0:
+        return []
+
     # Search for similarity
-    search_k = min(top_k * 2, idx.ntotal)
-    D, I = idx.search(np.array([vec], dtype="float32"), search_k)
+    search_k = min(top_k * 2, candidates)
+    with metrics.stage("search"):
+        D, I = _search(idx, np.array([vec]), search_k, matching_ids)
+
+    return _collect_results(D[0], I[0], meta, top_k)
+
+
+def query_user_batch(user_id, text_queries, top_k=3, filters=None):
+    """Return similar images for several text queries at once.
 
+    All queries are encoded in one forward pass, the index is loaded once and
+    searched with a single (n, FAISS_DIM) matrix. Returns one result list per
+    query, in the same order. filters applies to every query.
+    """
+    if not text_queries:
+        return []
+
+    with metrics.stage("embed"):
+        vecs = embed_texts(text_queries)
+    if vecs is None:
+        print("❌ embed_texts returned None")
+        return [[] for _ in text_queries]
+
+    if vecs.shape[1] != FAISS_DIM:
+        print(f"❌ ERROR: Text embedding dim {vecs.shape[1]} != {FAISS_DIM}")
+        return [[] for _ in text_queries]
+
+    with metrics.stage("index_load"):
+        idx, meta = load_user_index_for_query(user_id)
+
+    if idx.ntotal == 0:
+        print(f"No images indexed for user {user_id}")
+        return [[] for _ in text_queries]
+
+    matching_ids = _filter_ids(meta, filters)
+    candidates = idx.ntotal if matching_ids is None else matching_ids.size
+    if candidates == 0:
+        return [[] for _ in text_queries]
+
+    search_k = min(top_k * 2, candidates)
+    with metrics.stage("search"):
+        D, I = _search(idx, vecs, search_k, matching_ids)
+
+    return [_collect_results(D[row], I[row], meta, top_k) for row in range(len(text_queries))]
+
+
+def _collect_results(distances, ids, meta, top_k):
+    """Join one row of FAISS hits with metadata, skipping duplicate paths"""
     results = []
     seen_paths = set()
 
-    for dist, rid in zip(D[0], I[0]):
+    for dist, rid in zip(distances, ids):
         rid = int(rid)
         if rid == -1:
             continue
@@ -161,10 +733,93 @@ def query_user(user_id, text_query, top_k=3):
             "score": float(dist),
             "path": item["path"],
             "style": item.get("style", "Unknown"),
-            "color": item.get("color", "Unknown")
+            "color": item.get("color", "Unknown"),
+            "position": item.get("position"),
+            "favorite": item.get("favorite", False)
         })
 
         if len(results) >= top_k:
             break
 
     return results
+
+
+# -----------------------------
+# SIMILAR ITEMS (IMAGE-TO-IMAGE)
+# -----------------------------
+def _reconstruct(idx, item_id):
+    """Stored vector for an item id, read back from the flat index (no inference)"""
+    ids = faiss.vector_to_array(idx.id_map)
+    pos = np.flatnonzero(ids == item_id)
+    if pos.size == 0:
+        return None
+    return idx.index.reconstruct(int(pos[0]))
+
+
+def find_item_id(meta, filename):
+    """Index id of the item stored under filename (basename match), or None"""
+    for item_id, item in meta["items"].items():
+        if os.path.basename(item["path"]) == filename:
+            return int(item_id)
+    return None
+
+
+def list_indexed_users():
+    """User ids that have an index in INDEX_DIR (published snapshots on reader nodes)"""
+    if index_snapshots.READER:
+        return index_snapshots.list_users()
+    suffix = "_meta.json"
+    return sorted(name[:-len(suffix)] for name in os.listdir(INDEX_DIR) if name.endswith(suffix))
+
+
+def similar_items(user_id, item_id, top_k=3, all_users=False, filters=None, max_users=None):
+    """Return items similar to an already-indexed item.
+
+    The item's stored vector is reused as the query, so this costs only FAISS
+    searches. With all_users=True other users' indexes are searched too (at
+    most max_users indexes in total, including the caller's) and results are
+    merged by score; each result then carries its user_id.
+    """
+    with metrics.stage("index_load"):
+        idx, meta = load_user_index_for_query(user_id)
+
+    source = meta["items"].get(str(item_id))
+    vec = _reconstruct(idx, int(item_id)) if source else None
+    if vec is None:
+        print(f"Item {item_id} not found in index for user {user_id}")
+        return []
+
+    users = [user_id]
+    if all_users:
+        others = [u for u in list_indexed_users() if u != str(user_id)]
+        users += others if max_users is None else others[:max(max_users - 1, 0)]
+    results = []
+
+    for other_user in users:
+        if other_user == user_id:
+            other_idx, other_meta = idx, meta
+        else:
+            with metrics.stage("index_load"):
+                other_idx, other_meta = load_user_index_for_query(other_user)
+
+        matching_ids = _filter_ids(other_meta, filters)
+        candidates = other_idx.ntotal if matching_ids is None else matching_ids.size
+        if candidates == 0:
+            continue
+
+        # +1 because the source item matches itself
+        search_k = min(top_k * 2 + 1, candidates)
+        with metrics.stage("search"):
+            D, I = _search(other_idx, np.array([vec]), search_k, matching_ids)
+
+        hits = _collect_results(D[0], I[0], other_meta, search_k)
+        for hit in hits:
+            if hit["path"] == source["path"]:
+                continue
+            if all_users:
+                hit["user_id"] = other_user
+            results.append(hit)
+
+    results.sort(key=lambda r: r["score"], reverse=True)
+    return results[:top_k]
+
@@ -0,0 +1,84 @@
+"""
+Result cache for chatbot queries.
+
+Formatted results are cached under (user, normalized query, top_k, filters,
+index version). The version comes from per_user_index.query_index_version,
+which changes whenever any process saves the user's index, so writes
+invalidate old entries without any explicit purge; stale entries simply
+age out of the LRU. QUERY_CACHE_SIZE bounds the number of entries (0
+disables the cache).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+
+metrics.describe("query_cache_hits_total", "Chatbot queries answered from the result cache")
+metrics.describe("query_cache_misses_total", "Chatbot queries that ran the full search pipeline")
+
+
+def normalize_query(text):
+    """Lower-case with collapsed whitespace (CLIP's tokenizer ignores both)"""
+    return " ".join(str(text).lower().split())
+
+
+class QueryCache:
+    """Thread-safe LRU of query results with hit/miss counters"""
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, user_id, query_text, top_k, filters=None):
+        """Cache key for a query, or None when the result must not be cached"""
+        if self.max_entries <= 0:
+            return None
+        from per_user_index import query_index_version
+
+        version = query_index_version(user_id)
+        if version is None:
+            return None
+        filter_key = tuple(sorted((k, str(v).strip().lower()) for k, v in (filters or {}).items() if v is not None))
+        return (str(user_id), normalize_query(query_text), top_k, filter_key, version)
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.inc("query_cache_hits_total" if value is not None else "query_cache_misses_total")
+        return value
+
+    def put(self, key, value):
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+cache = QueryCache()
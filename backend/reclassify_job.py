@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Resumable bulk reclassification of stored uploads.
+
+After the category lists or the class prototype prompts change, existing
+uploads keep their old position/style/color labels. This job streams every
+row through a server-side cursor, classifies the images in batches across a
+pool of worker processes, and writes the new labels back with one
+UPDATE ... FROM (VALUES ...) per batch. Labels in the chatbot indexes are
+updated the same way (one index save per user per batch).
+
+Progress is checkpointed after every committed batch (highest finished
+upload id), so an interrupted run resumes where it stopped. A batch whose
+classification fails is retried; if it keeps failing the job stops without
+writing it or moving the checkpoint past it, so no row ever gets made-up
+labels. With the embedding cache warm, a rerun after a prompt change only
+scores cached image features against the new prompts and never runs the
+image tower.
+
+Usage: python reclassify_job.py [--mode efficient|enhanced] [--workers 4]
+                                [--batch-size 256] [--checkpoint FILE] [--restart]
+"""
+import argparse
+import collections
+import io
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extras import execute_values
+from PIL import Image
+
+DEFAULT_CHECKPOINT = "reclassify_checkpoint.json"
+
+# Extra attempts for a batch whose classification raised (e.g. a transient model/IO error)
+BATCH_RETRIES = 2
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.environ.get("DB_NAME", "loga"),
+        user=os.environ.get("DB_USER", "postgres"),
+        password=os.environ.get("DB_PASSWORD", "loga"),
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=os.environ.get("DB_PORT", "5432"),
+    )
+
+
+# -----------------------------
+# CHECKPOINT
+# -----------------------------
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"last_id": 0, "processed": 0, "changed": 0, "missing": 0}
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+
+# -----------------------------
+# WORKERS
+# -----------------------------
+def _init_worker(threads):
+    """Load the classifier once per worker and split CPU threads between workers"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    import model_registry
+    import classification  # noqa: F401 (imported to register "classifier" and "prototypes")
+    model_registry.warm_up(["classifier", "prototypes"])
+
+
+def classify_rows(rows, mode):
+    """[(id, image_path, md5_hash), ...] -> ([(id, position, style, color), ...], missing count)
+
+    Raises when classification fails, rather than returning default labels.
+    """
+    from classification import classify_all_attributes_batch, classify_with_confidence_boost_batch
+
+    ids, images, hashes = [], [], []
+    missing = 0
+    for upload_id, image_path, md5_hash in rows:
+        try:
+            with open(image_path, "rb") as f:
+                img = Image.open(io.BytesIO(f.read()))
+                img.load()
+        except Exception:
+            missing += 1
+            continue
+        ids.append(upload_id)
+        images.append(img)
+        hashes.append(md5_hash)
+
+    if not images:
+        return [], missing
+    if mode == "enhanced":
+        labels = classify_with_confidence_boost_batch(images, hashes, strict=True)
+    else:
+        labels = classify_all_attributes_batch(images, hashes, strict=True)
+    return [(i, c["position"], c["style"], c["color"]) for i, c in zip(ids, labels)], missing
+
+
+# -----------------------------
+# JOB
+# -----------------------------
+def _batches(read_conn, last_id, batch_size):
+    """Stream rows after last_id in id order through a server-side cursor"""
+    with read_conn.cursor(name="reclassify_uploads") as cur:
+        cur.itersize = batch_size
+        cur.execute(
+            "SELECT id, username, image_path, md5_hash, position, style, color "
+            "FROM uploads WHERE id > %s ORDER BY id",
+            (last_id,)
+        )
+        batch = []
+        for row in cur:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _write_batch(write_conn, batch, labels):
+    """Bulk-update changed labels in uploads and the chatbot indexes; returns rows changed"""
+    old = {r[0]: r for r in batch}
+    changed = [
+        (upload_id, position, style, color)
+        for upload_id, position, style, color in labels
+        if (old[upload_id][4], old[upload_id][5], old[upload_id][6]) != (position, style, color)
+    ]
+    if not changed:
+        return 0
+
+    with write_conn.cursor() as cur:
+        execute_values(
+            cur,
+            "UPDATE uploads AS u SET position = v.position, style = v.style, color = v.color "
+            "FROM (VALUES %s) AS v(id, position, style, color) WHERE u.id = v.id",
+            changed, page_size=len(changed)
+        )
+    write_conn.commit()
+
+    from per_user_index import set_items_attributes
+
+    by_user = defaultdict(dict)
+    for upload_id, position, style, color in changed:
+        _, username, image_path = old[upload_id][:3]
+        by_user[username][image_path] = {"position": position, "style": style, "color": color}
+    for username, updates in by_user.items():
+        try:
+            set_items_attributes(username, updates)
+        except Exception as e:
+            print(f"Warning: failed to update index labels for {username}: {e}")
+    return len(changed)
+
+
+def run(mode, workers, batch_size, checkpoint_path, restart=False):
+    checkpoint = {"last_id": 0, "processed": 0, "changed": 0, "missing": 0} if restart \
+        else load_checkpoint(checkpoint_path)
+    if checkpoint.get("mode") not in (None, mode):
+        raise SystemExit(f"Checkpoint was written in '{checkpoint['mode']}' mode; use --restart to start over")
+    checkpoint["mode"] = mode
+
+    read_conn, write_conn = connect(), connect()
+    with write_conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM uploads WHERE id > %s", (checkpoint["last_id"],))
+        remaining = cur.fetchone()[0]
+    print(f"Reclassifying {remaining} uploads ({mode} mode, {workers} workers, "
+          f"resuming after id {checkpoint['last_id']})")
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    ctx = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    done = 0
+
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        # Keep a bounded number of batches in flight and finish them in id order,
+        # so the checkpoint only ever covers fully written batches
+        in_flight = collections.deque()
+        batches = _batches(read_conn, checkpoint["last_id"], batch_size)
+
+        def finish_oldest():
+            nonlocal done
+            batch, rows, result = in_flight.popleft()
+            for attempt in range(BATCH_RETRIES + 1):
+                try:
+                    labels, missing = result.get()
+                    break
+                except Exception as e:
+                    if attempt == BATCH_RETRIES:
+                        raise SystemExit(
+                            f"Batch of ids {batch[0][0]}..{batch[-1][0]} failed {attempt + 1} times ({e}); "
+                            f"stopping with the checkpoint at id {checkpoint['last_id']}. Rerun to resume."
+                        )
+                    print(f"Batch of ids {batch[0][0]}..{batch[-1][0]} failed ({e}), retrying")
+                    result = pool.apply_async(classify_rows, (rows, mode))
+            checkpoint["changed"] += _write_batch(write_conn, batch, labels)
+            checkpoint["processed"] += len(batch)
+            checkpoint["missing"] += missing
+            checkpoint["last_id"] = batch[-1][0]
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            done += len(batch)
+            rate = done / (time.perf_counter() - start)
+            eta = (remaining - done) / rate if rate else 0
+            print(f"{done}/{remaining} rows, {checkpoint['changed']} relabelled, "
+                  f"{rate:.1f} rows/s, ETA {eta / 60:.1f} min")
+
+        for batch in batches:
+            rows = [(r[0], r[2], r[3]) for r in batch]
+            in_flight.append((batch, rows, pool.apply_async(classify_rows, (rows, mode))))
+            if len(in_flight) >= workers * 2:
+                finish_oldest()
+        while in_flight:
+            finish_oldest()
+
+    read_conn.close()
+    write_conn.close()
+    print(f"Done: {checkpoint['processed']} rows processed, {checkpoint['changed']} relabelled, "
+          f"{checkpoint['missing']} images missing")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=["efficient", "enhanced"], default="efficient",
+                        help="classification used by /classify (efficient) or /classify-enhanced")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first row")
+    args = parser.parse_args()
+    run(args.mode, args.workers, args.batch_size, args.checkpoint, args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Incremental reconciliation of the uploads table with the chatbot indexes.
+
+For every user it looks at, the set of uploads rows is compared with the
+user's index metadata by path and content hash (per_user_index.reconcile_user):
+
+- rows with no index item are embedded in one batch and added,
+- index items no uploads row accounts for are removed (chatbot-only images
+  are kept),
+- items whose image moved to a new path with the same hash are re-pointed
+  instead of re-embedded,
+- drifted style/color/position/favorite labels are updated.
+
+A high-water mark is kept in the state file, so a normal run only examines
+users with uploads added since the previous run. It is the largest upload id
+among the rows actually reconciled, held back below the new rows of any user
+that failed, so those users are retried next time. Index writes take the
+same per-user lock as uploads (per_user_index.user_lock), so a reconcile
+never overwrites a concurrent upload or delete.
+--full examines every user, including users whose uploads were all deleted.
+Users are reconciled in parallel by a thread pool.
+
+Usage: python reconciler.py [--full] [--workers 4] [--state reconcile_state.json]
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import time
+
+import psycopg2
+
+DEFAULT_STATE = "reconcile_state.json"
+STAT_KEYS = ("added", "removed", "repointed", "updated", "failed")
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.environ.get("DB_NAME", "loga"),
+        user=os.environ.get("DB_USER", "postgres"),
+        password=os.environ.get("DB_PASSWORD", "loga"),
+        host=os.environ.get("DB_HOST", "localhost"),
+        port=os.environ.get("DB_PORT", "5432"),
+    )
+
+
+# -----------------------------
+# STATE
+# -----------------------------
+def load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"last_id": 0}
+
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+# -----------------------------
+# DATABASE SIDE
+# -----------------------------
+def _users_to_check(cur, last_id, full):
+    if full:
+        from per_user_index import list_indexed_users
+        cur.execute("SELECT DISTINCT username FROM uploads")
+        return sorted({r[0] for r in cur.fetchall()} | set(list_indexed_users()))
+    cur.execute("SELECT DISTINCT username FROM uploads WHERE id > %s", (last_id,))
+    return sorted(r[0] for r in cur.fetchall())
+
+
+def _user_rows(cur, username):
+    cur.execute(
+        "SELECT id, image_path, md5_hash, style, color, position, favorite FROM uploads WHERE username = %s",
+        (username,)
+    )
+    return [
+        {"id": upload_id, "path": path, "image_hash": md5_hash, "style": style, "color": color,
+         "position": position, "favorite": favorite}
+        for upload_id, path, md5_hash, style, color, position, favorite in cur.fetchall()
+    ]
+
+
+# -----------------------------
+# RUN
+# -----------------------------
+def run(full=False, workers=4, state_path=DEFAULT_STATE):
+    from per_user_index import reconcile_user
+
+    state = load_state(state_path)
+    conn = connect()
+    cur = conn.cursor()
+
+    last_id = state["last_id"]
+    users = _users_to_check(cur, last_id, full)
+    scope = "full" if full else f"uploads after id {state['last_id']}"
+    print(f"Reconciling {len(users)} users ({scope}, {workers} workers)")
+
+    totals = dict.fromkeys(STAT_KEYS, 0)
+    start = time.perf_counter()
+    done = 0
+    # From the rows actually read: uploads added during the run are examined next time
+    processed_max = last_id
+    failed_below = None     # smallest new upload id of a user that failed
+
+    def finish(future, username, ids):
+        nonlocal done, processed_max, failed_below
+        done += 1
+        try:
+            stats = future.result()
+        except Exception as e:
+            totals["failed"] += 1
+            print(f"Warning: failed to reconcile {username}: {e}")
+            new_ids = [i for i in ids if i > last_id]
+            if new_ids:
+                failed_below = min(new_ids + ([failed_below] if failed_below is not None else []))
+            return
+        processed_max = max([processed_max] + ids)
+        for key in STAT_KEYS:
+            totals[key] += stats[key]
+        if any(stats.values()):
+            print(f"{username}: {stats}")
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = {}
+        for username in users:
+            rows = _user_rows(cur, username)
+            future = pool.submit(reconcile_user, username, rows)
+            pending[future] = (username, [row["id"] for row in rows])
+            # Bound how many users' rows are held in memory at once
+            if len(pending) >= workers * 2:
+                finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    finish(future, *pending.pop(future))
+        for future in concurrent.futures.as_completed(pending):
+            finish(future, *pending[future])
+
+    conn.close()
+    elapsed = time.perf_counter() - start
+    high_water = processed_max if failed_below is None else max(last_id, min(processed_max, failed_below - 1))
+    state.update(last_id=high_water, last_run=datetime.datetime.now().isoformat(), last_totals=totals)
+    save_state(state_path, state)
+    print(f"Done: {done} users in {elapsed:.1f}s, {totals}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="examine every user, not only those with new uploads")
+    parser.add_argument("--workers", type=int, default=4, help="users reconciled in parallel")
+    parser.add_argument("--state", default=DEFAULT_STATE, help="file holding the high-water mark")
+    args = parser.parse_args()
+    run(args.full, args.workers, args.state)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Admission control: lanes, fast failure and the 503 + Retry-After response
+"""
+import pytest
+from flask import Flask
+
+import admission
+from admission import AdmissionController, Overloaded
+
+
+def test_full_queue_fails_fast():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout_ms=1000,
+                                     reserved_interactive=0)
+    controller.acquire("bulk")
+
+    with pytest.raises(Overloaded) as e:
+        controller.acquire("bulk")
+    assert str(e.value) == "queue full"
+    assert e.value.retry_after >= 1
+
+
+def test_queue_timeout():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout_ms=50,
+                                     reserved_interactive=0)
+    controller.acquire("interactive")
+
+    with pytest.raises(Overloaded, match="queue timeout"):
+        controller.acquire("interactive")
+    assert controller.status()["queued"] == {"interactive": 0, "bulk": 0}
+
+
+def test_reserved_slot_only_admits_interactive():
+    controller = AdmissionController(max_concurrent=2, max_queue=0, queue_timeout_ms=1000,
+                                     reserved_interactive=1)
+    controller.acquire("bulk")
+
+    with pytest.raises(Overloaded):
+        controller.acquire("bulk")
+    controller.acquire("interactive")
+    assert controller.status()["running"] == 2
+
+    controller.release(0.5)
+    controller.release(0.5)
+    assert controller.status()["running"] == 0
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admission, "ENABLED", True)
+    monkeypatch.setattr(admission, "controller", AdmissionController(
+        max_concurrent=1, max_queue=0, queue_timeout_ms=1000, reserved_interactive=0))
+
+    app = Flask(__name__)
+
+    @app.route("/classify", methods=["POST"])
+    @admission.admission_controlled("bulk")
+    def classify():
+        return {"ok": True}
+
+    return app.test_client()
+
+
+def test_admitted_request_releases_its_slot(client):
+    assert client.post("/classify").status_code == 200
+    assert client.post("/classify").status_code == 200
+    assert admission.controller.status()["running"] == 0
+
+
+def test_overloaded_request_gets_503_with_retry_after(client):
+    admission.controller.acquire("bulk")
+
+    response = client.post("/classify")
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.get_json()["retry_after"] == int(response.headers["Retry-After"])
@@ -0,0 +1,67 @@
+"""
+Reference counting in the content-addressed image store (blob_store.py)
+"""
+import os
+
+import pytest
+
+import blob_store
+
+
+@pytest.fixture(autouse=True)
+def store_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "ROOT", str(tmp_path / "uploaded_images"))
+
+
+def test_identical_bytes_share_one_blob():
+    first = blob_store.add(b"image bytes", ".JPG")
+    second = blob_store.add(b"image bytes", ".png")
+
+    assert first == second
+    assert first.endswith(blob_store.content_hash(b"image bytes") + ".jpg")
+    assert blob_store.is_blob(first)
+    assert blob_store.refcount(first) == 2
+
+
+def test_release_deletes_blob_with_last_reference():
+    path = blob_store.add(b"image bytes", ".jpg")
+    blob_store.incref(path)
+
+    assert blob_store.release(path) == 1
+    assert os.path.exists(path)
+    assert blob_store.release(path) == 0
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".refs")
+
+
+def test_add_after_last_release_stores_the_image_again():
+    path = blob_store.add(b"image bytes", ".jpg")
+    blob_store.release(path)
+
+    assert blob_store.add(b"image bytes", ".jpg") == path
+    assert blob_store.refcount(path) == 1
+    with open(path, "rb") as f:
+        assert f.read() == b"image bytes"
+
+
+def test_legacy_file_counts_as_one_reference():
+    os.makedirs(blob_store.ROOT)
+    legacy = os.path.join(blob_store.ROOT, "old.jpg")
+    with open(legacy, "wb") as f:
+        f.write(b"old image")
+
+    assert not blob_store.is_blob(legacy)
+    assert blob_store.refcount(legacy) == 1
+    assert blob_store.release(legacy) == 0
+    assert not os.path.exists(legacy)
+
+
+def test_import_file_moves_without_taking_a_reference(tmp_path):
+    src = tmp_path / "flat.jpg"
+    src.write_bytes(b"flat image")
+
+    path = blob_store.import_file(str(src))
+
+    assert blob_store.is_blob(path)
+    assert not src.exists()
+    assert not os.path.exists(path + ".refs")
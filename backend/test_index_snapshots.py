@@ -0,0 +1,55 @@
+"""
+Publishing and reading versioned index snapshots (index_snapshots.py)
+"""
+import os
+
+import faiss
+import numpy as np
+
+import index_snapshots
+
+
+def _index(rows):
+    idx = faiss.IndexIDMap(faiss.IndexFlatIP(4))
+    idx.add_with_ids(np.eye(4, dtype="float32")[:rows], np.arange(1, rows + 1, dtype="int64"))
+    return idx
+
+
+def test_publish_and_read_back(tmp_path):
+    root = str(tmp_path / "snapshots")
+    meta = {"_next_id": 3, "items": {"1": {"path": "a.jpg"}, "2": {"path": "b.jpg"}}}
+
+    assert index_snapshots.publish("alice", _index(2), meta, root=root) == 1
+
+    manifest = index_snapshots.read_manifest("alice", root)
+    assert manifest["version"] == 1
+    assert manifest["items"] == 2
+    version, idx, read_meta = index_snapshots.SnapshotReader(root, cache_dir="").latest("alice")
+    assert version == 1
+    assert idx.ntotal == 2
+    assert read_meta == meta
+
+
+def test_reader_follows_the_manifest(tmp_path):
+    root = str(tmp_path / "snapshots")
+    reader = index_snapshots.SnapshotReader(root, cache_dir=str(tmp_path / "cache"))
+    assert reader.latest("alice") is None
+
+    index_snapshots.publish("alice", _index(1), {"items": {"1": {}}}, root=root)
+    assert reader.latest("alice")[0] == 1
+    index_snapshots.publish("alice", _index(3), {"items": {"1": {}, "2": {}, "3": {}}}, root=root)
+
+    version, idx, _ = reader.latest("alice")
+    assert version == 2
+    assert idx.ntotal == 3
+    assert os.path.isdir(tmp_path / "cache" / "alice" / "v00000002")
+
+
+def test_old_versions_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_snapshots, "SNAPSHOT_KEEP", 2)
+    root = str(tmp_path / "snapshots")
+    for _ in range(4):
+        index_snapshots.publish("alice", _index(1), {"items": {}}, root=root)
+
+    versions = sorted(name for name in os.listdir(os.path.join(root, "alice")) if name.startswith("v"))
+    assert versions == ["v00000003", "v00000004"]
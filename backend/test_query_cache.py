@@ -0,0 +1,93 @@
+"""
+Query result cache: entries are keyed by the user's index version, so any
+save of the index invalidates them
+"""
+import numpy as np
+import pytest
+
+import per_user_index
+from query_cache import QueryCache, normalize_query
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(per_user_index, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(per_user_index.index_snapshots, "SNAPSHOT_DIR", "")
+    monkeypatch.setattr(per_user_index.index_snapshots, "READER", False)
+    # Never let a stat tick hide a save from the version token
+    monkeypatch.setattr(per_user_index, "_RACY_NS", 10**18)
+
+
+def _save(user_id, items):
+    idx = per_user_index._create_new_index()
+    vecs = np.random.default_rng(0).standard_normal((len(items), per_user_index.FAISS_DIM)).astype("float32")
+    idx.add_with_ids(vecs, np.arange(1, len(items) + 1, dtype="int64"))
+    meta = {"_next_id": len(items) + 1,
+            "items": {str(i): item for i, item in enumerate(items, start=1)}}
+    per_user_index.save_user_index(user_id, idx, meta)
+
+
+def test_normalize_query():
+    assert normalize_query("  Red   DRESS\n") == "red dress"
+
+
+def test_unsaved_index_is_not_cached():
+    cache = QueryCache(max_entries=8)
+    assert cache.key("alice", "red dress", 3) is None
+
+
+def test_equivalent_queries_share_an_entry():
+    _save("alice", [{"path": "a.jpg", "style": "Casual"}])
+    cache = QueryCache(max_entries=8)
+
+    cache.put(cache.key("alice", "Red  dress", 3, {"style": "Casual"}), ["a.jpg"])
+
+    assert cache.get(cache.key("alice", "red dress", 3, {"style": "casual "})) == ["a.jpg"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_saving_the_index_invalidates_entries():
+    _save("alice", [{"path": "a.jpg"}])
+    cache = QueryCache(max_entries=8)
+    old_key = cache.key("alice", "red dress", 3)
+    cache.put(old_key, ["a.jpg"])
+
+    _save("alice", [{"path": "a.jpg"}, {"path": "b.jpg"}])
+    new_key = cache.key("alice", "red dress", 3)
+
+    assert new_key != old_key
+    assert cache.get(new_key) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_other_users_entries_survive_a_save():
+    _save("alice", [{"path": "a.jpg"}])
+    _save("bob", [{"path": "b.jpg"}])
+    cache = QueryCache(max_entries=8)
+    cache.put(cache.key("bob", "shoes", 3), ["b.jpg"])
+
+    _save("alice", [{"path": "a.jpg"}, {"path": "c.jpg"}])
+
+    assert cache.get(cache.key("bob", "shoes", 3)) == ["b.jpg"]
+
+
+def test_least_recently_used_entry_is_evicted():
+    _save("alice", [{"path": "a.jpg"}])
+    cache = QueryCache(max_entries=2)
+    keys = [cache.key("alice", q, 3) for q in ("one", "two", "three")]
+    for key in keys:
+        cache.put(key, [key[1]])
+
+    assert cache.get(keys[0]) is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_cached_index_is_reloaded_after_a_save():
+    _save("alice", [{"path": "a.jpg", "color": "Red"}])
+    idx, meta = per_user_index.load_user_index_for_query("alice")
+    assert idx.ntotal == 1
+    assert "filters" in meta
+
+    _save("alice", [{"path": "a.jpg"}, {"path": "b.jpg"}])
+    idx, meta = per_user_index.load_user_index_for_query("alice")
+    assert idx.ntotal == 2
@@ -0,0 +1,30 @@
+"""
+Checkpointing of the reclassification job (the parts that need no database)
+"""
+import pytest
+
+import reclassify_job
+
+
+def test_missing_checkpoint_starts_from_the_beginning(tmp_path):
+    checkpoint = reclassify_job.load_checkpoint(str(tmp_path / "checkpoint.json"))
+    assert checkpoint == {"last_id": 0, "processed": 0, "changed": 0, "missing": 0}
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = {"last_id": 512, "processed": 512, "changed": 40, "missing": 2, "mode": "efficient"}
+
+    reclassify_job.save_checkpoint(path, checkpoint)
+
+    assert reclassify_job.load_checkpoint(path) == checkpoint
+    assert not (tmp_path / "checkpoint.json.tmp").exists()
+
+
+def test_resuming_in_another_mode_is_refused(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    reclassify_job.save_checkpoint(path, {"last_id": 10, "processed": 10, "changed": 0, "missing": 0,
+                                          "mode": "enhanced"})
+
+    with pytest.raises(SystemExit, match="enhanced"):
+        reclassify_job.run("efficient", workers=1, batch_size=8, checkpoint_path=path)
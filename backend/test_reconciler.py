@@ -0,0 +1,101 @@
+"""
+High-water mark of the incremental reconciler, with the database and the
+index side replaced by fakes
+"""
+import json
+
+import pytest
+
+import per_user_index
+import reconciler
+
+# (id, username) of each uploads row
+UPLOADS = [(1, "alice"), (2, "bob"), (3, "alice"), (4, "carol"), (5, "bob")]
+
+
+class FakeCursor:
+    def execute(self, sql, params=()):
+        if "DISTINCT username" in sql:
+            self.result = sorted({(user,) for upload_id, user in UPLOADS if upload_id > params[0]})
+        else:
+            self.result = [(upload_id, f"{upload_id}.jpg", f"hash{upload_id}", None, None, None, False)
+                           for upload_id, user in UPLOADS if user == params[0]]
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def reconciled(monkeypatch):
+    """Users reconcile_user was called for; users in `failing` raise"""
+    calls = {"users": [], "failing": set()}
+
+    def reconcile_user(user_id, rows):
+        calls["users"].append(user_id)
+        if user_id in calls["failing"]:
+            raise RuntimeError("index unavailable")
+        return dict.fromkeys(reconciler.STAT_KEYS, 0)
+
+    monkeypatch.setattr(reconciler, "connect", FakeConnection)
+    monkeypatch.setattr(per_user_index, "reconcile_user", reconcile_user)
+    return calls
+
+
+def _last_id(path):
+    with open(path) as f:
+        return json.load(f)["last_id"]
+
+
+def test_high_water_is_the_largest_reconciled_id(tmp_path, reconciled):
+    state = str(tmp_path / "state.json")
+
+    reconciler.run(workers=2, state_path=state)
+
+    assert sorted(reconciled["users"]) == ["alice", "bob", "carol"]
+    assert _last_id(state) == 5
+
+
+def test_only_users_with_new_uploads_are_examined(tmp_path, reconciled):
+    state = str(tmp_path / "state.json")
+    reconciler.save_state(state, {"last_id": 3})
+
+    reconciler.run(workers=2, state_path=state)
+
+    assert sorted(reconciled["users"]) == ["bob", "carol"]
+    assert _last_id(state) == 5
+
+
+def test_failed_user_is_retried_next_run(tmp_path, reconciled):
+    state = str(tmp_path / "state.json")
+    reconciler.save_state(state, {"last_id": 2})
+    reconciled["failing"].add("carol")
+
+    totals = reconciler.run(workers=2, state_path=state)
+
+    assert totals["failed"] == 1
+    # carol's new upload is id 4, so the mark stops just below it
+    assert _last_id(state) == 3
+
+    reconciled["users"].clear()
+    reconciled["failing"].clear()
+    reconciler.run(workers=2, state_path=state)
+    assert "carol" in reconciled["users"]
+    assert _last_id(state) == 5
+
+
+def test_failure_never_moves_the_mark_backwards(tmp_path, reconciled):
+    state = str(tmp_path / "state.json")
+    reconciler.save_state(state, {"last_id": 4})
+    reconciled["failing"].add("bob")
+
+    reconciler.run(workers=2, state_path=state)
+
+    assert _last_id(state) == 4